@@ -3,24 +3,140 @@
 实现复杂的转场效果，确保音频正常
 """
 
+import json
 import os
+import subprocess as sp
+import tempfile
+import time
 import uuid
 import numpy as np
+from contextlib import contextmanager, nullcontext
 from typing import List, Dict, Any, Optional
+import proglog
+from PIL import Image
 from moviepy.editor import (
     VideoFileClip, CompositeVideoClip, concatenate_videoclips,
     AudioFileClip, CompositeAudioClip
 )
 from moviepy.video.fx.all import fadein, fadeout, resize
-from moviepy.audio.fx.all import audio_fadein, audio_fadeout
+from moviepy.audio.fx.all import audio_fadein, audio_fadeout, volumex
+
+from logger_config import AppLoggers, log_span, record_span
+from render_profiler import RenderProfiler
+from media_reader import ConformedVideoFileClip
+from render_options import (
+    DEFAULT_FRAME_TRANSPORT, DEFAULT_MP4_LAYOUT, ENGINES, FIT_MODES, FRAME_TRANSPORTS, MP4_LAYOUTS,
+    PREVIEW_HEIGHT, PREVIEW_PADDING_SECONDS, ProgressCallback, parse_clip
+)
+from ffmpeg_engine import (
+    FilterGraphEngine, FilterGraphError, build_rendition_outputs, concat_segments, rendition_path,
+    resolve_ffmpeg_binary, unsupported_transitions
+)
+from render_cost import cached_clip, cached_keyframes, plan_transition_preview
+from audio_analysis import clip_gains
+
+# moviepy 1.0.3 的 resize（缩放转场）使用 Pillow 10 已移除的 Image.ANTIALIAS
+if not hasattr(Image, 'ANTIALIAS'):
+    Image.ANTIALIAS = Image.LANCZOS
+
+logger = AppLoggers.PROCESSOR
+
+# 启用检查点时每个分段的时长（秒），中断后从最后完成的分段继续
+DEFAULT_SEGMENT_SECONDS = 60.0
+
+
+def partial_path(output_path: str) -> str:
+    """写入中的临时文件名（同目录的隐藏文件），完成后原子重命名为 output_path"""
+    directory, filename = os.path.split(output_path)
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(directory, f".{stem}.partial{ext}")
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class _FrameProgressLogger(proglog.ProgressBarLogger):
+    """把 moviepy 逐帧写出的进度条转换为进度回调"""
+
+    def __init__(self, callback: ProgressCallback, stage: str = 'encode'):
+        super().__init__()
+        # 父类的 callback 属性用于消息回调，这里另起名字
+        self.progress_callback = callback
+        self.stage = stage
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != 't' or attr != 'index':
+            return
+        total = self.bars[bar].get('total')
+        if total:
+            self.progress_callback(min(1.0, (value + 1) / total), self.stage)
 
 
 class AdvancedVideoProcessor:
     """高级视频处理器，支持复杂转场效果"""
     
-    def __init__(self, output_dir: str = "outputs"):
+    def __init__(self, output_dir: str = "outputs", profiler: Optional[RenderProfiler] = None,
+                 progress_callback: Optional[ProgressCallback] = None,
+                 checkpoint_dir: Optional[str] = None,
+                 segment_seconds: float = DEFAULT_SEGMENT_SECONDS,
+                 frame_transport: str = DEFAULT_FRAME_TRANSPORT):
+        if frame_transport not in FRAME_TRANSPORTS:
+            raise ValueError(f"不支持的帧传输方式: {frame_transport}")
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
+        # 可选的阶段剖析器，未启用时不做任何逐帧包装
+        self.profiler = profiler
+        # 可选的进度回调，渲染 worker 用它上报任务进度
+        self.progress_callback = progress_callback
+        # 可选的检查点目录：moviepy 引擎按分段编码，已完成的分段在重新运行同一任务时直接复用
+        self.checkpoint_dir = checkpoint_dir
+        self.segment_seconds = segment_seconds
+        # moviepy 引擎的取帧方式，shared_memory 时读取线程把帧提前读入共享内存环形缓冲区（见 frame_transport）
+        self.frame_transport = frame_transport
+        # 最近一次合成的渲染统计，供指标和日志使用
+        self.last_render_stats: Dict[str, Any] = {}
+        self._transition_timings: Dict[str, float] = {}
+        self._transition_frames: Dict[str, int] = {}
+        self._transition_index = 0
+    
+    @contextmanager
+    def _stage(self, name: str, **fields):
+        """阶段上下文：输出耗时 span 日志，启用剖析器时同时计入剖析阶段；返回可补充 span 字段的字典"""
+        with log_span(name, **fields) as span, \
+                (self.profiler.stage(name) if self.profiler is not None else nullcontext()):
+            yield span
+    
+    def _report_progress(self, fraction: float, stage: str) -> None:
+        """上报进度，回调异常不影响渲染"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(fraction, stage)
+        except Exception as e:
+            logger.warning("进度回调失败: %s", e)
+    
+    def _profile_clip(self, clip: VideoFileClip, name: str) -> VideoFileClip:
+        """启用剖析器时，把片段的逐帧取帧计入指定阶段"""
+        return self.profiler.wrap_clip(clip, name) if self.profiler is not None else clip
+    
+    def _track_transition(self, clip: VideoFileClip, transition_type: str) -> VideoFileClip:
+        """包装转场窗口，累计其逐帧渲染耗时和帧数（按转场类型）"""
+        clip = self._profile_clip(clip, f"transition[{self._transition_index}]:{transition_type}")
+        timings = self._transition_timings
+        frames = self._transition_frames
+        
+        def timed_frame(get_frame, t):
+            start = time.perf_counter()
+            frame = get_frame(t)
+            timings[transition_type] = timings.get(transition_type, 0.0) + time.perf_counter() - start
+            frames[transition_type] = frames.get(transition_type, 0) + 1
+            return frame
+        
+        return clip.fl(timed_frame)
     
     def create_fade_transition(self, clip1: VideoFileClip, clip2: VideoFileClip, 
                               duration: float = 1.0) -> List[VideoFileClip]:
@@ -36,7 +152,7 @@ class AdvancedVideoProcessor:
             处理后的视频片段列表
         """
         try:
-            print(f"应用淡入淡出转场，持续时间: {duration}秒")
+            logger.debug("应用淡入淡出转场，持续时间: %s秒", duration)
             
             # 确保转场时间不超过视频长度
             safe_duration = min(duration, clip1.duration * 0.5, clip2.duration * 0.5)
@@ -84,7 +200,7 @@ class AdvancedVideoProcessor:
             return [clip1_processed, clip2_processed]
             
         except Exception as e:
-            print(f"淡入淡出转场失败: {e}")
+            logger.warning("淡入淡出转场失败: %s", e)
             return [clip1, clip2]
     
     def create_crossfade_transition(self, clip1: VideoFileClip, clip2: VideoFileClip, 
@@ -101,7 +217,7 @@ class AdvancedVideoProcessor:
             合成后的视频片段
         """
         try:
-            print(f"应用交叉淡入淡出转场，持续时间: {duration}秒")
+            logger.debug("应用交叉淡入淡出转场，持续时间: %s秒", duration)
             
             # 确保转场时间合理
             safe_duration = min(duration, clip1.duration * 0.3, clip2.duration * 0.3)
@@ -134,6 +250,7 @@ class AdvancedVideoProcessor:
                 clip1_end,
                 clip2_start
             ], size=clip1.size)
+            transition_video = self._track_transition(transition_video, "fade")
             
             # 音频混合
             if clip1_end.audio is not None and clip2_start.audio is not None:
@@ -155,7 +272,7 @@ class AdvancedVideoProcessor:
             return concatenate_videoclips(parts)
             
         except Exception as e:
-            print(f"交叉淡入淡出转场失败: {e}")
+            logger.warning("交叉淡入淡出转场失败: %s", e)
             return concatenate_videoclips([clip1, clip2])
     
     def create_slide_transition(self, clip1: VideoFileClip, clip2: VideoFileClip,
@@ -173,7 +290,7 @@ class AdvancedVideoProcessor:
             合成后的视频片段
         """
         try:
-            print(f"应用滑动转场，方向: {direction}, 持续时间: {duration}秒")
+            logger.debug("应用滑动转场，方向: %s, 持续时间: %s秒", direction, duration)
             
             w, h = clip1.size
             safe_duration = min(duration, clip1.duration * 0.3, clip2.duration * 0.3)
@@ -207,6 +324,7 @@ class AdvancedVideoProcessor:
                 clip1_transition,
                 clip2_animated
             ], size=(w, h))
+            transition_composite = self._track_transition(transition_composite, f"slide_{direction}")
             
             # 处理音频（简单混合）
             if clip1_transition.audio is not None and clip2_transition.audio is not None:
@@ -234,7 +352,7 @@ class AdvancedVideoProcessor:
             return concatenate_videoclips(parts)
             
         except Exception as e:
-            print(f"滑动转场失败: {e}")
+            logger.warning("滑动转场失败: %s", e)
             return concatenate_videoclips([clip1, clip2])
     
     def create_zoom_transition(self, clip1: VideoFileClip, clip2: VideoFileClip,
@@ -252,7 +370,7 @@ class AdvancedVideoProcessor:
             合成后的视频片段
         """
         try:
-            print(f"应用缩放转场，类型: {zoom_type}, 持续时间: {duration}秒")
+            logger.debug("应用缩放转场，类型: %s, 持续时间: %s秒", zoom_type, duration)
             
             safe_duration = min(duration, clip1.duration * 0.3, clip2.duration * 0.3)
             
@@ -301,6 +419,7 @@ class AdvancedVideoProcessor:
                 clip1_zoomed,
                 clip2_zoomed
             ], size=clip1.size)
+            transition_composite = self._track_transition(transition_composite, f"zoom_{zoom_type}")
             
             # 处理音频
             if clip1_transition.audio is not None and clip2_transition.audio is not None:
@@ -327,7 +446,7 @@ class AdvancedVideoProcessor:
             return concatenate_videoclips(parts)
             
         except Exception as e:
-            print(f"缩放转场失败: {e}")
+            logger.warning("缩放转场失败: %s", e)
             return concatenate_videoclips([clip1, clip2])
     
     def apply_transition(self, clip1: VideoFileClip, clip2: VideoFileClip,
@@ -346,7 +465,7 @@ class AdvancedVideoProcessor:
         transition_type = transition_config.get("type", "fade")
         duration = transition_config.get("duration", 1.0)
         
-        print(f"应用转场效果: {transition_type}")
+        logger.debug("应用转场效果: %s", transition_type)
         
         if transition_type == "fade":
             return self.create_crossfade_transition(clip1, clip2, duration)
@@ -364,79 +483,307 @@ class AdvancedVideoProcessor:
             return self.create_zoom_transition(clip1, clip2, "out", duration)
         else:
             # 默认使用简单拼接
-            print(f"未知转场类型 {transition_type}，使用简单拼接")
+            logger.warning("未知转场类型 %s，使用简单拼接", transition_type)
             return concatenate_videoclips([clip1, clip2])
 
     def compose_videos_advanced(self, video_files: List[str], transitions: List[Dict[str, Any]],
-                               output_filename: Optional[str] = None) -> str:
+                               output_filename: Optional[str] = None,
+                               fit_mode: str = 'contain', pad_color: str = 'black',
+                               engine: str = 'moviepy', renditions: Optional[List[int]] = None,
+                               mp4_layout: str = DEFAULT_MP4_LAYOUT,
+                               loudness_target: Optional[float] = None) -> str:
         """
         高级视频合成，支持复杂转场效果
 
         Args:
-            video_files: 视频文件路径列表
+            video_files: 视频文件路径列表，每一项也可以是带裁剪点的 {'file', 'in', 'out'}（见 parse_clip），
+                裁剪在解码器输入端完成，耗时只与保留部分的时长相关
             transitions: 转场配置列表
             output_filename: 输出文件名
+            fit_mode: 尺寸与第一个视频不同时的适配方式 (contain, cover, stretch)
+            pad_color: contain 模式下的填充颜色
+            engine: 渲染引擎 (moviepy, ffmpeg)，ffmpeg 无法表达的转场自动回退到 moviepy
+            renditions: 额外输出的高度列表（如 [720, 480]），时间线只合成一次，
+                各输出在同一个 ffmpeg 进程中缩放编码，结果见 last_render_stats['renditions']
+            mp4_layout: MP4 封装方式 (faststart, fragmented, standard)，
+                前两种把 moov 放在文件头，预览和下载不必等到文件尾部就能开始播放
+            loudness_target: 目标响度（LUFS），指定时按上传时的响度分析给每个片段加增益，
+                在合成音频时一并应用，增益见 last_render_stats['loudness_gains_db']
 
         Returns:
-            输出文件路径
+            主输出文件路径
+        """
+        options = {'fit_mode': fit_mode, 'pad_color': pad_color, 'engine': engine,
+                   'renditions': list(renditions or []), 'mp4_layout': mp4_layout,
+                   'loudness_target': loudness_target}
+        # 整次合成一个根 span，加载、音频、编码、转场等阶段的 span 挂在它下面
+        with log_span('compose', clips=len(video_files), requested_engine=engine) as span:
+            if self.profiler is None:
+                output_path = self._compose_videos(video_files, transitions, output_filename, **options)
+            else:
+                with self.profiler.session():
+                    output_path = self._compose_videos(video_files, transitions, output_filename, **options)
+                self.last_render_stats['profile'] = self.profiler.report()
+            stats = self.last_render_stats
+            span.update(engine=stats.get('engine'), output_filename=os.path.basename(output_path),
+                        output_frames=stats.get('output_frames'), render_fps=stats.get('render_fps'))
+        return output_path
+
+    def _render_filter_graph(self, video_files: List[str], transitions: List[Dict[str, Any]],
+                             output_path: str, fit_mode: str, pad_color: str,
+                             renditions: List[int], mp4_layout: str,
+                             audio_gains: Optional[List[float]] = None) -> bool:
         """
+        使用 ffmpeg 滤镜图引擎渲染
+
+        Returns:
+            是否渲染成功；False 表示需要回退到 moviepy 引擎
+        """
+        unsupported = unsupported_transitions(transitions)
+        if unsupported:
+            logger.info("ffmpeg 引擎不支持转场 %s，回退到 moviepy 引擎", ", ".join(sorted(set(unsupported))))
+            return False
+
+        if self.checkpoint_dir:
+            logger.info("ffmpeg 引擎为单次滤镜图渲染，不写分段检查点，中断后整体重新渲染")
+        try:
+            with self._stage('ffmpeg'):
+                self.last_render_stats = FilterGraphEngine(mp4_layout=mp4_layout).render(
+                    video_files, transitions, output_path, fit_mode, pad_color,
+                    progress_callback=self._report_progress if self.progress_callback else None,
+                    renditions=renditions, audio_gains=audio_gains
+                )
+        except FilterGraphError as e:
+            logger.warning("ffmpeg 引擎渲染失败，回退到 moviepy 引擎: %s", e)
+            self._remove_outputs(output_path, renditions)
+            return False
+
+        logger.info("视频合成完成 (ffmpeg): %s | 耗时: %.2f秒",
+                    output_path, self.last_render_stats['encode_seconds'])
+        return True
+
+    @staticmethod
+    def _remove_outputs(output_path: str, renditions: List[int]) -> None:
+        for path in [output_path] + [rendition_path(output_path, height) for height in renditions]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _publish_outputs(self, temp_path: str, output_path: str, renditions: List[int]) -> None:
+        """把写完的临时文件原子重命名为最终文件名，/outputs 中不会出现写了一半的视频"""
+        for height in renditions:
+            os.replace(rendition_path(temp_path, height), rendition_path(output_path, height))
+        os.replace(temp_path, output_path)
+        self.last_render_stats['renditions'] = [
+            {'height': height, 'output_path': rendition_path(output_path, height)} for height in renditions
+        ]
+
+    def _encode_frames(self, final_clip, output_path: str, renditions: List[int],
+                       audio_path: Optional[str], mp4_layout: str,
+                       frame_range: Optional[range] = None, frames_total: Optional[int] = None
+                       ) -> List[Dict[str, Any]]:
+        """
+        逐帧合成，原始帧通过管道送入一个 ffmpeg 进程；有额外输出时由 split 分发给各编码器
+
+        Args:
+            frame_range: 只编码这些帧（分段编码时使用），默认全部帧
+            frames_total: 计算进度用的总帧数
+
+        Returns:
+            额外输出列表 [{'height', 'output_path'}]
+        """
+        # 帧时间与 write_videofile/iter_frames 完全一致
+        times = np.arange(0, final_clip.duration, 1.0 / final_clip.fps)
+        frame_range = frame_range if frame_range is not None else range(len(times))
+        frames_total = frames_total or len(times)
+
+        width, height = final_clip.size
+        cmd = [resolve_ffmpeg_binary(), '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-vcodec', 'rawvideo', '-s', f'{width}x{height}',
+               '-pix_fmt', 'rgb24', '-r', '%.02f' % final_clip.fps, '-i', '-']
+        if audio_path:
+            cmd += ['-i', audio_path]
+        chains, output_args, outputs = build_rendition_outputs(
+            '0:v', '1:a' if audio_path else None, output_path, renditions,
+            ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p'] + MP4_LAYOUTS[mp4_layout],
+            ['-c:a', 'aac']
+        )
+        cmd += ['-filter_complex', ';'.join(chains)] + output_args
+
+        # stderr 写到临时文件，避免编码器输出写满管道后阻塞帧写入
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.DEVNULL, stderr=stderr_file)
+            try:
+                for index in frame_range:
+                    frame = final_clip.get_frame(times[index])
+                    if frame.dtype != 'uint8':
+                        frame = frame.astype('uint8')
+                    proc.stdin.write(frame.tobytes())
+                    self._report_progress((index + 1) / frames_total, 'encode')
+            except BrokenPipeError:
+                pass
+            finally:
+                proc.stdin.close()
+                returncode = proc.wait()
+            if returncode != 0:
+                stderr_file.seek(0)
+                raise IOError(f"编码失败: {stderr_file.read().decode('utf8', errors='replace')[-2000:]}")
+        return outputs
+
+    def _write_checkpointed(self, final_clip, output_path: str, renditions: List[int],
+                            audio_path: Optional[str], mp4_layout: str) -> Dict[str, Any]:
+        """
+        按分段编码并记录检查点，最后无损拼接分段并封装音频
+
+        分段边界按帧号划分，每个分段都从关键帧开始，可以直接流复制拼接。
+        检查点目录中的 manifest.json 记录分段划分和已完成的分段；划分不一致（时间线或分段时长变化）时从头开始。
+
+        Returns:
+            {'renditions': 额外输出列表, 'resumed_segments': 复用的分段数}
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        frames_total = len(np.arange(0, final_clip.duration, 1.0 / final_clip.fps))
+        segment_frames = max(1, int(round(self.segment_seconds * final_clip.fps)))
+        layout = {'frames': frames_total, 'segment_frames': segment_frames, 'fps': final_clip.fps,
+                  'size': list(final_clip.size), 'renditions': renditions}
+        manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        manifest = {'layout': layout, 'done': []}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('layout') == layout:
+                manifest = saved
+
+        segments = []
+        resumed = 0
+        for index, start in enumerate(range(0, frames_total, segment_frames)):
+            segment = os.path.join(self.checkpoint_dir, f"segment_{index:05d}.mp4")
+            paths = [segment] + [rendition_path(segment, height) for height in renditions]
+            segments.append(paths)
+            if index in manifest['done'] and all(os.path.exists(path) for path in paths):
+                resumed += 1
+                self._report_progress(min(start + segment_frames, frames_total) / frames_total, 'encode')
+                continue
+
+            # 分段先写临时文件再重命名，中断时不会留下被当作已完成的半截分段
+            partial = partial_path(segment)
+            outputs = self._encode_frames(final_clip, partial, renditions, None, 'standard',
+                                          frame_range=range(start, min(start + segment_frames, frames_total)),
+                                          frames_total=frames_total)
+            os.replace(partial, segment)
+            for output in outputs:
+                os.replace(output['output_path'], rendition_path(segment, output['height']))
+            manifest['done'].append(index)
+            _write_json_atomic(manifest_path, manifest)
+
+        if resumed:
+            logger.info("从检查点继续: 复用 %d/%d 个分段", resumed, len(segments))
+
+        outputs = [{'height': height, 'output_path': rendition_path(output_path, height)} for height in renditions]
+        targets = [output_path] + [output['output_path'] for output in outputs]
+        for position, target in enumerate(targets):
+            concat_segments([paths[position] for paths in segments], target, audio_path, MP4_LAYOUTS[mp4_layout])
+        return {'renditions': outputs, 'resumed_segments': resumed}
+
+    def _compose_videos(self, video_files: List[str], transitions: List[Dict[str, Any]],
+                        output_filename: Optional[str] = None,
+                        fit_mode: str = 'contain', pad_color: str = 'black',
+                        engine: str = 'moviepy', renditions: Optional[List[int]] = None,
+                        mp4_layout: str = DEFAULT_MP4_LAYOUT,
+                        loudness_target: Optional[float] = None) -> str:
+        """compose_videos_advanced 的实现"""
         if not video_files:
             raise ValueError("至少需要一个视频文件")
 
+        if fit_mode not in FIT_MODES:
+            raise ValueError(f"不支持的尺寸适配方式: {fit_mode}")
+
+        if engine not in ENGINES:
+            raise ValueError(f"不支持的渲染引擎: {engine}")
+        if mp4_layout not in MP4_LAYOUTS:
+            raise ValueError(f"不支持的 MP4 封装方式: {mp4_layout}")
+
         if not output_filename:
             output_filename = f"advanced_composed_{uuid.uuid4().hex[:8]}.mp4"
 
         output_path = os.path.join(self.output_dir, output_filename)
+        self.last_render_stats = {}
+        self._transition_timings = {}
+        self._transition_frames = {}
+
+        # 确保转场配置数量正确
+        while len(transitions) < len(video_files) - 1:
+            transitions.append({"type": "fade", "duration": 1.0})
+
+        renditions = list(renditions or [])
+        # 响度归一化的增益来自上传时缓存的分析结果，未缓存时在这里分析一次
+        audio_gains = clip_gains(video_files, loudness_target) if loudness_target is not None else None
+        # 渲染时写入同目录的临时文件，完成后再重命名为最终文件名
+        temp_path = partial_path(output_path)
+        if engine == 'ffmpeg' and self._render_filter_graph(
+                video_files, transitions, temp_path, fit_mode, pad_color, renditions, mp4_layout, audio_gains):
+            if audio_gains is not None:
+                self.last_render_stats['loudness_gains_db'] = audio_gains
+            self._publish_outputs(temp_path, output_path, renditions)
+            return output_path
 
         try:
             # 加载视频片段
-            print(f"加载 {len(video_files)} 个视频文件")
+            # 统一视频尺寸（使用第一个视频的尺寸），尺寸不同的片段由 ffmpeg 在解码时
+            # 按 fit_mode 缩放/加边/裁剪，帧到达 Python 时已是目标尺寸
+            logger.info("加载 %d 个视频文件", len(video_files))
+            self._report_progress(0.0, 'load')
             clips = []
-            for i, video_file in enumerate(video_files):
+            target_size = None
+            for i, entry in enumerate(video_files):
+                video_file, start, end = parse_clip(entry)
                 try:
-                    print(f"正在加载第 {i+1} 个视频: {video_file}")
-                    clip = VideoFileClip(video_file)
+                    logger.debug("正在加载第 %d 个视频: %s", i + 1, video_file)
+                    with self._stage('load', index=i + 1) as span:
+                        # 上传时建立的关键帧索引让转场处和入点的定位从最近的关键帧开始解码
+                        clip = ConformedVideoFileClip(
+                            video_file, target_size=target_size,
+                            fit_mode=fit_mode, pad_color=pad_color,
+                            keyframes=cached_keyframes(video_file),
+                            frame_transport=self.frame_transport,
+                            start=start, end=end
+                        )
+                        # 尺寸不同的片段在解码时缩放，没有单独的缩放阶段
+                        span['resized'] = target_size is not None and tuple(clip.source_size) != target_size
+                    if audio_gains and audio_gains[i] and clip.audio is not None:
+                        clip.audio = clip.audio.fx(volumex, 10 ** (audio_gains[i] / 20))
                     clips.append(clip)
-                    print(f"成功加载视频: {video_file}, 时长: {clip.duration}秒, 尺寸: {clip.size}, 音频: {clip.audio is not None}")
+                    if target_size is None:
+                        target_size = tuple(clip.size)
+                        logger.debug("统一视频尺寸为: %s", target_size)
+                    elif tuple(clip.source_size) != target_size:
+                        logger.debug("第 %d 个视频在解码时从 %s 调整到 %s (%s)",
+                                     i + 1, clip.source_size, target_size, fit_mode)
+                    logger.debug("成功加载视频: %s, 时长: %s秒, 尺寸: %s, 音频: %s",
+                                 video_file, clip.duration, clip.size, clip.audio is not None)
                 except Exception as e:
-                    print(f"加载视频失败: {video_file}, 错误: {str(e)}")
+                    logger.error("加载视频失败: %s, 错误: %s", video_file, e)
                     raise ValueError(f"无法加载视频: {video_file}")
 
             if not clips:
                 raise ValueError("没有成功加载任何视频")
 
-            # 统一视频尺寸（使用第一个视频的尺寸）
-            target_size = clips[0].size
-            print(f"统一视频尺寸为: {target_size}")
-
-            # 调整所有视频到相同尺寸
-            resized_clips = []
-            for i, clip in enumerate(clips):
-                if clip.size != target_size:
-                    print(f"调整第 {i+1} 个视频尺寸从 {clip.size} 到 {target_size}")
-                    resized_clip = clip.resize(target_size)
-                    resized_clips.append(resized_clip)
-                else:
-                    resized_clips.append(clip)
+            resized_clips = [self._profile_clip(clip, 'decode') for clip in clips]
 
             if len(resized_clips) == 1:
                 # 只有一个视频，直接输出
-                print("只有一个视频，直接输出")
+                logger.debug("只有一个视频，直接输出")
                 final_clip = resized_clips[0]
             else:
                 # 应用转场效果
-                print(f"开始应用转场效果，合成 {len(resized_clips)} 个视频片段")
-
-                # 确保转场配置数量正确
-                while len(transitions) < len(resized_clips) - 1:
-                    transitions.append({"type": "fade", "duration": 1.0})
+                logger.info("开始应用转场效果，合成 %d 个视频片段", len(resized_clips))
 
                 # 逐步应用转场效果
                 result_clip = resized_clips[0]
 
                 for i in range(1, len(resized_clips)):
                     transition_config = transitions[i - 1]
-                    print(f"应用第 {i} 个转场: {transition_config}")
+                    logger.debug("应用第 %d 个转场: %s", i, transition_config)
+                    self._transition_index = i
 
                     try:
                         result_clip = self.apply_transition(
@@ -444,18 +791,17 @@ class AdvancedVideoProcessor:
                             resized_clips[i],
                             transition_config
                         )
-                        print(f"第 {i} 个转场应用成功")
+                        logger.debug("第 %d 个转场应用成功", i)
                     except Exception as e:
-                        print(f"第 {i} 个转场应用失败: {e}，使用简单拼接")
+                        logger.warning("第 %d 个转场应用失败: %s，使用简单拼接", i, e)
                         result_clip = concatenate_videoclips([result_clip, resized_clips[i]])
 
                 final_clip = result_clip
 
             # 输出视频
-            print(f"开始输出视频到: {output_path}")
-            print(f"最终视频时长: {final_clip.duration}秒")
-            print(f"最终视频尺寸: {final_clip.size}")
-            print(f"最终视频音频: {final_clip.audio is not None}")
+            logger.info("开始输出视频到: %s | 时长: %s秒 | 尺寸: %s | 音频: %s",
+                        output_path, final_clip.duration, final_clip.size,
+                        final_clip.audio is not None)
 
             # 输出设置
             output_params = {
@@ -463,19 +809,67 @@ class AdvancedVideoProcessor:
                 'verbose': False,
                 'logger': None,
                 'preset': 'medium',  # 平衡质量和速度
-                'ffmpeg_params': ['-crf', '23']  # 控制质量
+                'ffmpeg_params': ['-crf', '23'] + MP4_LAYOUTS[mp4_layout]  # 控制质量和封装方式
             }
+            if self.progress_callback is not None:
+                output_params['logger'] = _FrameProgressLogger(self._report_progress)
 
+            # 音频单独先行写出（每个任务独立的临时文件），再在编码时直接复用
+            temp_audio_path = None
             if final_clip.audio is not None:
-                output_params.update({
-                    'audio_codec': 'aac',
-                    'temp_audiofile': 'temp-audio.m4a',
-                    'remove_temp': True
-                })
+                temp_audio_path = os.path.join(
+                    self.output_dir, f".{os.path.splitext(output_filename)[0]}.audio.m4a"
+                )
+                self._report_progress(0.0, 'audio')
+                with self._stage('audio'):
+                    final_clip.audio.write_audiofile(
+                        temp_audio_path, fps=44100, codec='aac', logger=None
+                    )
+                output_params['audio'] = temp_audio_path
+
+            encode_start = time.perf_counter()
+            resumed_segments = 0
+            try:
+                with self._stage('encode'):
+                    if self.checkpoint_dir:
+                        resumed_segments = self._write_checkpointed(
+                            final_clip, temp_path, renditions, temp_audio_path, mp4_layout)['resumed_segments']
+                    elif renditions:
+                        self._encode_frames(final_clip, temp_path, renditions, temp_audio_path, mp4_layout)
+                    else:
+                        final_clip.write_videofile(temp_path, **output_params)
+            except Exception:
+                self._remove_outputs(temp_path, renditions)
+                raise
+            finally:
+                if temp_audio_path and os.path.exists(temp_audio_path):
+                    os.remove(temp_audio_path)
+            encode_elapsed = time.perf_counter() - encode_start
+            # 转场画面在编码时逐帧合成，耗时按类型累计，作为已结束的 span 输出
+            for transition_type, seconds in self._transition_timings.items():
+                record_span('transition', seconds, type=transition_type,
+                            frames=self._transition_frames.get(transition_type, 0))
 
-            final_clip.write_videofile(output_path, **output_params)
+            output_frames = int(final_clip.duration * final_clip.fps)
+            self.last_render_stats = {
+                'engine': 'moviepy',
+                'output_duration': final_clip.duration,
+                'output_frames': output_frames,
+                'encode_seconds': encode_elapsed,
+                'render_fps': output_frames / encode_elapsed if encode_elapsed > 0 else None,
+                'encode_seconds_per_output_second': (
+                    encode_elapsed / final_clip.duration if final_clip.duration else None
+                ),
+                'transition_seconds': dict(self._transition_timings),
+                'transition_frames': dict(self._transition_frames),
+                'output_size': tuple(final_clip.size),
+                'resumed_segments': resumed_segments,
+            }
+            if audio_gains is not None:
+                self.last_render_stats['loudness_gains_db'] = audio_gains
+            self._publish_outputs(temp_path, output_path, renditions)
 
-            print(f"视频合成完成: {output_path}")
+            logger.info("视频合成完成: %s | 耗时: %.2f秒", output_path, encode_elapsed)
 
             # 清理资源
             for clip in clips:
@@ -488,9 +882,7 @@ class AdvancedVideoProcessor:
             return output_path
 
         except Exception as e:
-            print(f"视频合成过程中出错: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.error("视频合成过程中出错: %s", e, exc_info=True)
 
             # 清理资源
             try:
@@ -510,6 +902,62 @@ class AdvancedVideoProcessor:
 
             raise e
 
+    def render_transition_preview(self, video_files: List[str], transition: Dict[str, Any], output_path: str,
+                                  height: int = PREVIEW_HEIGHT, padding: float = PREVIEW_PADDING_SECONDS,
+                                  fit_mode: str = 'contain', pad_color: str = 'black') -> Dict[str, float]:
+        """
+        只渲染两个片段之间的转场窗口，用于在界面上快速比较转场效果
+
+        两个片段按完整合成的规则拼接（转场时长、画面与完整渲染一致），只取转场前后各 padding 秒编码；
+        片段在解码时即缩放到 height 高度，定位使用关键帧索引，解码量只有窗口附近的几秒。
+
+        Args:
+            video_files: 两个视频文件路径或带裁剪点的片段
+            transition: 转场配置
+            output_path: 预览文件路径（写完后原子重命名）
+            height: 预览高度，宽度按第一个视频的比例计算
+            padding: 转场前后额外渲染的秒数
+
+        Returns:
+            预览在完整时间线上的位置（见 plan_transition_preview）
+        """
+        if len(video_files) != 2:
+            raise ValueError("转场预览需要两个视频文件")
+        if fit_mode not in FIT_MODES:
+            raise ValueError(f"不支持的尺寸适配方式: {fit_mode}")
+
+        sources = [cached_clip(entry) for entry in video_files]
+        window = plan_transition_preview(sources, transition, padding)
+        source_width, source_height = sources[0]['size']
+        target_size = (max(2, int(round(source_width * height / source_height / 2)) * 2), height)
+
+        directory, filename = os.path.split(output_path)
+        stem = f".{os.path.splitext(filename)[0]}.{uuid.uuid4().hex[:8]}"
+        temp_path = os.path.join(directory, f"{stem}.partial.mp4")
+        clips = []
+        try:
+            with self._stage('preview', type=transition.get('type', 'fade'), height=height):
+                for video_file, start, end in map(parse_clip, video_files):
+                    clips.append(ConformedVideoFileClip(
+                        video_file, target_size=target_size, fit_mode=fit_mode, pad_color=pad_color,
+                        keyframes=cached_keyframes(video_file), frame_transport=self.frame_transport,
+                        start=start, end=end
+                    ))
+                composed = self.apply_transition(clips[0], clips[1], transition)
+                preview = composed.subclip(window['start'], window['end'])
+                preview.write_videofile(
+                    temp_path, fps=composed.fps, codec='libx264', preset='ultrafast', audio_codec='aac',
+                    temp_audiofile=os.path.join(directory, f"{stem}.audio.m4a"),
+                    ffmpeg_params=['-crf', '28'] + MP4_LAYOUTS['faststart'], verbose=False, logger=None
+                )
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            for clip in clips:
+                clip.close()
+        return window
+
     def get_video_info(self, video_path: str) -> Dict[str, Any]:
         """获取视频信息"""
         try:
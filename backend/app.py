@@ -1,48 +1,336 @@
 """
 Flask 主应用
 提供视频合成的 REST API 接口
+
+开发环境:  python app.py
+生产环境:  gunicorn -c gunicorn.conf.py wsgi:app
 """
 
 import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
 import uuid
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+from flask import (
+    Flask, Blueprint, current_app, request, jsonify, send_file, send_from_directory, g, Response
+)
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-# from tasks import celery_app, compose_videos_task, get_video_info_task
-from advanced_video_processor import AdvancedVideoProcessor
 from logger_config import (
     setup_logging, AppLoggers, log_request_info, log_response_info,
-    log_file_operation, log_video_processing, log_system_info, log_error
+    log_file_operation, log_video_processing, log_system_info, log_error,
+    bind_log_context, unbind_log_context, log_context
 )
-
-# 初始化日志系统
-setup_logging('INFO')
-
-# 创建 Flask 应用
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB 最大文件大小
-
-# 启用 CORS
-CORS(app)
+from render_profiler import PROFILE_MODES, profile_mode_available
+from render_cost import (
+    RenderCostModel, AdmissionRejected, admission_capacity, admission_decision, cached_clip, cached_probe,
+    plan_transition_preview, reserve_backlog, release_backlog, sync_backlog_seconds
+)
+from render_jobs import (
+    RenderQueue, run_compose_job, publish_outputs, output_filenames, BATCH_JOB_OPTIONS, JOB_OPTIONS, PRIORITIES,
+    DEFAULT_PRIORITY, SUCCESS, FAILURE
+)
+from batch_compose import MAX_BATCH_VARIANTS, VARIANT_OPTIONS, estimate_batch, plan_batch
+from ffmpeg_engine import unsupported_transitions
+from job_store import JobStore, default_owner
+from render_options import (
+    DEFAULT_FRAME_TRANSPORT, DEFAULT_MP4_LAYOUT, ENGINES, FIT_MODES, FRAME_TRANSPORTS, MAX_RENDITIONS, MP4_LAYOUTS,
+    PREVIEW_HEIGHT, PREVIEW_PADDING_SECONDS, RENDITION_HEIGHT_RANGE, is_valid_pad_color, parse_clip, validate_clip
+)
+from metrics import REGISTRY, CONTENT_TYPE_LATEST, AppMetrics, watch_directory, record_upload
+from state_store import configure_state_store
+from transition_preview import TransitionPreviewCache, preview_cache_key
+from webhooks import callback_url_error, configure_callbacks, send_callback
+from audio_analysis import LOUDNESS_TARGET_RANGE, cached_audio_analysis, loudness_summary
+from storage import Storage, configure_storage, localize_clip, media_exists
 
 # 配置目录 - 使用绝对路径
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-OUTPUT_FOLDER = os.path.join(BASE_DIR, 'outputs')
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm'}
 
-# 确保目录存在
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# 可用的转场效果
+TRANSITIONS = [
+    {'type': 'fade', 'name': '淡入淡出', 'description': '平滑的淡入淡出效果'},
+    {'type': 'slide_left', 'name': '左滑', 'description': '从右向左滑动'},
+    {'type': 'slide_right', 'name': '右滑', 'description': '从左向右滑动'},
+    {'type': 'slide_up', 'name': '上滑', 'description': '从下向上滑动'},
+    {'type': 'slide_down', 'name': '下滑', 'description': '从上向下滑动'},
+    {'type': 'zoom_in', 'name': '放大', 'description': '放大转场效果'},
+    {'type': 'zoom_out', 'name': '缩小', 'description': '缩小转场效果'},
+]
+TRANSITION_TYPES = {transition['type'] for transition in TRANSITIONS}
+
+# 文件发送方式：direct 由 Web 进程发送文件内容；x-accel-redirect（nginx）和 x-sendfile（Apache / lighttpd）
+# 只做鉴权和定位，返回响应头后由前置代理发送文件，慢速下载不再占用 Web worker
+FILE_SERVING_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+# x-accel-redirect 的内部路径对应的存储区域和配置的目录
+FILE_SERVING_AREAS = {'uploads': 'UPLOAD_FOLDER', 'outputs': 'OUTPUT_FOLDER'}
+
+# 客户端传入的 X-Request-Id 只接受这些字符，其他情况由服务端生成
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+api = Blueprint('api', __name__)
+
+
+def _resolve_dir(value: str) -> str:
+    """相对路径按 backend 目录解析"""
+    return value if os.path.isabs(value) else os.path.join(BASE_DIR, value)
+
+
+def _parse_size(value: str) -> int:
+    """解析 500MB / 1GB / 字节数 形式的大小"""
+    value = value.strip().upper()
+    for suffix, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def load_config() -> Dict[str, Any]:
+    """从环境变量读取配置"""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-here'),
+        'MAX_CONTENT_LENGTH': _parse_size(os.environ.get('MAX_CONTENT_LENGTH', '500MB')),
+        'UPLOAD_FOLDER': _resolve_dir(os.environ.get('UPLOAD_FOLDER', 'uploads')),
+        'OUTPUT_FOLDER': _resolve_dir(os.environ.get('OUTPUT_FOLDER', 'outputs')),
+        'PROFILE_FOLDER': _resolve_dir(os.environ.get('PROFILE_FOLDER', 'profiles')),
+        # 多 worker 部署时必须使用 sqlite:/// 或 redis:// 共享存储
+        'STATE_STORE_URL': os.environ.get('STATE_STORE_URL', 'memory://'),
+        # 设置后合成任务提交到 Redis 队列，由 render_worker.py 渲染；为空时在 Web 进程内同步渲染
+        'RENDER_QUEUE_URL': os.environ.get('RENDER_QUEUE_URL') or None,
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'INFO'),
+        # 日志格式：text（带颜色的文本）或 json（每行一个 JSON 对象，便于日志管道检索）
+        'LOG_FORMAT': os.environ.get('LOG_FORMAT', 'text'),
+        # 准入控制：积压的预估渲染耗时超过 并行槽位 × 该秒数 时返回 429，0 表示不限制
+        'ADMISSION_MAX_WAIT_SECONDS': float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', '900')),
+        # 未启用渲染队列时本机同时渲染的任务数（用于准入控制）
+        'RENDER_SLOTS': int(os.environ.get('RENDER_SLOTS', '1')),
+        # 仅当前置代理或认证网关会覆盖 X-Client-Id 请求头时才开启，否则客户端可以伪造标识绕过并发上限
+        'TRUST_CLIENT_ID_HEADER': os.environ.get('TRUST_CLIENT_ID_HEADER', '').lower() in ('1', 'true', 'yes'),
+        # 每个 Web 进程同时探测上传文件的线程数（探测在 ffmpeg 子进程中进行，不受 GIL 限制）
+        'UPLOAD_PROBE_WORKERS': int(os.environ.get('UPLOAD_PROBE_WORKERS', '4')),
+        # 同步合成任务的持久化存储（SQLite），Web 进程异常退出后由其他进程从检查点继续
+        'JOB_STORE_PATH': _resolve_dir(os.environ.get('JOB_STORE_PATH', 'var/jobs.db')),
+        # 分段检查点的根目录，为空时使用输出目录下的 .checkpoints；
+        # 渲染 worker 的任务要在另一台机器上续渲时，必须是所有 worker 挂载到相同路径的共享存储
+        'CHECKPOINT_FOLDER': (_resolve_dir(os.environ['CHECKPOINT_FOLDER'])
+                              if os.environ.get('CHECKPOINT_FOLDER') else None),
+        # 检查中断任务的间隔（秒），0 表示不自动接管
+        'JOB_RESUME_INTERVAL': float(os.environ.get('JOB_RESUME_INTERVAL', '30')),
+        # 长轮询任务状态时单个请求最多阻塞的秒数，应小于前置代理的读超时
+        'TASK_WAIT_MAX_SECONDS': float(os.environ.get('TASK_WAIT_MAX_SECONDS', '30')),
+        # 每个 Web 进程同时阻塞等待的长轮询请求数上限，超过时返回 503；
+        # 每个等待占用一个 gunicorn 线程，应小于 GUNICORN_THREADS，给其他请求留出线程
+        'TASK_WAIT_MAX_CONCURRENT': int(os.environ.get('TASK_WAIT_MAX_CONCURRENT', '2')),
+        # 任务结束回调只投递到这些主机（逗号分隔），为空时接受任何解析到公网地址的主机
+        'CALLBACK_ALLOWED_HOSTS': [host for host in os.environ.get('CALLBACK_ALLOWED_HOSTS', '').split(',')
+                                   if host.strip()],
+        # 缓存的转场预览数上限，超过后按最近使用时间淘汰
+        'PREVIEW_CACHE_ENTRIES': int(os.environ.get('PREVIEW_CACHE_ENTRIES', '200')),
+        # moviepy 引擎从解码器取帧的方式（见 FRAME_TRANSPORTS），渲染 worker 使用相同的配置
+        'RENDER_FRAME_TRANSPORT': os.environ.get('RENDER_FRAME_TRANSPORT', DEFAULT_FRAME_TRANSPORT).lower(),
+        # 上传和输出文件的存储：为空时使用本地目录，s3://bucket/prefix?endpoint=... 使用 S3 兼容的对象存储
+        'STORAGE_URL': os.environ.get('STORAGE_URL') or None,
+        # 对象存储中的媒体下载到本机的缓存目录（ffmpeg 读取本地文件）
+        'STORAGE_CACHE_FOLDER': _resolve_dir(os.environ.get('STORAGE_CACHE_FOLDER', 'var/storage_cache')),
+        # 本地存储按文件名哈希分片的目录层数，0 表示不分片
+        'STORAGE_SHARD_DEPTH': int(os.environ.get('STORAGE_SHARD_DEPTH', '2')),
+        # 下载和预览的文件发送方式（见 FILE_SERVING_MODES），前置代理需要配置对应的内部路径
+        'FILE_SERVING': os.environ.get('FILE_SERVING', 'direct').lower(),
+        # x-accel-redirect 的内部路径前缀，之后是 uploads/、outputs/ 或 s3/（对象存储的预签名地址）
+        'FILE_SERVING_PREFIX': os.environ.get('FILE_SERVING_PREFIX', '/protected/'),
+    }
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """
+    创建 Flask 应用
+
+    Args:
+        config: 覆盖环境变量配置的字典
+
+    Returns:
+        Flask 应用实例
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+
+    # 初始化日志系统
+    setup_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+    if app.config['FILE_SERVING'] not in FILE_SERVING_MODES:
+        raise ValueError(f"不支持的文件发送方式: {app.config['FILE_SERVING']}，"
+                         f"可选: {', '.join(FILE_SERVING_MODES)}")
+    if app.config['RENDER_FRAME_TRANSPORT'] not in FRAME_TRANSPORTS:
+        raise ValueError(f"不支持的帧传输方式: {app.config['RENDER_FRAME_TRANSPORT']}，"
+                         f"可选: {', '.join(FRAME_TRANSPORTS)}")
+
+    # 启用 CORS
+    CORS(app)
+
+    # 确保目录存在
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+
+    # 指标等共享状态写入跨进程存储
+    REGISTRY.use_store(configure_state_store(app.config['STATE_STORE_URL']))
+    # 上传和输出文件的存储，渲染 worker 使用相同的配置
+    app.extensions['storage'] = configure_storage(app.config)
+    configure_callbacks(app.config['CALLBACK_ALLOWED_HOSTS'])
+
+    # 登记需要统计磁盘占用的目录
+    watch_directory('uploads', app.config['UPLOAD_FOLDER'])
+    watch_directory('outputs', app.config['OUTPUT_FOLDER'])
+
+    app.extensions['render_queue'] = (
+        RenderQueue(app.config['RENDER_QUEUE_URL']) if app.config['RENDER_QUEUE_URL'] else None
+    )
+
+    # 上传文件的探测线程池，进程内所有请求共用，限制同时运行的 ffmpeg 数量
+    app.extensions['probe_executor'] = ThreadPoolExecutor(
+        max_workers=max(1, app.config['UPLOAD_PROBE_WORKERS']), thread_name_prefix='probe'
+    )
+
+    app.extensions['job_store'] = JobStore(app.config['JOB_STORE_PATH'])
+    # 长轮询的等待名额，进程内所有请求线程共用
+    app.extensions['task_waiters'] = threading.BoundedSemaphore(max(1, app.config['TASK_WAIT_MAX_CONCURRENT']))
+    # 转场预览缓存放在输出目录的隐藏子目录中，不出现在文件列表里
+    app.extensions['preview_cache'] = TransitionPreviewCache(
+        os.path.join(app.config['OUTPUT_FOLDER'], '.previews'), app.config['PREVIEW_CACHE_ENTRIES']
+    )
+    if app.extensions['render_queue'] is None and app.config['JOB_RESUME_INTERVAL'] > 0:
+        _start_resume_thread(app)
+
+    app.register_blueprint(api)
+
+    # 只在主进程中显示系统信息
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        log_system_info(f"上传目录: {app.config['UPLOAD_FOLDER']}")
+        log_system_info(f"输出目录: {app.config['OUTPUT_FOLDER']}")
+        log_system_info(f"最大文件大小: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB")
+        log_system_info(f"状态存储: {app.config['STATE_STORE_URL'].split('@')[-1]}")
+        if app.config['STORAGE_URL']:
+            log_system_info(f"媒体存储: {app.config['STORAGE_URL']}")
+        if app.config['RENDER_QUEUE_URL']:
+            log_system_info(f"渲染队列: {app.config['RENDER_QUEUE_URL'].split('@')[-1]}")
+
+    return app
+
+
+def get_render_queue() -> Optional[RenderQueue]:
+    """当前应用的渲染队列，未配置时为 None"""
+    return current_app.extensions.get('render_queue')
 
-# 只在主进程中显示系统信息
-if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
-    log_system_info(f"上传目录: {UPLOAD_FOLDER}")
-    log_system_info(f"输出目录: {OUTPUT_FOLDER}")
-    log_system_info(f"最大文件大小: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB")
+
+def checkpoint_root(config: Dict[str, Any]) -> str:
+    """分段检查点的根目录（CHECKPOINT_FOLDER，未设置时为输出目录下的隐藏目录），每个任务一个子目录"""
+    return config.get('CHECKPOINT_FOLDER') or os.path.join(config['OUTPUT_FOLDER'], '.checkpoints')
+
+
+def _scratch_dir(output_folder: str, job_id: str) -> str:
+    """同步合成任务的临时目录（隐藏目录，不出现在文件列表中），输出写完后再移入存储"""
+    return os.path.join(output_folder, '.jobs', job_id)
+
+
+def run_persisted_job(app: Flask, job_id: str, payload: Dict[str, Any], owner: str) -> Dict[str, Any]:
+    """
+    在持有租约的情况下执行一个已登记的同步合成任务，结果写回任务存储
+
+    重新执行被中断的任务时复用同一个检查点目录，从最后完成的分段继续；任务结束后删除。
+    """
+    job_store = app.extensions['job_store']
+    scratch_dir = _scratch_dir(app.config['OUTPUT_FOLDER'], job_id)
+    checkpoint_dir = os.path.join(checkpoint_root(app.config), job_id)
+    try:
+        with job_store.lease(job_id, owner):
+            result = run_compose_job(payload, scratch_dir, app.config['PROFILE_FOLDER'],
+                                     checkpoint_dir=checkpoint_dir,
+                                     frame_transport=app.config['RENDER_FRAME_TRANSPORT'])
+            publish_outputs(result, app.extensions['storage']['outputs'])
+    except Exception as e:
+        job_store.fail(job_id, str(e))
+        send_callback(payload.get('callback_url'), job_id, FAILURE, error=str(e))
+        raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    job_store.complete(job_id, result)
+    send_callback(payload.get('callback_url'), job_id, SUCCESS, result=result)
+    return result
+
+
+def resume_interrupted_jobs(app: Flask) -> int:
+    """
+    接管租约已过期的同步合成任务（原 Web 进程已退出）并逐个执行完
+
+    Returns:
+        接管的任务数
+    """
+    job_store = app.extensions['job_store']
+    owner = default_owner()
+    resumed = 0
+    while True:
+        job = job_store.claim_interrupted(owner)
+        if job is None:
+            return resumed
+        resumed += 1
+        with log_context(job_id=job['id']):
+            AppLoggers.COMPOSE.info(f"接管中断的合成任务 | 任务: {job['id']} | 第 {job['attempts']} 次运行")
+            try:
+                run_persisted_job(app, job['id'], job['payload'], owner)
+            except Exception as e:
+                AppLoggers.COMPOSE.error(f"中断的合成任务重新运行失败 | 任务: {job['id']} | {e}")
+
+
+def _start_resume_thread(app: Flask) -> None:
+    def poll():
+        while True:
+            try:
+                resume_interrupted_jobs(app)
+            except Exception as e:
+                log_error("任务恢复", e, "检查中断的合成任务时发生错误")
+            time.sleep(app.config['JOB_RESUME_INTERVAL'])
+
+    threading.Thread(target=poll, name='job-resume', daemon=True).start()
+
+
+def get_client_id() -> str:
+    """
+    提交任务的客户端标识，用于公平调度和单客户端并发上限
+
+    默认使用来源 IP；TRUST_CLIENT_ID_HEADER 开启时使用可信代理写入的 X-Client-Id 请求头
+    """
+    if current_app.config['TRUST_CLIENT_ID_HEADER'] and request.headers.get('X-Client-Id'):
+        return request.headers['X-Client-Id']
+    return request.remote_addr or 'anonymous'
+
+
+def probe_video_info(file_path: str) -> Dict[str, Any]:
+    """
+    读取上传视频的基本信息，建立关键帧索引、计算内容哈希并分析音频响度和波形
+    （写入探测缓存，供后续预估、合成、转场预览和波形接口复用）
+    """
+    try:
+        source = cached_probe(file_path, keyframes=True, digest=True)
+        analysis = cached_audio_analysis(file_path)
+    except Exception as e:
+        return {'error': str(e)}
+    return {
+        'duration': source['duration'],
+        'size': list(source['size']),
+        'fps': source['fps'],
+        'has_audio': source['has_audio'],
+        'keyframes': len(source['keyframes']),
+        'loudness': loudness_summary(analysis),
+    }
 
 
 def allowed_file(filename):
@@ -50,7 +338,60 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-@app.route('/api/health', methods=['GET'])
+def get_request_id() -> str:
+    """当前请求的 ID：沿用客户端传入的 X-Request-Id，否则由服务端生成"""
+    request_id = request.headers.get('X-Request-Id', '')
+    return request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+
+@api.before_app_request
+def start_request_timer():
+    """记录请求开始时间，并把请求 ID 和接口绑定到本次请求期间的所有日志"""
+    g.request_start = time.perf_counter()
+    g.request_id = get_request_id()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.log_context_token = bind_log_context(request_id=g.request_id, endpoint=endpoint, method=request.method)
+
+
+@api.after_app_request
+def observe_request_latency(response):
+    """按接口记录请求耗时，输出一条带耗时和字节数的访问日志"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        AppMetrics.HTTP_LATENCY.observe(
+            elapsed, endpoint=endpoint, method=request.method, status=str(response.status_code)
+        )
+        # 指标接口抓取频繁，不写访问日志
+        if endpoint != '/metrics':
+            bytes_in = request.content_length or 0
+            bytes_out = response.content_length or 0
+            AppLoggers.API.info(
+                f"{request.method} {request.path} | {response.status_code} | {elapsed * 1000:.1f}ms | "
+                f"入 {bytes_in}B | 出 {bytes_out}B",
+                extra={'fields': {'status': response.status_code, 'latency_ms': round(elapsed * 1000, 3),
+                                  'bytes_in': bytes_in, 'bytes_out': bytes_out}}
+            )
+    if 'request_id' in g:
+        response.headers['X-Request-Id'] = g.request_id
+    return response
+
+
+@api.teardown_app_request
+def unbind_request_context(error=None):
+    token = g.pop('log_context_token', None)
+    if token is not None:
+        unbind_log_context(token)
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标接口（抓取频繁，不写请求日志）"""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE_LATEST)
+
+
+@api.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
     log_request_info('/api/health', 'GET')
@@ -65,20 +406,12 @@ def health_check():
     return jsonify(response_data)
 
 
-@app.route('/api/transitions', methods=['GET'])
+@api.route('/api/transitions', methods=['GET'])
 def get_available_transitions():
     """获取可用的转场效果列表"""
     log_request_info('/api/transitions', 'GET')
 
-    transitions = [
-        {'type': 'fade', 'name': '淡入淡出', 'description': '平滑的淡入淡出效果'},
-        {'type': 'slide_left', 'name': '左滑', 'description': '从右向左滑动'},
-        {'type': 'slide_right', 'name': '右滑', 'description': '从左向右滑动'},
-        {'type': 'slide_up', 'name': '上滑', 'description': '从下向上滑动'},
-        {'type': 'slide_down', 'name': '下滑', 'description': '从上向下滑动'},
-        {'type': 'zoom_in', 'name': '放大', 'description': '放大转场效果'},
-        {'type': 'zoom_out', 'name': '缩小', 'description': '缩小转场效果'},
-    ]
+    transitions = TRANSITIONS
 
     log_response_info('/api/transitions', 200, f"返回{len(transitions)}个转场效果")
     return jsonify({
@@ -87,7 +420,7 @@ def get_available_transitions():
     })
 
 
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/upload', methods=['POST'])
 def upload_video():
     """上传视频文件"""
     try:
@@ -102,37 +435,50 @@ def upload_video():
             log_response_info('/api/upload', 400, "文件列表为空")
             return jsonify({'error': '没有选择文件'}), 400
 
+        # 先检查全部文件格式，避免保存了一部分之后才拒绝
+        for file in files:
+            if not (file and allowed_file(file.filename)):
+                log_file_operation("上传", file.filename, False, "不支持的文件格式")
+                return jsonify({'error': f'不支持的文件格式: {file.filename}'}), 400
+
         AppLoggers.UPLOAD.info(f"开始处理 {len(files)} 个文件")
         uploaded_files = []
+        probes = []
+        executor = current_app.extensions['probe_executor']
+
+        uploads = current_app.extensions['storage']['uploads']
 
         for file in files:
-            if file and allowed_file(file.filename):
-                # 生成安全的文件名
-                original_filename = secure_filename(file.filename)
-                file_extension = original_filename.rsplit('.', 1)[1].lower()
-                unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-
-                # 保存文件
-                file.save(file_path)
-                file_size = os.path.getsize(file_path)
-                log_file_operation("上传", original_filename, True, f"大小: {file_size//1024}KB")
-
-                # 获取视频信息
-                processor = AdvancedVideoProcessor()
-                video_info = processor.get_video_info(file_path)
-                AppLoggers.UPLOAD.info(f"视频信息 | {original_filename} | {video_info.get('duration', 'N/A')}s | {video_info.get('width', 'N/A')}x{video_info.get('height', 'N/A')}")
-
-                uploaded_files.append({
-                    'original_name': original_filename,
-                    'filename': unique_filename,
-                    'path': file_path,
-                    'size': file_size,
-                    'info': video_info
-                })
+            # 生成安全的文件名
+            original_filename = secure_filename(file.filename)
+            file_extension = original_filename.rsplit('.', 1)[1].lower()
+            unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
+
+            # 流式写入存储，对象存储同时在本机缓存中留一份供探测使用
+            save_start = time.perf_counter()
+            file_size = uploads.save_stream(unique_filename, file.stream)
+            file_path = uploads.local_path(unique_filename)
+            record_upload(file_size, time.perf_counter() - save_start)
+            log_file_operation("上传", original_filename, True, f"大小: {file_size//1024}KB")
+
+            # 探测提交到线程池，与后续文件的保存和其他文件的探测并行
+            probes.append(executor.submit(probe_video_info, file_path))
+            uploaded_files.append({
+                'original_name': original_filename,
+                'filename': unique_filename,
+                'path': uploads.locator(unique_filename),
+                'size': file_size,
+            })
+
+        # 按文件收集探测结果，单个文件探测失败只体现在它自己的 info.error 中
+        for uploaded, probe in zip(uploaded_files, probes):
+            video_info = probe.result()
+            uploaded['info'] = video_info
+            if 'error' in video_info:
+                AppLoggers.UPLOAD.warning(f"视频信息读取失败 | {uploaded['original_name']} | {video_info['error']}")
             else:
-                log_file_operation("上传", file.filename, False, "不支持的文件格式")
-                return jsonify({'error': f'不支持的文件格式: {file.filename}'}), 400
+                AppLoggers.UPLOAD.info(f"视频信息 | {uploaded['original_name']} | {video_info['duration']}s | "
+                                       f"{video_info['size'][0]}x{video_info['size'][1]}")
 
         log_response_info('/api/upload', 200, f"成功上传 {len(uploaded_files)} 个文件")
         return jsonify({
@@ -146,7 +492,182 @@ def upload_video():
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
 
-@app.route('/api/compose', methods=['POST'])
+def validate_transition(transition: Any, label: str = '') -> Optional[str]:
+    """校验单个转场配置，label 用于错误信息中指明是哪一个转场"""
+    if not isinstance(transition, dict):
+        return f'{label}转场配置必须是对象'
+    if transition.get('type', 'fade') not in TRANSITION_TYPES:
+        return f"{label}转场类型不支持: {transition.get('type')}"
+    duration = transition.get('duration', 1.0)
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)) or duration <= 0:
+        return f'{label}转场时长必须是正数: {duration}'
+    return None
+
+
+def validate_compose_request(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """校验合成请求参数，返回错误信息，合法时返回 None"""
+    if not data:
+        return '请求数据为空'
+
+    # 尺寸与第一个视频不同时的适配方式：contain 加黑边，cover 裁剪，stretch 拉伸
+    fit_mode = data.get('fit_mode', 'contain')
+    # 渲染引擎：moviepy（默认）或 ffmpeg 单进程滤镜图
+    engine = data.get('engine', 'moviepy')
+    # MP4 封装方式：faststart（默认）/ fragmented 让预览不必等到文件尾部
+    mp4_layout = data.get('mp4_layout', DEFAULT_MP4_LAYOUT)
+    # 渲染队列中的优先级：draft 草稿预览优先于 normal、final 正式导出
+    priority = data.get('priority', DEFAULT_PRIORITY)
+    # 可选的阶段剖析：true 只统计各阶段耗时，"cprofile"/"pyinstrument" 额外导出函数级剖析
+    profile = data.get('profile', False)
+
+    if fit_mode not in FIT_MODES:
+        return f'不支持的尺寸适配方式: {fit_mode}'
+    if not is_valid_pad_color(data.get('pad_color', 'black')):
+        return f"不支持的填充颜色: {data.get('pad_color')}，可用颜色名或 #RRGGBB"
+    if engine not in ENGINES:
+        return f'不支持的渲染引擎: {engine}'
+    if not isinstance(mp4_layout, str) or mp4_layout not in MP4_LAYOUTS:
+        return f"不支持的 MP4 封装方式: {mp4_layout}，可选: {', '.join(MP4_LAYOUTS)}"
+    if priority not in PRIORITIES:
+        return f'不支持的优先级: {priority}'
+    if profile and profile is not True and profile not in PROFILE_MODES:
+        return f'不支持的剖析模式: {profile}'
+    if profile in PROFILE_MODES and not profile_mode_available(profile):
+        return f'剖析模式 {profile} 不可用，服务器未安装 {profile}'
+    if not data.get('video_files'):
+        return '至少需要一个视频文件'
+    if not isinstance(data['video_files'], list):
+        return 'video_files 必须是列表'
+
+    transitions = data.get('transitions') or []
+    if not isinstance(transitions, list):
+        return 'transitions 必须是列表'
+    for index, transition in enumerate(transitions, 1):
+        error = validate_transition(transition, f'第 {index} 个')
+        if error:
+            return error
+
+    # 额外输出的高度列表，如 [720, 480]
+    renditions = data.get('renditions') or []
+    if not isinstance(renditions, list):
+        return 'renditions 必须是列表'
+    if len(renditions) > MAX_RENDITIONS:
+        return f'额外输出最多 {MAX_RENDITIONS} 个'
+    low, high = RENDITION_HEIGHT_RANGE
+    for height in renditions:
+        if isinstance(height, bool) or not isinstance(height, int) or height % 2 or not low <= height <= high:
+            return f'额外输出高度必须是 {low}~{high} 之间的偶数: {height}'
+    if len(set(renditions)) != len(renditions):
+        return '额外输出高度不能重复'
+
+    # 响度归一化的目标响度（LUFS），不指定时保持各片段原始音量
+    loudness_target = data.get('loudness_target')
+    low, high = LOUDNESS_TARGET_RANGE
+    if loudness_target is not None and (isinstance(loudness_target, bool)
+                                        or not isinstance(loudness_target, (int, float))
+                                        or not low <= loudness_target <= high):
+        return f'loudness_target 必须是 {low:g}~{high:g} 之间的响度 (LUFS): {loudness_target}'
+
+    # 任务结束时接收 POST 回调的地址
+    if 'callback_url' in data:
+        error = callback_url_error(data['callback_url'])
+        if error:
+            return error
+
+    return validate_video_files(data['video_files'])
+
+
+def validate_video_files(video_files: List[Any]) -> Optional[str]:
+    """校验 video_files 的每一项（文件路径、存储位置或带裁剪点的片段）并检查文件存在"""
+    for entry in video_files:
+        error = validate_clip(entry)
+        if error:
+            return error
+        video_file = parse_clip(entry)[0]
+        try:
+            exists = media_exists(video_file)
+        except ValueError as e:
+            return str(e)
+        if not exists:
+            log_file_operation("验证", os.path.basename(video_file), False, "文件不存在")
+            return f'视频文件不存在: {video_file}'
+        log_file_operation("验证", os.path.basename(video_file), True, "文件存在")
+    return None
+
+
+def estimate_compose(data: Dict[str, Any]) -> Dict[str, Any]:
+    """估算合成请求的渲染耗时（对象存储中的片段先下载到本机缓存再探测）"""
+    return RenderCostModel().estimate(
+        [localize_clip(entry) for entry in data['video_files']], list(data.get('transitions') or []),
+        engine=data.get('engine', 'moviepy'),
+        renditions=data.get('renditions') or []
+    )
+
+
+def render_slots() -> int:
+    """并行渲染槽位：启用渲染队列时为存活的 worker 数，否则为 RENDER_SLOTS"""
+    render_queue = get_render_queue()
+    if render_queue is not None:
+        return len(render_queue.workers()) or 1
+    return current_app.config['RENDER_SLOTS']
+
+
+def estimate_and_admit(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    估算渲染耗时并按当前积压量给出准入判断（只读，不登记）
+
+    启用渲染队列时积压量取队列中未结束任务的预估耗时之和，否则取本机正在同步渲染的任务。
+    """
+    estimate = estimate_compose(data)
+    render_queue = get_render_queue()
+    backlog = render_queue.backlog_seconds() if render_queue is not None else sync_backlog_seconds()
+    slots = render_slots()
+    admission = admission_decision(estimate['estimated_seconds'], backlog, slots,
+                                   current_app.config['ADMISSION_MAX_WAIT_SECONDS'])
+    admission['slots'] = slots
+    return estimate, admission
+
+
+def reject_compose(estimate: Dict[str, Any], backlog_seconds: float, slots: int, endpoint: str = '/api/compose'):
+    """积压已满时返回 429 和 Retry-After"""
+    admission = admission_decision(estimate['estimated_seconds'], backlog_seconds, slots,
+                                   current_app.config['ADMISSION_MAX_WAIT_SECONDS'])
+    admission['slots'] = slots
+    AppMetrics.COMPOSE_TOTAL.inc(status='rejected')
+    log_response_info(endpoint, 429,
+                      f"积压 {admission['backlog_seconds']:.0f}秒，{admission['retry_after']}秒后重试")
+    response = jsonify({
+        'error': '渲染负载已满，请稍后重试',
+        'retry_after': admission['retry_after'],
+        'estimate': estimate,
+        'admission': admission
+    })
+    response.headers['Retry-After'] = str(admission['retry_after'])
+    return response, 429
+
+
+@api.route('/api/compose/estimate', methods=['POST'])
+def estimate_compose_task():
+    """预估合成耗时（不提交任务），同时返回当前负载下是否会被接受"""
+    data = request.get_json(silent=True)
+    log_request_info('/api/compose/estimate', 'POST')
+
+    error = validate_compose_request(data)
+    if error:
+        log_response_info('/api/compose/estimate', 400, error)
+        return jsonify({'error': error}), 400
+
+    try:
+        estimate, admission = estimate_and_admit(data)
+    except Exception as e:
+        log_error("预估", e, "读取视频信息失败")
+        return jsonify({'error': f'无法读取视频信息: {str(e)}'}), 400
+
+    log_response_info('/api/compose/estimate', 200, f"预估耗时: {estimate['estimated_seconds']:.1f}秒")
+    return jsonify({'status': 'success', 'estimate': estimate, 'admission': admission})
+
+
+@api.route('/api/compose', methods=['POST'])
 def create_compose_task():
     """创建视频合成任务"""
     try:
@@ -155,133 +676,452 @@ def create_compose_task():
                         视频数量=len(data.get('video_files', [])) if data else 0,
                         转场数量=len(data.get('transitions', [])) if data else 0)
 
-        if not data:
-            log_response_info('/api/compose', 400, "请求数据为空")
-            return jsonify({'error': '请求数据为空'}), 400
+        error = validate_compose_request(data)
+        if error:
+            log_response_info('/api/compose', 400, error)
+            return jsonify({'error': error}), 400
 
-        video_files = data.get('video_files', [])
+        video_files = data['video_files']
         transitions = data.get('transitions', [])
-        output_filename = data.get('output_filename')
-
-        if not video_files:
-            log_response_info('/api/compose', 400, "没有提供视频文件")
-            return jsonify({'error': '至少需要一个视频文件'}), 400
 
         AppLoggers.COMPOSE.info(f"开始合成任务 | 视频数量: {len(video_files)} | 转场数量: {len(transitions)}")
 
-        # 验证文件存在
-        for video_file in video_files:
-            if not os.path.exists(video_file):
-                log_file_operation("验证", os.path.basename(video_file), False, "文件不存在")
-                return jsonify({'error': f'视频文件不存在: {video_file}'}), 400
-            else:
-                log_file_operation("验证", os.path.basename(video_file), True, "文件存在")
+        # 按预估耗时做准入控制，积压超过容量时让客户端稍后重试
+        try:
+            estimate = estimate_compose(data)
+        except Exception as e:
+            log_error("预估", e, "读取视频信息失败")
+            return jsonify({'error': f'无法读取视频信息: {str(e)}'}), 400
+
+        payload = {key: data[key] for key in JOB_OPTIONS if key in data}
+        return submit_compose_job(payload, estimate, data.get('priority', DEFAULT_PRIORITY), '/api/compose')
+
+    except Exception as e:
+        log_error("合成", e, "创建合成任务时发生错误")
+        return jsonify({'error': f'创建任务失败: {str(e)}'}), 500
 
-        # 使用高级视频处理器，支持复杂转场效果
-        processor = AdvancedVideoProcessor()
 
+def submit_compose_job(payload: Dict[str, Any], estimate: Dict[str, Any], priority: str, endpoint: str):
+    """
+    按预估耗时做准入控制并提交合成任务（单个合成和批量合成共用）
+
+    配置了渲染队列时提交给渲染 worker，返回 202 和任务 ID；
+    否则登记到任务存储后在本进程同步渲染，返回合成结果
+    """
+    estimated_seconds = estimate['estimated_seconds']
+    slots = render_slots()
+    capacity = admission_capacity(slots, current_app.config['ADMISSION_MAX_WAIT_SECONDS'])
+
+    # 配置了渲染队列时提交给渲染 worker，立即返回任务 ID
+    render_queue = get_render_queue()
+    if render_queue is not None:
         try:
-            log_video_processing("开始合成", f"输出文件: {output_filename or '自动生成'}")
-            output_path = processor.compose_videos_advanced(
-                video_files=video_files,
-                transitions=transitions,
-                output_filename=output_filename
-            )
+            task_id = render_queue.enqueue(payload, client_id=get_client_id(), priority=priority,
+                                           estimated_seconds=estimated_seconds, capacity_seconds=capacity,
+                                           request_id=g.request_id)
+        except AdmissionRejected as e:
+            return reject_compose(estimate, e.backlog_seconds, slots, endpoint)
+        AppMetrics.COMPOSE_QUEUE_DEPTH.inc()
+        AppLoggers.COMPOSE.info(f"任务已入队 | 任务: {task_id} | 客户端: {get_client_id()} | "
+                                f"优先级: {priority} | 预估: {estimated_seconds:.1f}秒 | "
+                                f"等待中: {render_queue.pending_count()}")
+        log_response_info(endpoint, 202, f"任务已入队: {task_id}")
+        return jsonify({
+            'status': 'queued',
+            'task_id': task_id,
+            'status_url': f'/api/task/{task_id}',
+            'estimated_seconds': estimated_seconds
+        }), 202
+
+    # 同步渲染：准入判断和登记原子完成，登记带过期时间，进程被杀时不会永久占用容量
+    reservation_id = uuid.uuid4().hex
+    admitted, backlog = reserve_backlog(reservation_id, estimated_seconds, capacity)
+    if not admitted:
+        return reject_compose(estimate, backlog, slots, endpoint)
+
+    AppMetrics.COMPOSE_QUEUE_DEPTH.inc()
+    # 任务连同完整参数登记到任务存储，进程中途退出时由其他进程接管
+    task_id = uuid.uuid4().hex
+    owner = default_owner()
+    current_app.extensions['job_store'].create(task_id, payload, owner)
+    target = (f"{len(payload['variants'])} 个版本" if 'variants' in payload
+              else payload.get('output_filename') or '自动生成')
+    try:
+        log_video_processing("开始合成", f"任务: {task_id} | 输出文件: {target} | "
+                                     f"预估耗时: {estimated_seconds:.1f}秒")
+        with log_context(job_id=task_id):
+            result = run_persisted_job(current_app._get_current_object(), task_id, payload, owner)
+
+        names = output_filenames(result)
+        for name in names:
+            output_stat = current_app.extensions['storage']['outputs'].stat(name)
+            output_size = output_stat['size'] if output_stat else 0
+            log_video_processing("合成完成", f"输出文件: {name} | 大小: {output_size//1024}KB")
+        log_response_info(endpoint, 200, f"合成成功: {', '.join(names)}")
 
-            output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-            log_video_processing("合成完成", f"输出文件: {os.path.basename(output_path)} | 大小: {output_size//1024}KB")
-            log_response_info('/api/compose', 200, f"合成成功: {os.path.basename(output_path)}")
-
-            return jsonify({
-                'status': 'success',
-                'result': {
-                    'status': 'SUCCESS',
-                    'output_path': output_path,
-                    'output_filename': os.path.basename(output_path),
-                    'message': '视频合成成功完成'
-                }
-            })
+        return jsonify({
+            'status': 'success',
+            'task_id': task_id,
+            'result': result
+        })
 
+    except Exception as e:
+        log_video_processing("合成失败", str(e), False)
+        return jsonify({'error': f'视频合成失败: {str(e)}'}), 500
+
+    finally:
+        release_backlog(reservation_id)
+        AppMetrics.COMPOSE_QUEUE_DEPTH.dec()
+
+
+def validate_batch_request(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    校验批量合成请求，返回错误信息，合法时返回 None
+
+    每个版本与整批共用的参数合并后按单个合成请求校验，另外要求转场都能由 ffmpeg 表达、输出文件名不重复。
+    """
+    if not data:
+        return '请求数据为空'
+    variants = data.get('variants')
+    if not isinstance(variants, list) or not variants:
+        return 'variants 必须是非空列表'
+    if len(variants) > MAX_BATCH_VARIANTS:
+        return f'一次最多合成 {MAX_BATCH_VARIANTS} 个版本'
+
+    shared = {key: data[key] for key in BATCH_JOB_OPTIONS + ('priority',) if key in data and key != 'variants'}
+    names = set()
+    for index, variant in enumerate(variants, 1):
+        if not isinstance(variant, dict):
+            return f'第 {index} 个版本必须是对象'
+        unknown = sorted(set(variant) - set(VARIANT_OPTIONS))
+        if unknown:
+            return f"第 {index} 个版本包含不支持的参数: {', '.join(unknown)}，可选: {', '.join(VARIANT_OPTIONS)}"
+        error = validate_compose_request(dict(shared, **variant))
+        if error:
+            return f'第 {index} 个版本: {error}'
+        unsupported = unsupported_transitions(variant.get('transitions') or [])
+        if unsupported:
+            return f"第 {index} 个版本: 批量合成不支持转场 {', '.join(sorted(set(unsupported)))}"
+        name = variant.get('output_filename')
+        if name is not None:
+            if not isinstance(name, str) or not name or name != os.path.basename(name):
+                return f'第 {index} 个版本: output_filename 必须是文件名: {name}'
+            if name in names:
+                return f'输出文件名重复: {name}'
+            names.add(name)
+    return None
+
+
+def plan_batch_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    """规划批量合成请求的共享工作（对象存储中的片段先下载到本机缓存再探测）"""
+    variants = [dict(variant, video_files=[localize_clip(entry) for entry in variant['video_files']],
+                     output_filename=variant.get('output_filename') or f'variant_{index}.mp4')
+                for index, variant in enumerate(data['variants'], 1)]
+    return plan_batch(variants, data.get('fit_mode', 'contain'), data.get('pad_color', 'black'),
+                      data.get('loudness_target'))
+
+
+@api.route('/api/compose/batch', methods=['POST'])
+def create_batch_compose_task():
+    """
+    批量合成：同一批素材的多个版本（不同顺序、转场、片头）在一个任务中合成
+
+    所有版本共享的片段主体和转场窗口只渲染一次，耗时随唯一内容增长而不是随版本数增长；
+    dry_run 为 true 时只返回共享规划和预估耗时，不提交任务
+    """
+    try:
+        data = request.get_json(silent=True)
+        log_request_info('/api/compose/batch', 'POST',
+                         版本数量=len(data.get('variants') or []) if isinstance(data, dict) else 0)
+
+        error = validate_batch_request(data)
+        if error:
+            log_response_info('/api/compose/batch', 400, error)
+            return jsonify({'error': error}), 400
+
+        try:
+            estimate = estimate_batch(plan_batch_request(data))
         except Exception as e:
-            log_video_processing("合成失败", str(e), False)
-            return jsonify({'error': f'视频合成失败: {str(e)}'}), 500
+            log_error("批量预估", e, "读取视频信息失败")
+            return jsonify({'error': f'无法读取视频信息: {str(e)}'}), 400
+        AppLoggers.COMPOSE.info(f"批量合成 | 版本数量: {estimate['variants']} | "
+                                f"部分: {estimate['pieces_unique']}/{estimate['pieces_total']} | "
+                                f"渲染帧数: {estimate['rendered_frames']}/{estimate['timeline_frames']}")
+        if data.get('dry_run'):
+            log_response_info('/api/compose/batch', 200, f"预估耗时: {estimate['estimated_seconds']:.1f}秒")
+            return jsonify({'status': 'success', 'estimate': estimate})
+
+        payload = {key: data[key] for key in BATCH_JOB_OPTIONS if key in data}
+        # 未指定文件名的版本在提交时确定文件名，任务被接管重新运行时输出不变
+        batch_id = uuid.uuid4().hex[:8]
+        payload['variants'] = [
+            dict(variant, output_filename=variant.get('output_filename') or f'batch_{batch_id}_{index}.mp4')
+            for index, variant in enumerate(data['variants'], 1)
+        ]
+        return submit_compose_job(payload, estimate, data.get('priority', DEFAULT_PRIORITY), '/api/compose/batch')
 
     except Exception as e:
-        log_error("合成", e, "创建合成任务时发生错误")
+        log_error("批量合成", e, "创建批量合成任务时发生错误")
         return jsonify({'error': f'创建任务失败: {str(e)}'}), 500
 
 
-# 简化版本不需要任务状态查询
-# @app.route('/api/task/<task_id>', methods=['GET'])
-# def get_task_status(task_id):
-#     """获取任务状态"""
-#     # 直接返回完成状态，因为我们现在是同步处理
-#     return jsonify({
-#         'state': 'SUCCESS',
-#         'current': 100,
-#         'total': 100,
-#         'status': '完成'
-#     })
-
-
-@app.route('/api/download/<filename>', methods=['GET'])
+def _wait_seconds() -> Optional[float]:
+    """长轮询参数 wait（秒），超过 TASK_WAIT_MAX_SECONDS 时截断；不合法时返回 None"""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return None
+    if not 0 <= wait < float('inf'):
+        return None
+    return min(wait, current_app.config['TASK_WAIT_MAX_SECONDS'])
+
+
+def _wait_for_task(wait_for_change, task_id: str, job: Dict[str, Any],
+                   wait: float) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    长轮询等待任务状态离开 state 参数（默认为当前状态）
+
+    每个等待占用一个请求线程，同时等待的请求数达到 TASK_WAIT_MAX_CONCURRENT 时不再等待，
+    避免少数慢客户端占满线程；状态已经变化时立即返回，不占用名额。
+
+    Returns:
+        (最新的任务状态, 是否因名额已满而拒绝等待)
+    """
+    state = request.args.get('state', job['state'])
+    if job['state'] != state:
+        return job, False
+    waiters = current_app.extensions['task_waiters']
+    if not waiters.acquire(blocking=False):
+        AppMetrics.TASK_WAITS.inc(result='rejected')
+        return job, True
+    AppMetrics.TASK_WAITS.inc(result='waited')
+    try:
+        return wait_for_change(task_id, state, wait), False
+    finally:
+        waiters.release()
+
+
+def _reject_task_wait(task_id: str, job: Dict[str, Any]):
+    """等待名额已满时返回 503 和 Retry-After，附带当前状态"""
+    log_response_info('/api/task', 503, f"同时等待的长轮询已达上限 {current_app.config['TASK_WAIT_MAX_CONCURRENT']}")
+    response = jsonify({'error': '等待任务状态的请求过多，请稍后重试', 'task_id': task_id, 'state': job['state'],
+                        'retry_after': 1})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@api.route('/api/task/<task_id>', methods=['GET'])
+def get_task_status(task_id):
+    """
+    获取任务的状态和进度
+
+    长轮询：带 wait=<秒> 时阻塞到任务状态不再是 state 参数（默认为请求时的状态）或超时后再返回，
+    客户端把上次拿到的状态作为 state 传入，等待期间不产生额外请求。
+    同时等待的请求已达上限时返回 503 和 Retry-After。
+    未启用渲染队列时查询同步合成任务的持久化状态。
+    """
+    wait = _wait_seconds()
+    if wait is None:
+        return jsonify({'error': f"wait 必须是非负数: {request.args.get('wait')}"}), 400
+
+    render_queue = get_render_queue()
+    if render_queue is None:
+        job_store = current_app.extensions['job_store']
+        job = job_store.get(task_id)
+        if job is not None and wait:
+            job, rejected = _wait_for_task(job_store.wait_for_change, task_id, job, wait)
+            if rejected:
+                return _reject_task_wait(task_id, job)
+        if job is None:
+            return jsonify({'error': f'任务不存在: {task_id}'}), 404
+        response = {
+            'task_id': task_id,
+            'state': job['state'],
+            'current': 100 if job['state'] == SUCCESS else 0,
+            'total': 100,
+            'attempts': job['attempts'],
+        }
+        if job['state'] == SUCCESS:
+            response['result'] = job['result']
+        elif job['state'] == FAILURE:
+            response['error'] = job['error']
+        return jsonify(response)
+
+    job = render_queue.get_job(task_id)
+    if job is not None and wait:
+        job, rejected = _wait_for_task(render_queue.wait_for_change, task_id, job, wait)
+        if rejected:
+            return _reject_task_wait(task_id, job)
+    if job is None:
+        return jsonify({'error': f'任务不存在: {task_id}'}), 404
+
+    response = {
+        'task_id': task_id,
+        'state': job['state'],
+        'current': int(job['progress'] * 100),
+        'total': 100,
+        'stage': job['stage'],
+        'priority': job['priority'],
+        'worker': job['worker'],
+        'attempts': job['attempts'],
+        'cancel_requested': job['cancel_requested'],
+    }
+    if job['state'] == 'SUCCESS':
+        response['result'] = job['result']
+    elif job['state'] == 'FAILURE':
+        response['error'] = job['error']
+    return jsonify(response)
+
+
+@api.route('/api/task/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """取消任务：等待中的任务立即移出队列，运行中的任务由 worker 终止渲染进程并清理临时文件"""
+    log_request_info('/api/task/cancel', 'POST', 任务=task_id)
+    render_queue = get_render_queue()
+    if render_queue is None:
+        return jsonify({'error': '未启用渲染队列，合成任务为同步处理'}), 404
+
+    state = render_queue.cancel(task_id)
+    if state is None:
+        log_response_info('/api/task/cancel', 404, f"任务不存在: {task_id}")
+        return jsonify({'error': f'任务不存在: {task_id}'}), 404
+
+    if state == 'CANCELLED':
+        # 等待中的任务不会再被 worker 领取
+        AppMetrics.COMPOSE_QUEUE_DEPTH.dec()
+        AppMetrics.COMPOSE_TOTAL.inc(status='cancelled')
+    elif state != 'CANCELLING':
+        log_response_info('/api/task/cancel', 409, f"任务已结束: {state}")
+        return jsonify({'error': '任务已结束，无法取消', 'state': state}), 409
+
+    log_response_info('/api/task/cancel', 202 if state == 'CANCELLING' else 200, f"{task_id}: {state}")
+    return jsonify({'task_id': task_id, 'state': state}), 202 if state == 'CANCELLING' else 200
+
+
+def attachment_disposition(name: str) -> str:
+    """
+    下载用的 Content-Disposition：filename 为加引号的 ASCII 回退名（转义引号和反斜杠），
+    filename* 为 RFC 5987 的 UTF-8 百分号编码原名，浏览器优先使用后者
+    """
+    fallback = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    fallback = ''.join(ch for ch in fallback if ch.isprintable()).replace('\\', '\\\\').replace('"', '\\"')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def offload_response(path: Optional[str], area: str, mimetype: str, name: str,
+                     as_attachment: bool = False, url: Optional[str] = None) -> Optional[Response]:
+    """
+    按 FILE_SERVING 生成交给前置代理发送文件的空响应，direct 模式或代理无法发送时返回 None
+
+    Args:
+        path: 本地文件路径（对象存储为 None）
+        area: 文件所在的区域（FILE_SERVING_AREAS 的键），决定 x-accel-redirect 的内部路径
+        url: 对象存储的预签名地址，nginx 通过内部路径 s3/ 代理读取；x-sendfile 只能发送本地文件
+    """
+    mode = current_app.config['FILE_SERVING']
+    prefix = current_app.config['FILE_SERVING_PREFIX'].rstrip('/') + '/'
+    if mode == 'x-sendfile' and path is not None:
+        header, target = 'X-Sendfile', os.path.abspath(path)
+    elif mode == 'x-accel-redirect' and path is not None:
+        relative = os.path.relpath(path, current_app.config[FILE_SERVING_AREAS[area]])
+        header, target = 'X-Accel-Redirect', prefix + area + '/' + quote(relative.replace(os.sep, '/'))
+    elif mode == 'x-accel-redirect' and url is not None:
+        # s3/<scheme>/<host>/<bucket>/<key>?<签名参数>，nginx 按这几段拼出代理地址
+        header, target = 'X-Accel-Redirect', prefix + 's3/' + url.replace('://', '/', 1)
+    else:
+        return None
+
+    # 前置代理保留 Content-Type、Content-Disposition 和 Cache-Control，Range 和条件请求由代理处理
+    response = Response(b'', mimetype=mimetype)
+    response.headers[header] = target
+    if as_attachment:
+        response.headers['Content-Disposition'] = attachment_disposition(name)
+    AppMetrics.FILE_TRANSFERS.inc(mode=mode)
+    return response
+
+
+def send_stored_file(storage: Storage, area: str, name: str, mimetype: str,
+                     as_attachment: bool = False) -> Response:
+    """
+    发送存储中的文件
+
+    配置了 FILE_SERVING 时只返回响应头，由前置代理发送文件（见 offload_response）；
+    否则本地存储交给 send_file（支持 Range 和条件请求），对象存储按请求的字节范围流式转发，
+    Web 进程不把整个文件读入内存，浏览器拖动进度条时只取需要的部分。
+    """
+    path = storage.direct_path(name)
+    url = storage.presigned_url(name) if path is None and current_app.config['FILE_SERVING'] == 'x-accel-redirect' \
+        else None
+    offloaded = offload_response(path, area, mimetype, name, as_attachment, url)
+    if offloaded is not None:
+        return offloaded
+    AppMetrics.FILE_TRANSFERS.inc(mode='direct')
+    if path is not None:
+        return send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=name)
+
+    stat = storage.stat(name)
+    if stat is None:
+        raise FileNotFoundError(f"文件不存在: {name}")
+    size = stat['size']
+    byte_range = request.range.range_for_length(size) if request.range else None
+    start, stop = byte_range or (0, size)
+    response = Response(storage.read_range(name, start, stop - start), mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = stop - start
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.last_modified = datetime.fromtimestamp(stat['modified'])
+    if byte_range:
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    if as_attachment:
+        response.headers['Content-Disposition'] = attachment_disposition(name)
+    return response
+
+
+@api.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     """下载合成的视频文件"""
     try:
         log_request_info('/api/download', 'GET', 文件名=filename)
-        file_path = os.path.join(OUTPUT_FOLDER, filename)
+        outputs = current_app.extensions['storage']['outputs']
+        stat = outputs.stat(filename) if filename == os.path.basename(filename) else None
 
-        if not os.path.exists(file_path):
+        if stat is None:
             log_file_operation("下载", filename, False, "文件不存在")
             log_response_info('/api/download', 404, f"文件不存在: {filename}")
             return jsonify({'error': '文件不存在'}), 404
 
-        file_size = os.path.getsize(file_path)
-        log_file_operation("下载", filename, True, f"大小: {file_size//1024}KB")
+        log_file_operation("下载", filename, True, f"大小: {stat['size']//1024}KB")
         log_response_info('/api/download', 200, f"下载文件: {filename}")
 
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='video/mp4'
-        )
+        return send_stored_file(outputs, 'outputs', filename, 'video/mp4', as_attachment=True)
 
     except Exception as e:
         log_error("下载", e, f"下载文件时发生错误: {filename}")
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
 
-@app.route('/api/preview/<filename>', methods=['GET'])
+@api.route('/api/preview/<filename>', methods=['GET'])
 def preview_file(filename):
     """预览视频文件"""
     try:
         log_request_info('/api/preview', 'GET', 文件名=filename)
-
-        # 首先尝试在上传目录中查找文件（原始上传的文件）
-        upload_file_path = os.path.join(UPLOAD_FOLDER, filename)
-        AppLoggers.PREVIEW.info(f"查找文件 | 上传目录 | {filename}")
-        if os.path.exists(upload_file_path):
-            file_size = os.path.getsize(upload_file_path)
-            log_file_operation("预览", filename, True, f"上传目录 | 大小: {file_size//1024}KB")
-            log_response_info('/api/preview', 200, f"预览文件: {filename}")
-            return send_file(upload_file_path, mimetype='video/mp4')
-
-        # 如果上传目录中没有，再尝试输出目录（合成后的文件）
-        output_file_path = os.path.join(OUTPUT_FOLDER, filename)
-        AppLoggers.PREVIEW.info(f"查找文件 | 输出目录 | {filename}")
-        if os.path.exists(output_file_path):
-            file_size = os.path.getsize(output_file_path)
-            log_file_operation("预览", filename, True, f"输出目录 | 大小: {file_size//1024}KB")
-            log_response_info('/api/preview', 200, f"预览文件: {filename}")
-            return send_file(output_file_path, mimetype='video/mp4')
-
-        # 列出目录内容以便调试
-        upload_files = os.listdir(UPLOAD_FOLDER) if os.path.exists(UPLOAD_FOLDER) else []
-        output_files = os.listdir(OUTPUT_FOLDER) if os.path.exists(OUTPUT_FOLDER) else []
-        AppLoggers.PREVIEW.warning(f"文件未找到 | {filename} | 上传目录: {len(upload_files)}个文件 | 输出目录: {len(output_files)}个文件")
-
-        # 两个目录都没有找到文件
+        if filename != os.path.basename(filename):
+            log_response_info('/api/preview', 404, f"文件不存在: {filename}")
+            return jsonify({'error': f'文件不存在: {filename}'}), 404
+
+        # 首先在上传文件中查找（原始上传的文件），再查找输出文件（合成后的文件）
+        for area, label in (('uploads', '上传目录'), ('outputs', '输出目录')):
+            storage = current_app.extensions['storage'][area]
+            AppLoggers.PREVIEW.info(f"查找文件 | {label} | {filename}")
+            stat = storage.stat(filename)
+            if stat is not None:
+                log_file_operation("预览", filename, True, f"{label} | 大小: {stat['size']//1024}KB")
+                log_response_info('/api/preview', 200, f"预览文件: {filename}")
+                return send_stored_file(storage, area, filename, 'video/mp4')
+
+        # 两处都没有找到文件
+        AppLoggers.PREVIEW.warning(f"文件未找到 | {filename}")
         log_response_info('/api/preview', 404, f"文件不存在: {filename}")
         return jsonify({'error': f'文件不存在: {filename}'}), 404
 
@@ -290,35 +1130,138 @@ def preview_file(filename):
         return jsonify({'error': f'预览失败: {str(e)}'}), 500
 
 
-@app.route('/api/files', methods=['GET'])
+def validate_preview_request(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """校验转场预览请求参数，返回错误信息，合法时返回 None"""
+    if not data:
+        return '请求数据为空'
+    video_files = data.get('video_files')
+    if not isinstance(video_files, list) or len(video_files) != 2:
+        return 'video_files 必须是两个视频文件'
+    error = validate_transition(data.get('transition', {}))
+    if error:
+        return error
+    if data.get('fit_mode', 'contain') not in FIT_MODES:
+        return f"不支持的尺寸适配方式: {data.get('fit_mode')}"
+    if not is_valid_pad_color(data.get('pad_color', 'black')):
+        return f"不支持的填充颜色: {data.get('pad_color')}，可用颜色名或 #RRGGBB"
+    height = data.get('height', PREVIEW_HEIGHT)
+    low, high = RENDITION_HEIGHT_RANGE
+    if isinstance(height, bool) or not isinstance(height, int) or height % 2 or not low <= height <= high:
+        return f'预览高度必须是 {low}~{high} 之间的偶数: {height}'
+    return validate_video_files(video_files)
+
+
+@api.route('/api/preview/transition', methods=['POST'])
+def preview_transition():
+    """
+    渲染两个片段之间的转场预览（低分辨率，只包含转场窗口和前后各约 1 秒）
+
+    预览按片段内容哈希和转场配置缓存，同样的组合再次请求时直接返回缓存，
+    响应中的 preview_url 可直接用于 <video> 播放。
+    """
+    data = request.get_json(silent=True)
+    log_request_info('/api/preview/transition', 'POST')
+
+    error = validate_preview_request(data)
+    if error:
+        log_response_info('/api/preview/transition', 400, error)
+        return jsonify({'error': error}), 400
+
+    transition = data.get('transition', {})
+    height = data.get('height', PREVIEW_HEIGHT)
+    fit_mode = data.get('fit_mode', 'contain')
+    pad_color = data.get('pad_color', 'black')
+    try:
+        video_files = [localize_clip(entry) for entry in data['video_files']]
+        sources = [cached_clip(entry, digest=True) for entry in video_files]
+    except Exception as e:
+        log_error("转场预览", e, "读取视频信息失败")
+        return jsonify({'error': f'无法读取视频信息: {str(e)}'}), 400
+
+    key = preview_cache_key([(source['sha256'], source.get('trim_start', 0.0), source['duration'])
+                             for source in sources], transition, height,
+                            PREVIEW_PADDING_SECONDS, fit_mode, pad_color)
+
+    frame_transport = current_app.config['RENDER_FRAME_TRANSPORT']
+
+    def render(path: str) -> None:
+        from advanced_video_processor import AdvancedVideoProcessor
+
+        processor = AdvancedVideoProcessor(output_dir=os.path.dirname(path), frame_transport=frame_transport)
+        processor.render_transition_preview(video_files, transition, path, height=height,
+                                            padding=PREVIEW_PADDING_SECONDS, fit_mode=fit_mode,
+                                            pad_color=pad_color)
+
+    try:
+        _, cached = current_app.extensions['preview_cache'].get_or_render(key, render)
+    except Exception as e:
+        log_error("转场预览", e, "渲染转场预览失败")
+        return jsonify({'error': f'转场预览失败: {str(e)}'}), 500
+
+    log_response_info('/api/preview/transition', 200, f"{'命中缓存' if cached else '已渲染'}: {key[:12]}")
+    return jsonify({
+        'status': 'success',
+        'cached': cached,
+        'preview_url': f'/api/preview/transition/{key}',
+        'window': plan_transition_preview(sources, transition, PREVIEW_PADDING_SECONDS),
+    })
+
+
+@api.route('/api/preview/transition/<key>', methods=['GET'])
+def get_transition_preview(key):
+    """读取缓存的转场预览，内容由键唯一确定，允许客户端长期缓存"""
+    path = current_app.extensions['preview_cache'].lookup(key)
+    if path is None:
+        return jsonify({'error': '预览不存在或已过期'}), 404
+    response = offload_response(path, 'outputs', 'video/mp4', os.path.basename(path))
+    if response is None:
+        AppMetrics.FILE_TRANSFERS.inc(mode='direct')
+        response = send_file(path, mimetype='video/mp4', conditional=True)
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
+
+
+@api.route('/api/waveform/<filename>', methods=['GET'])
+def get_waveform(filename):
+    """
+    读取上传视频的音频波形（峰值 0~255，每秒 peaks_per_second 个点）和响度
+
+    上传时已经分析过的文件直接返回缓存，不再解码音频。
+    """
+    try:
+        file_path = current_app.extensions['storage']['uploads'].local_path(filename)
+    except (FileNotFoundError, ValueError):
+        log_response_info('/api/waveform', 404, f"文件不存在: {filename}")
+        return jsonify({'error': f'文件不存在: {filename}'}), 404
+    try:
+        analysis = cached_audio_analysis(file_path)
+    except Exception as e:
+        log_error("波形", e, f"分析音频失败: {filename}")
+        return jsonify({'error': f'音频分析失败: {str(e)}'}), 500
+
+    response = jsonify({
+        'filename': filename,
+        'has_audio': analysis['has_audio'],
+        'loudness': loudness_summary(analysis),
+        'peaks_per_second': analysis.get('peaks_per_second'),
+        'peaks': analysis.get('peaks', []),
+    })
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+@api.route('/api/files', methods=['GET'])
 def list_files():
     """列出上传和输出的文件"""
     try:
         log_request_info('/api/files', 'GET')
-        upload_files = []
-        output_files = []
-
-        # 列出上传的文件
-        if os.path.exists(UPLOAD_FOLDER):
-            for filename in os.listdir(UPLOAD_FOLDER):
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                if os.path.isfile(file_path):
-                    upload_files.append({
-                        'filename': filename,
-                        'size': os.path.getsize(file_path),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                    })
-
-        # 列出输出的文件
-        if os.path.exists(OUTPUT_FOLDER):
-            for filename in os.listdir(OUTPUT_FOLDER):
-                file_path = os.path.join(OUTPUT_FOLDER, filename)
-                if os.path.isfile(file_path):
-                    output_files.append({
-                        'filename': filename,
-                        'size': os.path.getsize(file_path),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                    })
+        storages = current_app.extensions['storage']
+        # 以 . 开头的是写入中的临时文件和任务目录，存储不会列出
+        upload_files, output_files = [
+            [dict(item, modified=datetime.fromtimestamp(item['modified']).isoformat())
+             for item in sorted(storages[area].list_files(), key=lambda item: item['filename'])]
+            for area in ('uploads', 'outputs')
+        ]
 
         AppLoggers.FILES.info(f"文件列表 | 上传文件: {len(upload_files)}个 | 输出文件: {len(output_files)}个")
         log_response_info('/api/files', 200, f"返回文件列表: 上传{len(upload_files)}个, 输出{len(output_files)}个")
@@ -334,25 +1277,29 @@ def list_files():
         return jsonify({'error': f'获取文件列表失败: {str(e)}'}), 500
 
 
-@app.errorhandler(413)
+@api.app_errorhandler(413)
 def too_large(e):
     """文件过大错误处理"""
-    return jsonify({'error': '文件过大，最大支持 500MB'}), 413
+    max_size_mb = current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'文件过大，最大支持 {max_size_mb}MB'}), 413
 
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(e):
     """404 错误处理"""
     return jsonify({'error': '接口不存在'}), 404
 
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(e):
     """500 错误处理"""
     return jsonify({'error': '服务器内部错误'}), 500
 
 
 if __name__ == '__main__':
+    # 开发服务器（单进程 + 自动重载），生产环境请使用 gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
+
     # 只在主进程中显示启动信息
     if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
         log_system_info("=" * 60)
@@ -365,9 +1312,14 @@ if __name__ == '__main__':
             ("GET", "/api/transitions", "获取转场效果列表"),
             ("POST", "/api/upload", "上传视频文件"),
             ("POST", "/api/compose", "创建合成任务"),
+            ("POST", "/api/compose/estimate", "预估合成耗时"),
+            ("GET", "/api/task/<task_id>", "查询任务状态"),
+            ("POST", "/api/task/<task_id>/cancel", "取消任务"),
             ("GET", "/api/download/<filename>", "下载文件"),
             ("GET", "/api/preview/<filename>", "预览文件"),
-            ("GET", "/api/files", "列出文件")
+            ("POST", "/api/preview/transition", "转场预览"),
+            ("GET", "/api/files", "列出文件"),
+            ("GET", "/metrics", "Prometheus 指标")
         ]
 
         log_system_info("📚 API接口列表:")
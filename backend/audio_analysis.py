@@ -0,0 +1,170 @@
+"""
+音频分析
+上传时把音轨解码一次，同时得到 EBU R128 响度（ffmpeg ebur128 滤镜）和降采样的峰值波形，
+结果与探测信息一样按文件大小和修改时间缓存在共享状态存储中：
+合成时按响度计算每个片段的增益（在唯一的一次音频混合中生效），前端读取波形对齐剪辑点，都不再解码音频。
+
+只依赖标准库和 ffmpeg，API 进程可以直接导入。
+"""
+
+import array
+import os
+import re
+import subprocess as sp
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from ffmpeg_engine import resolve_ffmpeg_binary
+from metrics import record_cache_lookup
+from render_cost import cached_probe
+from render_options import parse_clip
+from state_store import StateStore, get_state_store
+
+# 波形分析使用的采样率（单声道），只用于求峰值，不需要高采样率
+ANALYSIS_SAMPLE_RATE = 8000
+# 每秒的峰值点数，长视频按 MAX_WAVEFORM_PEAKS 降低
+PEAKS_PER_SECOND = 50
+MAX_WAVEFORM_PEAKS = 20000
+# 峰值量化到 0~255
+PEAK_SCALE = 255
+
+# 响度归一化：增益上限（dB），以及增益后真峰值不超过的电平（dBTP），避免削波
+MAX_LOUDNESS_GAIN_DB = 20.0
+TRUE_PEAK_CEILING_DB = -1.0
+# 合成请求 loudness_target 的取值范围（LUFS）
+LOUDNESS_TARGET_RANGE = (-40.0, -5.0)
+
+# ebur128 对静音（低于绝对门限）报告的积分响度
+SILENCE_LUFS = -70.0
+
+AUDIO_CACHE_PREFIX = 'audio:'
+AUDIO_CACHE_TTL = 24 * 3600
+
+_INTEGRATED = re.compile(r'I:\s+(-?[\d.]+|-inf) LUFS')
+_RANGE = re.compile(r'LRA:\s+(-?[\d.]+) LU\b')
+_TRUE_PEAK = re.compile(r'Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+
+def _parse_level(match: Optional[re.Match]) -> Optional[float]:
+    if match is None or match.group(1) == '-inf':
+        return None
+    return float(match.group(1))
+
+
+def analyze_audio(path: str, duration: float) -> Dict[str, Any]:
+    """
+    解码一次音轨（文件需要有音轨），计算响度和峰值波形
+
+    Args:
+        path: 媒体文件路径
+        duration: 媒体时长（秒），用于确定波形点数
+
+    Returns:
+        {'has_audio', 'integrated_lufs', 'loudness_range_lu', 'true_peak_dbfs', 'peaks_per_second', 'peaks'}，
+        静音的响度和真峰值为 None
+    """
+    peaks_per_second = min(PEAKS_PER_SECOND, MAX_WAVEFORM_PEAKS / duration) if duration > 0 else PEAKS_PER_SECOND
+    window = max(1, int(round(ANALYSIS_SAMPLE_RATE / peaks_per_second)))
+    cmd = [resolve_ffmpeg_binary(), '-hide_banner', '-nostats', '-nostdin', '-i', path,
+           '-map', '0:a:0', '-vn',
+           '-af', (f'ebur128=peak=true:framelog=quiet,aresample={ANALYSIS_SAMPLE_RATE},'
+                   'aformat=sample_fmts=s16:channel_layouts=mono'),
+           '-f', 's16le', '-']
+
+    peaks = []
+    # stderr 写到临时文件，避免读取 stdout 期间 stderr 管道写满
+    with tempfile.TemporaryFile() as stderr_file, \
+            sp.Popen(cmd, stdout=sp.PIPE, stderr=stderr_file, stdin=sp.DEVNULL) as proc:
+        carry = b''
+        block = window * 2 * 1024
+        while True:
+            chunk = proc.stdout.read(block)
+            if not chunk:
+                break
+            data = carry + chunk
+            usable = len(data) - len(data) % (window * 2)
+            carry = data[usable:]
+            samples = array.array('h', data[:usable])
+            if sys.byteorder == 'big':
+                samples.byteswap()
+            for start in range(0, len(samples), window):
+                part = samples[start:start + window]
+                peaks.append(max(max(part), -min(part)))
+        if len(carry) >= 2:
+            samples = array.array('h', carry[:len(carry) - len(carry) % 2])
+            if sys.byteorder == 'big':
+                samples.byteswap()
+            peaks.append(max(max(samples), -min(samples)))
+        proc.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode('utf8', errors='ignore')
+    if proc.returncode != 0:
+        raise RuntimeError(f"音频分析失败 (返回码 {proc.returncode}): {stderr[-500:]}")
+
+    integrated = _parse_level(_INTEGRATED.search(stderr))
+    if integrated is not None and integrated <= SILENCE_LUFS:
+        integrated = None
+    return {
+        'has_audio': True,
+        'integrated_lufs': integrated,
+        'loudness_range_lu': _parse_level(_RANGE.search(stderr)),
+        'true_peak_dbfs': _parse_level(_TRUE_PEAK.search(stderr)),
+        'peaks_per_second': ANALYSIS_SAMPLE_RATE / window,
+        'peaks': [min(PEAK_SCALE, peak * PEAK_SCALE // 32767) for peak in peaks],
+    }
+
+
+def _audio_cache_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{AUDIO_CACHE_PREFIX}{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cached_audio_analysis(path: str, store: Optional[StateStore] = None) -> Dict[str, Any]:
+    """
+    带缓存的 analyze_audio，缓存键与探测缓存一样包含文件大小和修改时间
+
+    波形单独存放，不放进探测信息里，预估和合成读取探测缓存时不必解析整条波形。
+    没有音轨的文件返回 {'has_audio': False}。
+    """
+    key = _audio_cache_key(path)
+    store = store or get_state_store()
+    analysis = store.get(key)
+    record_cache_lookup('audio_analysis', analysis is not None)
+    if analysis is None:
+        source = cached_probe(path, store)
+        analysis = analyze_audio(path, source['duration']) if source['has_audio'] else {'has_audio': False}
+        store.set(key, analysis, ttl=AUDIO_CACHE_TTL)
+    return analysis
+
+
+def loudness_summary(analysis: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """分析结果中除波形以外的部分，没有音轨时返回 None"""
+    if not analysis.get('has_audio'):
+        return None
+    return {key: value for key, value in analysis.items() if key not in ('has_audio', 'peaks', 'peaks_per_second')}
+
+
+def loudness_gain_db(analysis: Dict[str, Any], target_lufs: float) -> float:
+    """
+    把片段调整到目标响度所需的增益（dB）
+
+    增益限制在 ±MAX_LOUDNESS_GAIN_DB 之内，提升音量时保证真峰值不超过 TRUE_PEAK_CEILING_DB；
+    没有音轨或静音的片段不调整。
+    """
+    if not analysis.get('has_audio') or analysis.get('integrated_lufs') is None:
+        return 0.0
+    gain = max(-MAX_LOUDNESS_GAIN_DB, min(MAX_LOUDNESS_GAIN_DB, target_lufs - analysis['integrated_lufs']))
+    if gain > 0 and analysis.get('true_peak_dbfs') is not None:
+        gain = max(0.0, min(gain, TRUE_PEAK_CEILING_DB - analysis['true_peak_dbfs']))
+    return gain
+
+
+def clip_gains(video_files: List[Any], target_lufs: float, store: Optional[StateStore] = None) -> List[float]:
+    """
+    每个片段调整到目标响度的增益（dB），顺序与 video_files 一致
+
+    带裁剪点的片段按整个文件的响度计算，上传时的分析结果可以直接复用。
+    """
+    return [round(loudness_gain_db(cached_audio_analysis(parse_clip(entry)[0], store), target_lufs), 2)
+            for entry in video_files]
@@ -0,0 +1,358 @@
+"""
+批量合成
+同一批素材的多个版本（不同顺序、不同转场、不同片头）在一个任务中合成。
+
+每条时间线拆成两类部分：
+    片段主体  一个片段去掉两侧转场窗口后的部分
+    转场窗口  前一个片段的结尾和后一个片段的开头按转场叠加的部分
+部分由源文件、起点、帧数、目标尺寸、帧率和转场等参数唯一确定，相同的部分在整批中只渲染一次；
+各版本再按顺序用 concat 流复制拼接视频，拼接 PCM 音频后统一编码 AAC。
+总耗时随唯一内容的时长增长，而不是随版本数增长。
+
+所有部分使用相同的编码参数，各自从关键帧开始，可以直接拼接。部分的边界按帧对齐，转场时长取整到帧：
+转场时长不是整数帧时（如按片段时长的 30% 截短），每个转场取整带来不到一帧的偏差，
+之后的画面可能比单次 ffmpeg 渲染（FilterGraphEngine）的结果错开一帧。
+转场窗口重叠（片段短于两侧转场之和）的版本无法拆分，整条时间线单独用 FilterGraphEngine 渲染。
+
+不依赖 moviepy/numpy，API 进程可以直接导入做校验和预估。
+"""
+
+import hashlib
+import json
+import os
+import subprocess as sp
+import time
+from typing import Any, Dict, List, Optional
+
+from audio_analysis import clip_gains
+from ffmpeg_engine import (
+    AUDIO_LAYOUT, AUDIO_SAMPLE_RATE, XFADE_TRANSITIONS, FilterGraphEngine, FilterGraphError, concat_segments,
+    resolve_ffmpeg_binary, safe_transition_duration
+)
+from logger_config import AppLoggers
+from render_cost import JOB_OVERHEAD_SECONDS, RenderCostModel, cached_clip
+from render_options import DEFAULT_MP4_LAYOUT, MP4_LAYOUTS, ProgressCallback, build_conform_filter
+from state_store import StateStore
+
+logger = AppLoggers.PROCESSOR
+
+# 一个批量任务最多包含的版本数
+MAX_BATCH_VARIANTS = 50
+# 每个版本可以指定的参数，其余参数（尺寸适配、封装方式、响度等）整批共用
+VARIANT_OPTIONS = ('video_files', 'transitions', 'output_filename')
+
+# 部分的输入多读的帧数：保证按帧截取时有足够的帧，源文件结尾不足时复制最后一帧补齐
+_INPUT_MARGIN_FRAMES = 2
+# 统一各部分的颜色标记：缩放过的片段带有色彩空间标记而转场输出没有，
+# 标记不一致时拼接后的视频流中途变更参数，解码端会重新初始化
+_COLOR_PARAMS = 'setparams=range=unknown:color_primaries=unknown:color_trc=unknown:colorspace=unknown'
+
+
+def piece_key(piece: Dict[str, Any]) -> str:
+    """部分的唯一键：参数相同的部分在整批中只渲染一次"""
+    return hashlib.sha1(json.dumps(piece, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _clip_ref(source: Dict[str, Any], offset: float, gain_db: float) -> Dict[str, Any]:
+    """部分引用的源片段：文件、在文件中的起点（秒）、尺寸、有无音轨和响度增益"""
+    return {
+        'path': source['path'],
+        'start': round(source.get('trim_start', 0.0) + offset, 6),
+        'size': list(source['size']),
+        'has_audio': source['has_audio'],
+        'gain_db': gain_db,
+    }
+
+
+def split_timeline(sources: List[Dict[str, Any]], transitions: List[Dict[str, Any]],
+                   fit_mode: str = 'contain', pad_color: str = 'black',
+                   gains: Optional[List[float]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    把一条时间线拆成按顺序排列的片段主体和转场窗口
+
+    转场时长按合成规则计算（见 safe_transition_duration），再取整到帧；目标尺寸为第一个片段的尺寸，
+    帧率为各片段中最高的帧率，与 FilterGraphEngine 一致。
+
+    Args:
+        sources: cached_clip 的结果列表（带裁剪点时为保留部分）
+        transitions: 转场配置列表，不足时按 1 秒淡入淡出补齐
+        gains: 每个片段的音频增益（dB）
+
+    Returns:
+        部分列表；有片段短于两侧转场窗口之和时返回 None（时间线无法拆分）
+    """
+    size = list(sources[0]['size'])
+    fps = max(source['fps'] for source in sources)
+    gains = gains or [0.0] * len(sources)
+    frames = [int(round(source['duration'] * fps)) for source in sources]
+    common = {'size': size, 'fps': fps, 'fit_mode': fit_mode, 'pad_color': pad_color}
+
+    cuts = []
+    accumulated = sources[0]['duration']
+    for index in range(1, len(sources)):
+        config = transitions[index - 1] if index - 1 < len(transitions) else {}
+        duration = safe_transition_duration(float(config.get('duration', 1.0)), accumulated,
+                                            sources[index]['duration'], fps)
+        cuts.append({'type': XFADE_TRANSITIONS[config.get('type', 'fade')],
+                     'frames': max(1, int(round(duration * fps)))})
+        accumulated = accumulated + sources[index]['duration'] - duration
+
+    pieces = []
+    for index, source in enumerate(sources):
+        head = cuts[index - 1]['frames'] if index else 0
+        tail = cuts[index]['frames'] if index < len(cuts) else 0
+        body = frames[index] - head - tail
+        if body < 0:
+            return None
+        if index:
+            previous = sources[index - 1]
+            pieces.append(dict(common, kind='transition', type=cuts[index - 1]['type'], frames=head, clips=[
+                _clip_ref(previous, (frames[index - 1] - head) / fps, gains[index - 1]),
+                _clip_ref(source, 0.0, gains[index]),
+            ]))
+        if body:
+            pieces.append(dict(common, kind='body', frames=body,
+                               clips=[_clip_ref(source, head / fps, gains[index])]))
+    return pieces
+
+
+def plan_batch(variants: List[Dict[str, Any]], fit_mode: str = 'contain', pad_color: str = 'black',
+               loudness_target: Optional[float] = None, store: Optional[StateStore] = None) -> Dict[str, Any]:
+    """
+    规划一批版本的共享工作
+
+    Args:
+        variants: 版本列表，每项包含 video_files（本地路径或带裁剪点的片段）、transitions 和 output_filename
+        loudness_target: 目标响度（LUFS），指定时按上传时的响度分析给每个片段加增益
+
+    Returns:
+        {'variants': [{'output_filename', 'video_files', 'transitions', 'pieces'（部分键列表，无法拆分时为 None）,
+                       'frames', 'size', 'fps', 'with_audio', 'loudness_gains_db'}],
+         'pieces': {部分键: 部分参数}}，pieces 按首次出现的顺序排列
+    """
+    pieces: Dict[str, Dict[str, Any]] = {}
+    planned = []
+    for variant in variants:
+        video_files = variant['video_files']
+        transitions = list(variant.get('transitions') or [])
+        # 与单次合成一致：转场配置不足时按 1 秒淡入淡出补齐
+        transitions += [{'type': 'fade', 'duration': 1.0}] * (len(video_files) - 1 - len(transitions))
+        sources = [cached_clip(entry, store) for entry in video_files]
+        gains = clip_gains(video_files, loudness_target, store) if loudness_target is not None else None
+        split = split_timeline(sources, transitions, fit_mode, pad_color, gains)
+        keys = None
+        if split is not None:
+            keys = []
+            for piece in split:
+                key = piece_key(piece)
+                pieces.setdefault(key, piece)
+                keys.append(key)
+        fps = max(source['fps'] for source in sources)
+        planned.append({
+            'output_filename': variant['output_filename'],
+            'video_files': video_files,
+            'transitions': transitions,
+            'pieces': keys,
+            'frames': (sum(pieces[key]['frames'] for key in keys) if keys is not None
+                       else _timeline_frames(sources, transitions, fps)),
+            'size': list(sources[0]['size']),
+            'fps': fps,
+            'with_audio': any(source['has_audio'] for source in sources),
+            'loudness_gains_db': gains,
+        })
+    return {'variants': planned, 'pieces': pieces}
+
+
+def _timeline_frames(sources: List[Dict[str, Any]], transitions: List[Dict[str, Any]], fps: float) -> int:
+    accumulated = sources[0]['duration']
+    for index in range(1, len(sources)):
+        config = transitions[index - 1] if index - 1 < len(transitions) else {}
+        accumulated += sources[index]['duration'] - safe_transition_duration(
+            float(config.get('duration', 1.0)), accumulated, sources[index]['duration'], fps)
+    return int(accumulated * fps)
+
+
+def batch_work(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    一批版本的工作量：需要渲染的唯一帧数（无法拆分的版本整条计入）和所有版本的总帧数
+
+    Returns:
+        {'variants', 'pieces_total', 'pieces_unique', 'rendered_frames', 'timeline_frames',
+         'rendered_megapixel_frames'}
+    """
+    rendered = [(piece['frames'], piece['size']) for piece in plan['pieces'].values()]
+    rendered += [(variant['frames'], variant['size']) for variant in plan['variants'] if variant['pieces'] is None]
+    return {
+        'variants': len(plan['variants']),
+        'pieces_total': sum(len(variant['pieces'] or []) for variant in plan['variants']),
+        'pieces_unique': len(plan['pieces']),
+        'rendered_frames': sum(frames for frames, _ in rendered),
+        'timeline_frames': sum(variant['frames'] for variant in plan['variants']),
+        'rendered_megapixel_frames': round(sum(frames * size[0] * size[1] / 1e6 for frames, size in rendered), 3),
+    }
+
+
+def estimate_batch(plan: Dict[str, Any], model: Optional[RenderCostModel] = None) -> Dict[str, Any]:
+    """
+    估算批量合成的耗时：唯一帧按 ffmpeg 引擎的基础速率计，每个部分和每次拼接各计一次进程开销
+
+    Returns:
+        batch_work 的结果加上 estimated_seconds
+    """
+    model = model or RenderCostModel()
+    work = batch_work(plan)
+    processes = work['pieces_unique'] + work['variants']
+    seconds = (processes * JOB_OVERHEAD_SECONDS['ffmpeg']
+               + work['rendered_megapixel_frames'] * model.rates()['base']['ffmpeg'])
+    return dict(work, engine='ffmpeg', estimated_seconds=round(seconds, 3))
+
+
+class BatchRenderer:
+    """按 plan_batch 的规划渲染唯一的部分并拼接出所有版本"""
+
+    def __init__(self, piece_dir: str, mp4_layout: str = DEFAULT_MP4_LAYOUT,
+                 progress_callback: Optional[ProgressCallback] = None):
+        """
+        Args:
+            piece_dir: 部分的存放目录；中断后用同一目录重新运行时，已完成的部分直接复用
+            progress_callback: 可选的进度回调 (完成比例, 阶段)
+        """
+        self.piece_dir = piece_dir
+        self.mp4_layout = mp4_layout
+        self.progress_callback = progress_callback
+        # 部分单独封装为 standard，拼接时再按 mp4_layout 封装
+        self.engine = FilterGraphEngine(mp4_layout='standard')
+
+    def _piece_paths(self, key: str):
+        return os.path.join(self.piece_dir, f"{key}.mp4"), os.path.join(self.piece_dir, f"{key}.wav")
+
+    def build_piece_command(self, piece: Dict[str, Any], video_path: str, audio_path: str) -> List[str]:
+        """
+        生成渲染一个部分的 ffmpeg 命令：视频按帧截取后编码，音频输出为 PCM（拼接后统一编码）
+
+        片段的输入端定位到部分的起点，只解码这一部分；没有音轨的片段补静音。
+        """
+        fps = piece['fps']
+        frames = piece['frames']
+        duration = frames / fps
+        cmd = [resolve_ffmpeg_binary(), '-y', '-loglevel', 'error', '-nostdin']
+        chains = []
+        for index, clip in enumerate(piece['clips']):
+            cmd += ['-ss', f"{clip['start']:.6f}", '-t', f"{(frames + _INPUT_MARGIN_FRAMES) / fps:.6f}",
+                    '-i', clip['path']]
+            conform = build_conform_filter(clip['size'], piece['size'], piece['fit_mode'], piece['pad_color'])
+            chains.append(
+                f"[{index}:v]{conform},setpts=PTS-STARTPTS,settb=AVTB,fps={fps:g},"
+                f"tpad=stop_mode=clone:stop={_INPUT_MARGIN_FRAMES},trim=end_frame={frames},format=yuv420p,"
+                f"{_COLOR_PARAMS}[v{index}]"
+            )
+            if clip['has_audio']:
+                gain = f"volume={clip['gain_db']:.2f}dB," if clip['gain_db'] else ''
+                chains.append(
+                    f"[{index}:a]aformat=sample_rates={AUDIO_SAMPLE_RATE}:channel_layouts={AUDIO_LAYOUT},{gain}"
+                    f"atrim=duration={duration:.6f},asetpts=PTS-STARTPTS,apad=whole_dur={duration:.6f}[a{index}]"
+                )
+            else:
+                chains.append(f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl={AUDIO_LAYOUT},"
+                              f"atrim=duration={duration:.6f}[a{index}]")
+
+        video_label, audio_label = 'v0', 'a0'
+        if piece['kind'] == 'transition':
+            chains.append(f"[v0][v1]xfade=transition={piece['type']}:duration={duration:.6f}:offset=0,"
+                          f"trim=end_frame={frames}[vx]")
+            chains.append(f"[a0][a1]acrossfade=d={duration:.6f}[ax]")
+            video_label, audio_label = 'vx', 'ax'
+
+        return cmd + ['-filter_complex', ';'.join(chains),
+                      '-map', f'[{video_label}]', '-an'] + self.engine.video_args + [video_path] + [
+                      '-map', f'[{audio_label}]', '-c:a', 'pcm_s16le', audio_path]
+
+    def render_piece(self, key: str, piece: Dict[str, Any]) -> bool:
+        """
+        渲染一个部分，先写临时文件再重命名
+
+        Returns:
+            是否实际渲染；已存在（中断前完成）时返回 False
+        """
+        video_path, audio_path = self._piece_paths(key)
+        if os.path.exists(video_path) and os.path.exists(audio_path):
+            return False
+        partial_video = os.path.join(self.piece_dir, f".{key}.partial.mp4")
+        partial_audio = os.path.join(self.piece_dir, f".{key}.partial.wav")
+        result = sp.run(self.build_piece_command(piece, partial_video, partial_audio),
+                        stdout=sp.DEVNULL, stderr=sp.PIPE, stdin=sp.DEVNULL)
+        if result.returncode != 0:
+            for path in (partial_video, partial_audio):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise FilterGraphError(result.stderr.decode('utf8', errors='replace').strip()[-2000:])
+        os.replace(partial_audio, audio_path)
+        os.replace(partial_video, video_path)
+        return True
+
+    def assemble(self, variant: Dict[str, Any], output_path: str) -> None:
+        """按顺序拼接一个版本的部分：视频流复制，PCM 音频拼接后编码为 AAC"""
+        videos, audios = zip(*(self._piece_paths(key) for key in variant['pieces']))
+        audio_path = None
+        if variant['with_audio']:
+            audio_path = f"{output_path}.audio.wav"
+            concat_segments(list(audios), audio_path)
+        try:
+            concat_segments(list(videos), output_path, audio_path, MP4_LAYOUTS[self.mp4_layout],
+                            audio_args=['-c:a', 'aac'])
+        finally:
+            if audio_path and os.path.exists(audio_path):
+                os.remove(audio_path)
+
+    def _report_progress(self, done: int, total: int, stage: str) -> None:
+        if self.progress_callback is not None and total:
+            self.progress_callback(min(1.0, done / total), stage)
+
+    def render(self, plan: Dict[str, Any], output_dir: str,
+               fit_mode: str = 'contain', pad_color: str = 'black') -> Dict[str, Any]:
+        """
+        渲染整批版本，输出写入 output_dir（先写临时文件，完成后重命名为 output_filename）
+
+        Returns:
+            统计信息：batch_work 的结果加上 encode_seconds、reused_pieces，
+            以及 outputs（每个版本的 output_path、output_duration）
+        """
+        os.makedirs(self.piece_dir, exist_ok=True)
+        work = batch_work(plan)
+        total = work['rendered_frames']
+        done = 0
+        reused = 0
+        start = time.perf_counter()
+
+        for key, piece in plan['pieces'].items():
+            if not self.render_piece(key, piece):
+                reused += 1
+            done += piece['frames']
+            self._report_progress(done, total, 'encode')
+        if reused:
+            logger.info("批量合成从中断处继续: 复用 %d/%d 个部分", reused, len(plan['pieces']))
+
+        outputs = []
+        for variant in plan['variants']:
+            output_path = os.path.join(output_dir, variant['output_filename'])
+            temp_path = os.path.join(output_dir, f".{variant['output_filename']}.partial.mp4")
+            try:
+                if variant['pieces'] is None:
+                    # 转场窗口重叠，整条时间线单独渲染
+                    FilterGraphEngine(mp4_layout=self.mp4_layout).render(
+                        variant['video_files'], variant['transitions'], temp_path, fit_mode, pad_color,
+                        audio_gains=variant['loudness_gains_db'])
+                    done += variant['frames']
+                    self._report_progress(done, total, 'encode')
+                else:
+                    self.assemble(variant, temp_path)
+                os.replace(temp_path, output_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            outputs.append({'output_path': output_path, 'output_duration': variant['frames'] / variant['fps']})
+
+        elapsed = time.perf_counter() - start
+        logger.info("批量合成完成: %d 个版本 | 部分 %d 个（去重前 %d 个）| 耗时: %.2f秒",
+                    work['variants'], work['pieces_unique'], work['pieces_total'], elapsed)
+        return dict(work, engine='ffmpeg', encode_seconds=elapsed, reused_pieces=reused, outputs=outputs)
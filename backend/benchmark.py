@@ -0,0 +1,272 @@
+"""
+离线渲染基准测试
+使用 ffmpeg lavfi（testsrc2/sine）在本地生成合成测试素材，
+按转场类型和片段数量计时 compose_videos_advanced，并以 JSON 输出结果。
+
+用法示例:
+    python benchmark.py --resolutions 640x360,1280x720 --durations 5 \\
+        --clip-counts 2,4 --transitions fade,slide_left --output bench.json
+    python benchmark.py --compare bench_old.json --output bench_new.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ALL_TRANSITIONS = ['fade', 'slide_left', 'slide_right', 'slide_up', 'slide_down', 'zoom_in', 'zoom_out']
+
+
+def get_ffmpeg_binary() -> str:
+    """与 moviepy 使用同一个 ffmpeg 可执行文件"""
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def generate_clip(work_dir: str, width: int, height: int, duration: float,
+                  fps: int = 25, index: int = 0) -> str:
+    """生成一段带正弦音频的测试视频，已存在则直接复用"""
+    filename = f"synthetic_{width}x{height}_{duration:g}s_{fps}fps_{index}.mp4"
+    path = os.path.join(work_dir, filename)
+    if os.path.exists(path):
+        return path
+
+    # 不同 index 使用不同的测试图样和音高，避免片段完全相同
+    pattern = 'testsrc2' if index % 2 == 0 else 'smptebars'
+    frequency = 220 * (index + 1)
+    cmd = [
+        get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'{pattern}=size={width}x{height}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency={frequency}:sample_rate=44100:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', path
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def _max_rss_bytes(who: int) -> int:
+    """ru_maxrss 在 Linux 上单位为 KB，在 macOS 上为字节"""
+    value = resource.getrusage(who).ru_maxrss
+    return value if sys.platform == 'darwin' else value * 1024
+
+
+def _run_case_in_child(case: Dict[str, Any], result_queue) -> None:
+    """在独立进程中运行单个用例，保证峰值内存互不影响"""
+    if hasattr(os, 'setpgrp'):
+        # 独立进程组，超时时连同 ffmpeg 读取进程一起终止
+        os.setpgrp()
+    sys.path.insert(0, BASE_DIR)
+    from advanced_video_processor import AdvancedVideoProcessor
+
+    try:
+        processor = AdvancedVideoProcessor(output_dir=case['output_dir'])
+        transitions = [
+            {'type': case['transition'], 'duration': case['transition_duration']}
+            for _ in range(len(case['video_files']) - 1)
+        ]
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        output_path = processor.compose_videos_advanced(
+            video_files=case['video_files'],
+            transitions=transitions,
+            output_filename=case['output_filename'],
+        )
+        elapsed = time.perf_counter() - start
+        cpu_elapsed = time.process_time() - cpu_start
+
+        stats = processor.last_render_stats
+        output_duration = stats.get('output_duration') or 0.0
+        result_queue.put({
+            'ok': True,
+            'elapsed_seconds': elapsed,
+            'cpu_seconds': cpu_elapsed,
+            'output_duration': output_duration,
+            'output_frames': stats.get('output_frames'),
+            'fps': stats.get('output_frames', 0) / elapsed if elapsed > 0 else None,
+            'realtime_factor': output_duration / elapsed if elapsed > 0 else None,
+            'peak_rss_bytes': _max_rss_bytes(resource.RUSAGE_SELF),
+            'peak_child_rss_bytes': _max_rss_bytes(resource.RUSAGE_CHILDREN),
+            'output_size_bytes': os.path.getsize(output_path),
+            'transition_seconds': stats.get('transition_seconds', {}),
+        })
+    except Exception as e:
+        result_queue.put({'ok': False, 'error': f"{type(e).__name__}: {e}"})
+
+
+def run_case(case: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """启动子进程运行用例并收集结果"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_run_case_in_child, args=(case, result_queue))
+    process.start()
+    try:
+        result = result_queue.get(timeout=timeout)
+    except Exception:
+        _kill_process_group(process)
+        result = {'ok': False, 'error': f'超时 ({timeout}s)'}
+    process.join()
+    return result
+
+
+def _kill_process_group(process) -> None:
+    """终止用例子进程及其进程组内的 ffmpeg"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        # 子进程尚未建立进程组或已经退出
+        process.kill()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _environment() -> Dict[str, Any]:
+    import moviepy
+    import numpy
+    return {
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'moviepy': moviepy.__version__,
+        'numpy': numpy.__version__,
+        'ffmpeg': get_ffmpeg_binary(),
+    }
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    return f"{result['resolution']}|{result['clip_duration']:g}s|{result['clip_count']}clips|{result['transition']}"
+
+
+def median_seconds(report: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """按用例汇总成功运行（--repeat 多次）的耗时中位数"""
+    runs: Dict[str, List[float]] = {}
+    for result in report.get('results', []):
+        if result.get('ok'):
+            runs.setdefault(case_key(result), []).append(result['elapsed_seconds'])
+    return {key: {'seconds': statistics.median(values), 'runs': len(values)} for key, values in runs.items()}
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按用例比较两份报告的耗时中位数，ratio > 1 表示变慢"""
+    baseline_cases = median_seconds(baseline)
+    comparison = []
+    for key, after in median_seconds(current).items():
+        before = baseline_cases.get(key)
+        if not before:
+            continue
+        comparison.append({
+            'case': key,
+            'baseline_seconds': before['seconds'],
+            'current_seconds': after['seconds'],
+            'baseline_runs': before['runs'],
+            'current_runs': after['runs'],
+            'ratio': after['seconds'] / before['seconds'] if before['seconds'] else None,
+        })
+    return comparison
+
+
+def _parse_list(value: str, cast=str) -> List[Any]:
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='离线渲染基准测试')
+    parser.add_argument('--resolutions', default='640x360,1280x720', help='逗号分隔的分辨率列表')
+    parser.add_argument('--durations', default='5', help='逗号分隔的单片段时长（秒）')
+    parser.add_argument('--clip-counts', default='2,3', help='逗号分隔的片段数量')
+    parser.add_argument('--transitions', default=','.join(ALL_TRANSITIONS), help='逗号分隔的转场类型')
+    parser.add_argument('--transition-duration', type=float, default=1.0)
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--repeat', type=int, default=1, help='每个用例重复次数')
+    parser.add_argument('--timeout', type=float, default=1800, help='单个用例超时（秒）')
+    parser.add_argument('--work-dir', default=None, help='测试素材和输出目录，默认使用临时目录')
+    parser.add_argument('--output', default=None, help='JSON 报告输出路径，默认输出到 stdout')
+    parser.add_argument('--compare', default=None, help='与之前的 JSON 报告比较')
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='video_bench_')
+    media_dir = os.path.join(work_dir, 'media')
+    output_dir = os.path.join(work_dir, 'outputs')
+    os.makedirs(media_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    resolutions = [tuple(int(v) for v in item.split('x')) for item in _parse_list(args.resolutions)]
+    durations = _parse_list(args.durations, float)
+    clip_counts = _parse_list(args.clip_counts, int)
+    transitions = _parse_list(args.transitions)
+
+    report: Dict[str, Any] = {
+        'created_at': datetime.now().isoformat(),
+        'environment': _environment(),
+        'parameters': vars(args),
+        'results': [],
+    }
+
+    for width, height in resolutions:
+        for duration in durations:
+            for clip_count in clip_counts:
+                video_files = [
+                    generate_clip(media_dir, width, height, duration, args.fps, index)
+                    for index in range(clip_count)
+                ]
+                for transition in transitions:
+                    for run in range(args.repeat):
+                        case = {
+                            'video_files': video_files,
+                            'transition': transition,
+                            'transition_duration': args.transition_duration,
+                            'output_dir': output_dir,
+                            'output_filename': f"bench_{width}x{height}_{duration:g}s_{clip_count}_{transition}_{run}.mp4",
+                        }
+                        result = run_case(case, args.timeout)
+                        result.update({
+                            'resolution': f"{width}x{height}",
+                            'clip_duration': duration,
+                            'clip_count': clip_count,
+                            'transition': transition,
+                            'run': run,
+                        })
+                        report['results'].append(result)
+                        status = f"{result['elapsed_seconds']:.2f}s" if result.get('ok') else result['error']
+                        print(f"[基准] {case_key(result)} #{run}: {status}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['comparison'] = compare_reports(json.load(f), report)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    return 0 if all(r.get('ok') for r in report['results']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
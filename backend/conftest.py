@@ -0,0 +1,8 @@
+"""
+测试共用的辅助函数（pytest 自动加载本文件；直接运行测试脚本时通过 from conftest import 使用）
+"""
+
+
+def source_info(path, duration, size=(1280, 720), fps=25.0, has_audio=True):
+    """构造与 probe_source 结果格式相同的源信息，不需要真实文件"""
+    return {'path': path, 'duration': duration, 'size': size, 'fps': fps, 'has_audio': has_audio}
@@ -0,0 +1,373 @@
+"""
+ffmpeg 滤镜图渲染引擎
+把 video_files + transitions 编译为一个 filter_complex（xfade/acrossfade），
+由单个 ffmpeg 进程完成解码、缩放、转场和编码，全程没有逐帧的 Python 参与
+
+moviepy 只用于定位 ffmpeg 可执行文件和解析探测信息，在函数内按需导入，
+API 进程导入本模块（参数校验、成本估算）时不加载 moviepy/numpy
+"""
+
+import functools
+import os
+import re
+import subprocess as sp
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from logger_config import AppLoggers
+from render_options import DEFAULT_MP4_LAYOUT, MP4_LAYOUTS, build_conform_filter, is_valid_pad_color, parse_clip
+
+logger = AppLoggers.PROCESSOR
+
+# 转场类型到 xfade transition 的映射；不在表中的类型（如 zoom_out）由 moviepy 引擎处理
+XFADE_TRANSITIONS = {
+    'fade': 'fade',
+    'slide_left': 'slideleft',
+    'slide_right': 'slideright',
+    'slide_up': 'slideup',
+    'slide_down': 'slidedown',
+    'zoom_in': 'zoomin',
+}
+
+# 统一的音频格式，保证 acrossfade 两侧输入一致
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_LAYOUT = 'stereo'
+
+# showinfo 的每帧日志，只取关键帧的显示时间
+_SHOWINFO_KEYFRAME = re.compile(r'pts_time:(-?[\d.]+)\s.*?\biskey:1\b')
+
+
+class FilterGraphError(Exception):
+    """ffmpeg 滤镜图渲染失败"""
+
+
+def unsupported_transitions(transitions: List[Dict[str, Any]]) -> List[str]:
+    """返回无法用 xfade 表达的转场类型"""
+    return [t.get('type', 'fade') for t in transitions if t.get('type', 'fade') not in XFADE_TRANSITIONS]
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_ffmpeg_binary() -> str:
+    """
+    解析并检查 ffmpeg 可执行文件，每个进程只做一次
+
+    渲染 worker 启动时调用，ffmpeg 不可用时立即失败，而不是等到领取第一个任务
+    """
+    from moviepy.config import get_setting
+
+    binary = get_setting("FFMPEG_BINARY")
+    try:
+        result = sp.run([binary, '-version'], stdout=sp.PIPE, stderr=sp.PIPE, stdin=sp.DEVNULL)
+    except OSError as e:
+        raise RuntimeError(f"ffmpeg 不可用: {binary}: {e}")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 不可用: {binary} (返回码 {result.returncode})")
+    return binary
+
+
+def probe_source(path: str) -> Dict[str, Any]:
+    """读取构建滤镜图所需的源信息"""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(path)
+    return {
+        'path': path,
+        'duration': infos['video_duration'],
+        'size': tuple(infos['video_size']),
+        'fps': infos['video_fps'],
+        'has_audio': infos['audio_found'],
+    }
+
+
+def trim_source(source: Dict[str, Any], start: float = 0.0, end: Optional[float] = None) -> Dict[str, Any]:
+    """
+    按裁剪点调整探测信息：duration 为保留部分的时长，trim_start 为入点（秒），没有裁剪时原样返回
+
+    出点超过视频时长时截断到结尾；入点不早于视频结尾时抛出 ValueError。
+    """
+    if start >= source['duration']:
+        raise ValueError(f"入点 {start:g} 秒超出视频时长 {source['duration']:g} 秒: {source['path']}")
+    end = source['duration'] if end is None else min(end, source['duration'])
+    if start == 0 and end == source['duration']:
+        return source
+    return dict(source, duration=end - start, trim_start=start)
+
+
+def probe_keyframes(path: str) -> List[float]:
+    """
+    建立视频流的关键帧时间索引（秒，升序）
+
+    只解码关键帧（-skip_frame nokey），由 showinfo 输出每个关键帧的显示时间戳，
+    时间与 -ss 一样相对于文件起点。索引只供 moviepy 读取器选择解码起点（见 media_reader），
+    本引擎的裁剪由 ffmpeg 自己的输入端 -ss 定位；所有输出都重新编码，不按关键帧做流复制剪切。
+    """
+    cmd = [resolve_ffmpeg_binary(), '-hide_banner', '-nostats', '-skip_frame', 'nokey',
+           '-i', path, '-map', '0:v:0', '-an', '-vf', 'showinfo', '-f', 'null', '-']
+    result = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.PIPE, stdin=sp.DEVNULL)
+    stderr = result.stderr.decode('utf8', errors='ignore')
+    if result.returncode != 0:
+        raise RuntimeError(f"关键帧索引失败 (返回码 {result.returncode}): {stderr[-500:]}")
+    times = [float(match.group(1)) for match in _SHOWINFO_KEYFRAME.finditer(stderr)]
+    return sorted(set(times))
+
+
+def rendition_path(output_path: str, height: int) -> str:
+    """额外输出的文件路径: result.mp4 -> result_720p.mp4"""
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}_{height}p{ext}"
+
+
+def build_rendition_outputs(video_label: str, audio_label: Optional[str], output_path: str,
+                            renditions: List[int], video_args: List[str],
+                            audio_args: List[str]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """
+    把合成结果分发给多个编码器：时间线只合成一次，每个额外输出只增加缩放和编码
+
+    Args:
+        video_label: 合成画面在滤镜图中的标签（如 'vx2'，或输入流 '0:v'）
+        audio_label: 合成音频的标签，None 表示没有音频
+        output_path: 主输出路径，保持时间线尺寸
+        renditions: 额外输出的高度列表，宽度按比例取偶数
+        video_args / audio_args: 每个输出使用的编码参数
+
+    Returns:
+        (追加到 filter_complex 的滤镜链, 所有输出的命令行参数, 额外输出列表 [{'height', 'output_path'}])
+    """
+    count = len(renditions) + 1
+    chains = [f"[{video_label}]split={count}" + ''.join(f"[rv{i}]" for i in range(count))]
+    video_labels = ['rv0']
+    for i, height in enumerate(renditions, 1):
+        chains.append(f"[rv{i}]scale=-2:{height},setsar=1[rs{i}]")
+        video_labels.append(f'rs{i}')
+    if audio_label:
+        chains.append(f"[{audio_label}]asplit={count}" + ''.join(f"[ra{i}]" for i in range(count)))
+
+    outputs = [{'height': height, 'output_path': rendition_path(output_path, height)} for height in renditions]
+    args: List[str] = []
+    for i, path in enumerate([output_path] + [output['output_path'] for output in outputs]):
+        args += ['-map', f'[{video_labels[i]}]']
+        if audio_label:
+            args += ['-map', f'[ra{i}]'] + audio_args
+        args += video_args + [path]
+    return chains, args, outputs
+
+
+def concat_segments(segment_paths: List[str], output_path: str, audio_path: Optional[str] = None,
+                    movflags: Optional[List[str]] = None, audio_args: Optional[List[str]] = None) -> None:
+    """
+    无损拼接编码参数相同的视频分段（concat 分离器 + 流复制），可选地同时封装音频
+
+    Args:
+        audio_args: 音频的编码参数（如 ['-c:a', 'aac']），默认直接复制 audio_path 中的音频流
+
+    Raises:
+        FilterGraphError: ffmpeg 返回非零退出码
+    """
+    list_path = f"{output_path}.segments.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [resolve_ffmpeg_binary(), '-y', '-loglevel', 'error', '-nostdin',
+           '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+    cmd += ['-c', 'copy'] + (audio_args or []) + (movflags or []) + [output_path]
+    try:
+        result = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.PIPE, stdin=sp.DEVNULL)
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        raise FilterGraphError(result.stderr.decode('utf8', errors='replace').strip()[-2000:])
+
+
+def safe_transition_duration(duration: float, accumulated: float, clip_duration: float, fps: float) -> float:
+    """与 moviepy 引擎一致：转场不超过两侧时长的 30%，且至少一帧"""
+    return max(min(duration, accumulated * 0.3, clip_duration * 0.3), 1.0 / fps)
+
+
+def build_filter_graph(sources: List[Dict[str, Any]], transitions: List[Dict[str, Any]],
+                       fit_mode: str = 'contain', pad_color: str = 'black') -> Dict[str, Any]:
+    """
+    构建 filter_complex
+
+    Args:
+        sources: probe_source 的结果列表，输入顺序与 ffmpeg -i 顺序一致
+        transitions: 转场配置列表，数量应为 len(sources) - 1
+        fit_mode: 尺寸适配方式，目标尺寸为第一个视频的尺寸
+        pad_color: contain 模式下的填充颜色
+
+    Returns:
+        {'filter_complex', 'video_label', 'audio_label', 'duration', 'size', 'fps'}
+    """
+    if not sources:
+        raise ValueError("至少需要一个视频文件")
+    # 填充颜色会拼进 filter_complex，必须在这里拦截 movie=/amovie= 等滤镜注入
+    if not is_valid_pad_color(pad_color):
+        raise ValueError(f"不支持的填充颜色: {pad_color}，可用颜色名或 #RRGGBB")
+
+    target_size = sources[0]['size']
+    fps = max(source['fps'] for source in sources)
+    with_audio = any(source['has_audio'] for source in sources)
+
+    chains = []
+    for index, source in enumerate(sources):
+        conform = build_conform_filter(source['size'], target_size, fit_mode, pad_color)
+        chains.append(
+            f"[{index}:v]{conform},trim=duration={source['duration']:.6f},setpts=PTS-STARTPTS,"
+            f"settb=AVTB,fps={fps:g},format=yuv420p[v{index}]"
+        )
+        if not with_audio:
+            continue
+        if source['has_audio']:
+            # 响度归一化的增益（见 audio_analysis.loudness_gain_db）
+            gain = f"volume={source['gain_db']:.2f}dB," if source.get('gain_db') else ''
+            chains.append(
+                f"[{index}:a]aformat=sample_rates={AUDIO_SAMPLE_RATE}:channel_layouts={AUDIO_LAYOUT},{gain}"
+                f"atrim=duration={source['duration']:.6f},asetpts=PTS-STARTPTS,"
+                f"apad=whole_dur={source['duration']:.6f}[a{index}]"
+            )
+        else:
+            # 无音轨的片段补静音，保证音视频时间线对齐
+            chains.append(
+                f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl={AUDIO_LAYOUT},"
+                f"atrim=duration={source['duration']:.6f}[a{index}]"
+            )
+
+    video_label = 'v0'
+    audio_label = 'a0' if with_audio else None
+    accumulated = sources[0]['duration']
+
+    for index in range(1, len(sources)):
+        config = transitions[index - 1]
+        clip_duration = sources[index]['duration']
+        duration = safe_transition_duration(float(config.get('duration', 1.0)), accumulated, clip_duration, fps)
+        offset = accumulated - duration
+        xfade = XFADE_TRANSITIONS[config.get('type', 'fade')]
+
+        chains.append(
+            f"[{video_label}][v{index}]xfade=transition={xfade}:duration={duration:.6f}:"
+            f"offset={offset:.6f}[vx{index}]"
+        )
+        video_label = f'vx{index}'
+        if with_audio:
+            chains.append(f"[{audio_label}][a{index}]acrossfade=d={duration:.6f}[ax{index}]")
+            audio_label = f'ax{index}'
+        accumulated = accumulated + clip_duration - duration
+
+    return {
+        'filter_complex': ';'.join(chains),
+        'video_label': video_label,
+        'audio_label': audio_label,
+        'duration': accumulated,
+        'size': target_size,
+        'fps': fps,
+    }
+
+
+class FilterGraphEngine:
+    """单进程 ffmpeg 渲染引擎"""
+
+    def __init__(self, ffmpeg_binary: Optional[str] = None, preset: str = 'medium', crf: int = 23,
+                 mp4_layout: str = DEFAULT_MP4_LAYOUT):
+        self.ffmpeg_binary = ffmpeg_binary or resolve_ffmpeg_binary()
+        self.preset = preset
+        self.crf = crf
+        self.mp4_layout = mp4_layout
+
+    @property
+    def video_args(self) -> List[str]:
+        return (['-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf), '-pix_fmt', 'yuv420p']
+                + MP4_LAYOUTS[self.mp4_layout])
+
+    def build_command(self, sources: List[Dict[str, Any]], transitions: List[Dict[str, Any]],
+                      output_path: str, fit_mode: str = 'contain', pad_color: str = 'black',
+                      renditions: Optional[List[int]] = None) -> Tuple[List[str], Dict[str, Any]]:
+        """生成完整的 ffmpeg 命令行，renditions 非空时 graph['renditions'] 为额外输出列表"""
+        graph = build_filter_graph(sources, transitions, fit_mode, pad_color)
+
+        cmd = [self.ffmpeg_binary, '-y', '-loglevel', 'error', '-nostdin']
+        for source in sources:
+            if 'trim_start' in source:
+                # 输入端定位和限时：入点之前、出点之后的部分不解码
+                cmd += ['-ss', f"{source.get('trim_start', 0.0):.6f}", '-t', f"{source['duration']:.6f}"]
+            cmd += ['-i', source['path']]
+        if renditions:
+            chains, output_args, graph['renditions'] = build_rendition_outputs(
+                graph['video_label'], graph['audio_label'], output_path, renditions,
+                self.video_args, ['-c:a', 'aac']
+            )
+            return cmd + ['-filter_complex', ';'.join([graph['filter_complex']] + chains)] + output_args, graph
+
+        cmd += ['-filter_complex', graph['filter_complex'], '-map', f"[{graph['video_label']}]"]
+        if graph['audio_label']:
+            cmd += ['-map', f"[{graph['audio_label']}]", '-c:a', 'aac']
+        cmd += self.video_args + [output_path]
+        return cmd, graph
+
+    def render(self, video_files: List[str], transitions: List[Dict[str, Any]], output_path: str,
+               fit_mode: str = 'contain', pad_color: str = 'black',
+               sources: Optional[List[Dict[str, Any]]] = None,
+               progress_callback: Optional[Callable[[float, str], None]] = None,
+               renditions: Optional[List[int]] = None,
+               audio_gains: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        渲染并返回统计信息
+
+        Args:
+            video_files: 视频文件路径或带裁剪点的片段（见 parse_clip）
+            progress_callback: 可选的进度回调 (完成比例, 阶段)，由 ffmpeg -progress 输出驱动
+            renditions: 额外输出的高度列表，与主输出在同一个 ffmpeg 进程中编码
+            audio_gains: 每个片段的音频增益（dB），在滤镜图的音频链中应用
+
+        Raises:
+            FilterGraphError: ffmpeg 返回非零退出码
+        """
+        if sources is None:
+            sources = [trim_source(probe_source(path), start, end) for path, start, end in map(parse_clip, video_files)]
+        if audio_gains:
+            sources = [dict(source, gain_db=gain) for source, gain in zip(sources, audio_gains)]
+        cmd, graph = self.build_command(sources, transitions, output_path, fit_mode, pad_color, renditions)
+        logger.debug("ffmpeg 滤镜图: %s", graph['filter_complex'])
+
+        start = time.perf_counter()
+        if progress_callback is None:
+            proc = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.PIPE, stdin=sp.DEVNULL)
+            returncode, stderr = proc.returncode, proc.stderr
+        else:
+            returncode, stderr = self._run_with_progress(cmd, graph['duration'], progress_callback)
+        elapsed = time.perf_counter() - start
+
+        if returncode != 0:
+            raise FilterGraphError(stderr.decode('utf8', errors='replace').strip()[-2000:])
+
+        output_frames = int(graph['duration'] * graph['fps'])
+        return {
+            'engine': 'ffmpeg',
+            'output_duration': graph['duration'],
+            'output_frames': output_frames,
+            'encode_seconds': elapsed,
+            'render_fps': output_frames / elapsed if elapsed > 0 else None,
+            'encode_seconds_per_output_second': elapsed / graph['duration'] if graph['duration'] else None,
+            'transition_seconds': {},
+            'output_size': tuple(graph['size']),
+            'renditions': graph.get('renditions', []),
+        }
+
+    @staticmethod
+    def _run_with_progress(cmd: List[str], duration: float,
+                           progress_callback: Callable[[float, str], None]) -> Tuple[int, bytes]:
+        """运行 ffmpeg 并解析 -progress 输出（out_time_us 为已编码的时长）"""
+        cmd = cmd[:-1] + ['-progress', 'pipe:1', '-nostats', cmd[-1]]
+        # stderr 写到临时文件：读 stdout 期间 stderr 管道写满会让 ffmpeg 阻塞
+        with tempfile.TemporaryFile() as stderr_file:
+            with sp.Popen(cmd, stdout=sp.PIPE, stderr=stderr_file, stdin=sp.DEVNULL) as proc:
+                for line in proc.stdout:
+                    key, _, value = line.decode('ascii', errors='ignore').strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit() and duration > 0:
+                        progress_callback(min(1.0, int(value) / 1e6 / duration), 'encode')
+                returncode = proc.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+        return returncode, stderr
@@ -0,0 +1,158 @@
+"""
+共享内存帧传输
+每个源片段的 ffmpeg 解码进程把原始帧写到管道，合成进程中的读取线程用 readinto 把每一帧
+直接读入共享内存环形缓冲区的槽位（不经过中间 bytes 对象）；合成按 NumPy 视图读取槽位，帧数据不再拷贝。
+
+管道模式下 ffmpeg 只能领先合成一个管道缓冲区（远小于一帧），合成期间解码基本停滞；
+环形缓冲区让读取线程在合成当前帧时继续接收后面几帧，ffmpeg 的解码与合成在不同的核上并行。
+readinto 在系统调用期间释放 GIL，读取线程不与合成争抢解释器；与管道模式相比没有额外的进程，
+也没有额外的拷贝（都是内核管道到用户内存的一次拷贝）。
+
+同步：free 信号量计数空闲槽位，filled 计数已写好的帧；合成读取下一帧时才归还上一帧的槽位，
+返回给调用方的视图在读取下一帧之前保持有效。缓冲区头部记录每个槽位写入的字节数，不足一帧表示解码结束。
+
+本模块只依赖标准库，不导入 moviepy/numpy。
+"""
+
+import struct
+import subprocess as sp
+import threading
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+from logger_config import AppLoggers
+
+logger = AppLoggers.PROCESSOR
+
+# 每个源片段的环形缓冲区槽位数（1080p RGB 每帧约 6MB）
+RING_SLOTS = 4
+
+_LENGTH = struct.Struct('q')
+_ALIGN = 64
+
+
+class FrameRing:
+    """一块共享内存上的定长帧槽位（单生产者、单消费者）"""
+
+    def __init__(self, frame_bytes: int, slots: int = RING_SLOTS):
+        self.frame_bytes = frame_bytes
+        self.slots = slots
+        # 头部：每个槽位写入的字节数，帧数据按缓存行对齐
+        self.offset = -(-slots * _LENGTH.size // _ALIGN) * _ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=self.offset + frame_bytes * slots)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def frame_offset(self, slot: int) -> int:
+        return self.offset + slot * self.frame_bytes
+
+    def frame_length(self, slot: int) -> int:
+        return _LENGTH.unpack_from(self.shm.buf, slot * _LENGTH.size)[0]
+
+    def close(self) -> None:
+        """
+        释放共享内存，调用方应先释放所有帧视图
+
+        仍有帧视图未释放时记录警告：名称照常删除（/dev/shm 中不残留），映射保留到这些视图被回收。
+        """
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning("关闭共享内存 %s 时仍有帧视图未释放，映射保留到视图被回收", self.shm.name)
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RingDecoder:
+    """运行 ffmpeg 解码命令，由读取线程把输出的每一帧写入 FrameRing，合成按顺序取帧（单生产者、单消费者）"""
+
+    def __init__(self, ring: FrameRing, cmd: List[str]):
+        self.ring = ring
+        self._free = threading.Semaphore(ring.slots)
+        self._filled = threading.Semaphore(0)
+        self._stop = threading.Event()
+        self._seq = 0
+        self._holding = False
+        self.finished = False
+        # 读取线程的异常，取帧时抛出
+        self.error: Optional[BaseException] = None
+        # bufsize=0：stdout 为原始文件对象，readinto 直接从管道读入共享内存
+        self.process = sp.Popen(cmd, bufsize=0, stdout=sp.PIPE, stderr=sp.DEVNULL, stdin=sp.DEVNULL)
+        self._reader = threading.Thread(target=self._fill, name='frame-reader', daemon=True)
+        self._reader.start()
+
+    def _read_frame_into(self, slot: int) -> int:
+        """把一帧读入槽位，返回读到的字节数（不足一帧表示 ffmpeg 已结束）"""
+        ring = self.ring
+        view = ring.shm.buf[ring.frame_offset(slot):ring.frame_offset(slot) + ring.frame_bytes]
+        try:
+            received = 0
+            while received < ring.frame_bytes:
+                count = self.process.stdout.readinto(view[received:])
+                if not count:
+                    break
+                received += count
+            return received
+        finally:
+            view.release()
+
+    def _fill(self) -> None:
+        """读取线程：等待空闲槽位，读入下一帧；结束或出错时也发出一次 filled，取帧方不会一直等待"""
+        seq = 0
+        try:
+            while True:
+                self._free.acquire()
+                if self._stop.is_set():
+                    return
+                slot = seq % self.ring.slots
+                received = self._read_frame_into(slot)
+                _LENGTH.pack_into(self.ring.shm.buf, slot * _LENGTH.size, received)
+                seq += 1
+                if received < self.ring.frame_bytes:
+                    returncode = self.process.wait()
+                    if returncode and not self._stop.is_set():
+                        logger.warning("解码进程异常退出，退出码: %s，按片段结束处理", returncode)
+                    self._filled.release()
+                    return
+                self._filled.release()
+        except BaseException as e:
+            self.error = e
+            self._filled.release()
+
+    def next_slot(self) -> Optional[int]:
+        """
+        归还上一帧的槽位并等待下一帧
+
+        Returns:
+            下一帧所在的槽位，解码结束时返回 None
+        """
+        if self._holding:
+            self._free.release()
+            self._holding = False
+        if self.finished:
+            return None
+        self._filled.acquire()
+        if self.error is not None:
+            self.finished = True
+            raise IOError(f"读取解码输出失败: {self.error}")
+        slot = self._seq % self.ring.slots
+        self._seq += 1
+        if self.ring.frame_length(slot) < self.ring.frame_bytes:
+            self.finished = True
+            return None
+        self._holding = True
+        return slot
+
+    def stop(self) -> None:
+        """结束 ffmpeg 和读取线程"""
+        self._stop.set()
+        # 读取线程可能阻塞在管道读取（终止 ffmpeg 后读到结束）或等待空闲槽位
+        self.process.kill()
+        self._free.release()
+        self._reader.join()
+        self.process.stdout.close()
+        self.process.wait()
@@ -0,0 +1,37 @@
+"""
+gunicorn 配置
+所有参数均可通过环境变量覆盖，例如:
+    GUNICORN_WORKERS=8 GUNICORN_TIMEOUT=1800 gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import multiprocessing
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# 上传和预览是 I/O 密集型，使用多进程 + 线程
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# 长轮询（/api/task/<id>?wait=）每个等待占用一个线程，默认最多占用一半线程，
+# 其余线程留给上传、下载等请求；超过上限的长轮询返回 503，客户端按 Retry-After 重试
+os.environ.setdefault('TASK_WAIT_MAX_CONCURRENT', str(max(1, threads // 2)))
+
+# 同步合成请求可能持续数分钟，超时需要大于最长的合成时间
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '900'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '60'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# 定期回收 worker，避免视频处理的内存碎片持续增长
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# 访问日志默认关闭，请求日志由应用自身输出
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# 多个 worker 之间的指标和任务状态必须放在共享存储中
+os.environ.setdefault('STATE_STORE_URL', 'sqlite:///' + os.path.join(BASE_DIR, 'var', 'state.db'))
@@ -0,0 +1,169 @@
+"""
+合成任务持久化
+未启用渲染队列时，Web 进程内同步合成的任务连同完整参数和状态写入 SQLite。
+运行中的任务持有租约并定期续期；进程异常退出后租约过期，由其他（或重启后的）Web 进程
+接管，渲染从最后完成的分段继续（分段检查点见 AdvancedVideoProcessor）。
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from render_jobs import STARTED, SUCCESS, FAILURE
+
+# 租约时长（秒），续期间隔为其三分之一
+LEASE_SECONDS = 60
+# 单个任务最多运行的次数（含被接管后的重试），超过后标记为失败
+MAX_ATTEMPTS = 3
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobStore:
+    """基于 SQLite 的合成任务存储（WAL 模式，多进程共享）"""
+
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS compose_job ("
+            "id TEXT PRIMARY KEY, payload TEXT, state TEXT, owner TEXT, lease_until REAL, "
+            "attempts INTEGER, result TEXT, error TEXT, created_at REAL, updated_at REAL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # 连接按线程和进程隔离，与 SQLiteStateStore 相同
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id: str, payload: Dict[str, Any], owner: str) -> None:
+        """登记一个开始运行的任务"""
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO compose_job (id, payload, state, owner, lease_until, attempts, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
+            (job_id, json.dumps(payload), STARTED, owner, now + self.lease_seconds, now, now)
+        )
+
+    def renew(self, job_id: str, owner: str) -> bool:
+        """续期租约，任务已被其他进程接管或已结束时返回 False"""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE compose_job SET lease_until = ?, updated_at = ? WHERE id = ? AND owner = ? AND state = ?",
+            (now + self.lease_seconds, now, job_id, owner, STARTED)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._finish(job_id, SUCCESS, result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._finish(job_id, FAILURE, error=error)
+
+    def _finish(self, job_id: str, state: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        self._connection().execute(
+            "UPDATE compose_job SET state = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? "
+            "WHERE id = ?",
+            (state, result, error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT id, payload, state, owner, attempts, result, error, created_at, updated_at "
+            "FROM compose_job WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'payload': json.loads(row[1]),
+            'state': row[2],
+            'owner': row[3],
+            'attempts': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'created_at': row[7],
+            'updated_at': row[8],
+        }
+
+    def wait_for_change(self, job_id: str, state: str, timeout: float,
+                        interval: float = 0.25) -> Optional[Dict[str, Any]]:
+        """
+        长轮询：阻塞直到任务状态不再是 state 或超时
+
+        状态可能由其他进程更新，这里按 interval 轮询数据库（只读一行，开销很小）。
+
+        Returns:
+            最新的任务状态，任务不存在时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['state'] != state or remaining <= 0:
+                return job
+            time.sleep(min(interval, remaining))
+
+    def claim_interrupted(self, owner: str) -> Optional[Dict[str, Any]]:
+        """
+        接管一个租约已过期的运行中任务（原进程已退出）
+
+        达到最大运行次数的任务直接标记为失败。
+
+        Returns:
+            接管的任务，没有可接管的任务时返回 None
+        """
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE compose_job SET state = ?, error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (FAILURE, f'渲染进程多次异常退出（{self.max_attempts} 次）', now, STARTED, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id FROM compose_job WHERE state = ? AND lease_until < ? ORDER BY created_at LIMIT 1",
+                (STARTED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE compose_job SET owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ?",
+                (owner, now + self.lease_seconds, now, row[0])
+            )
+        return self.get(row[0])
+
+    @contextmanager
+    def lease(self, job_id: str, owner: str):
+        """渲染期间在后台线程中续期租约"""
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(job_id, owner)
+
+        thread = threading.Thread(target=keep_alive, name=f'lease-{job_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
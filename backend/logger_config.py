@@ -1,12 +1,30 @@
 """
 日志配置模块
 提供统一的日志管理和格式化
+
+两种输出格式：
+    text  带颜色的可读文本（默认），适合本地开发
+    json  每行一个 JSON 对象，附带请求/任务 ID 等上下文字段和结构化字段，适合日志管道检索
 """
 
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
-from datetime import datetime
-from typing import Optional
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+LOG_FORMATS = ('text', 'json')
+
+# 当前请求/任务的日志上下文（request_id、job_id、endpoint 等），附加到期间记录的每一条日志
+_log_context: ContextVar[Dict[str, Any]] = ContextVar('log_context', default={})
+# 当前打开的 span 路径，嵌套的 span 记录完整路径
+_span_path: ContextVar[Tuple[str, ...]] = ContextVar('log_span_path', default=())
 
 
 class ColoredFormatter(logging.Formatter):
@@ -22,15 +40,63 @@ class ColoredFormatter(logging.Formatter):
     }
     RESET = '\033[0m'
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 预先生成带颜色的级别名，避免每条日志重复拼接
+        self._colored_levels = {
+            name: f"{color}{name}{self.RESET}" for name, color in self.COLORS.items()
+        }
+    
     def format(self, record):
-        # 添加颜色
-        color = self.COLORS.get(record.levelname, self.RESET)
-        record.levelname = f"{color}{record.levelname}{self.RESET}"
-        
-        # 格式化时间
-        record.asctime = datetime.now().strftime('%H:%M:%S')
-        
-        return super().format(record)
+        # 临时替换级别名，格式化后恢复，避免污染其他处理器看到的 record
+        levelname = record.levelname
+        record.levelname = self._colored_levels.get(levelname, levelname)
+        try:
+            return super().format(record)
+        finally:
+            record.levelname = levelname
+
+    def formatMessage(self, record):
+        # 模块日志器的记录在消息前加 [模块名]
+        module = getattr(record, 'log_module', None)
+        if not module:
+            return super().formatMessage(record)
+        message = record.message
+        record.message = f"[{module}] {message}"
+        try:
+            return super().formatMessage(record)
+        finally:
+            record.message = message
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    JSON 格式化器：每条日志一行
+
+    固定字段 ts、level、module、message，加上日志上下文（request_id、job_id 等）
+    和记录时通过 extra={'fields': {...}} 传入的结构化字段。
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': getattr(record, 'log_module', None) or record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """在记录日志的线程中附加当前的日志上下文（监听线程里已经拿不到调用方的 contextvars）"""
+
+    def filter(self, record):
+        record.context = _log_context.get()
+        return True
 
 
 class ModuleLogger:
@@ -40,31 +106,69 @@ class ModuleLogger:
         self.logger = logging.getLogger(name)
         self.module_name = name
         
-    def _log_with_module(self, level: int, message: str, **kwargs):
-        """带模块名的日志记录"""
-        formatted_message = f"[{self.module_name}] {message}"
-        self.logger.log(level, formatted_message, **kwargs)
+    def is_enabled_for(self, level: int) -> bool:
+        """判断指定级别是否会被输出，供热路径在拼接消息前做级别判断"""
+        return self.logger.isEnabledFor(level)
     
-    def debug(self, message: str, **kwargs):
-        self._log_with_module(logging.DEBUG, message, **kwargs)
+    def _log_with_module(self, level: int, message: str, *args, **kwargs):
+        """
+        带模块名的日志记录，支持 %-风格的延迟格式化参数
+
+        结构化字段通过 extra={'fields': {...}} 传入，JSON 格式下作为独立的键输出
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        kwargs['extra'] = dict(kwargs.get('extra') or {}, log_module=self.module_name)
+        self.logger.log(level, message, *args, **kwargs)
+    
+    def debug(self, message: str, *args, **kwargs):
+        self._log_with_module(logging.DEBUG, message, *args, **kwargs)
     
-    def info(self, message: str, **kwargs):
-        self._log_with_module(logging.INFO, message, **kwargs)
+    def info(self, message: str, *args, **kwargs):
+        self._log_with_module(logging.INFO, message, *args, **kwargs)
     
-    def warning(self, message: str, **kwargs):
-        self._log_with_module(logging.WARNING, message, **kwargs)
+    def warning(self, message: str, *args, **kwargs):
+        self._log_with_module(logging.WARNING, message, *args, **kwargs)
     
-    def error(self, message: str, **kwargs):
-        self._log_with_module(logging.ERROR, message, **kwargs)
+    def error(self, message: str, *args, **kwargs):
+        self._log_with_module(logging.ERROR, message, *args, **kwargs)
     
-    def critical(self, message: str, **kwargs):
-        self._log_with_module(logging.CRITICAL, message, **kwargs)
+    def critical(self, message: str, *args, **kwargs):
+        self._log_with_module(logging.CRITICAL, message, *args, **kwargs)
+
+
+# 后台日志监听器，负责把队列中的日志写到 stdout
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def stop_logging() -> None:
+    """停止后台日志线程，并把队列中剩余的日志全部写出"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+atexit.register(stop_logging)
 
 
-def setup_logging(level: str = 'INFO') -> None:
-    """设置全局日志配置"""
+def setup_logging(level: str = 'INFO', log_format: str = 'text') -> None:
+    """
+    设置全局日志配置
+
+    请求线程和渲染线程只把日志记录放入内存队列（QueueHandler），
+    真正的格式化和 stdout 写入由后台 QueueListener 线程完成。
+
+    Args:
+        level: 日志级别
+        log_format: 输出格式，text 或 json（见 LOG_FORMATS）
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"不支持的日志格式: {log_format}，可选: {', '.join(LOG_FORMATS)}")
+    global _queue_listener
     
-    # 清除现有的处理器
+    # 停止旧的监听器并清除现有的处理器
+    stop_logging()
     root_logger = logging.getLogger()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
@@ -77,15 +181,28 @@ def setup_logging(level: str = 'INFO') -> None:
     console_handler.setLevel(log_level)
     
     # 设置格式化器
-    formatter = ColoredFormatter(
-        fmt='%(asctime)s | %(levelname)s | %(message)s',
-        datefmt='%H:%M:%S'
-    )
+    if log_format == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = ColoredFormatter(
+            fmt='%(asctime)s | %(levelname)s | %(message)s',
+            datefmt='%H:%M:%S'
+        )
     console_handler.setFormatter(formatter)
     
+    # 日志队列：调用方只做入队，I/O 由监听线程完成
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(log_level)
+    queue_handler.addFilter(_ContextFilter())
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, respect_handler_level=True
+    )
+    _queue_listener.start()
+    
     # 配置根日志器
     root_logger.setLevel(log_level)
-    root_logger.addHandler(console_handler)
+    root_logger.addHandler(queue_handler)
     
     # 禁用Flask的默认日志
     logging.getLogger('werkzeug').setLevel(logging.WARNING)
@@ -108,6 +225,75 @@ class AppLoggers:
     PREVIEW = get_module_logger("预览")
     FILES = get_module_logger("文件")
     ERROR = get_module_logger("错误")
+    PROCESSOR = get_module_logger("处理器")
+    WORKER = get_module_logger("渲染")
+    SPAN = get_module_logger("耗时")
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    在代码块内为所有日志附加上下文字段（如 request_id、job_id），可嵌套，值为 None 的字段忽略
+
+    上下文随 contextvars 传递，只对当前线程（或当前异步任务）有效。
+    """
+    token = _log_context.set(dict(_log_context.get(), **{k: v for k, v in fields.items() if v is not None}))
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def bind_log_context(**fields):
+    """
+    为当前线程之后的日志附加上下文字段，返回用于 unbind_log_context 的令牌
+
+    用于无法用 with 包住的场景（如 Flask 的 before_request / teardown_request）
+    """
+    return _log_context.set(dict(_log_context.get(), **{k: v for k, v in fields.items() if v is not None}))
+
+
+def unbind_log_context(token) -> None:
+    _log_context.reset(token)
+
+
+def get_log_context() -> Dict[str, Any]:
+    """当前的日志上下文"""
+    return dict(_log_context.get())
+
+
+def record_span(name: str, seconds: float, **fields) -> None:
+    """
+    记录一个已结束的 span（名称、耗时和父路径），挂在当前打开的 span 下
+
+    用于耗时在别处测得的阶段，例如编码期间逐帧累计的转场渲染时间
+    """
+    parent = _span_path.get()
+    path = '/'.join(parent + (name,))
+    AppLoggers.SPAN.info(f"{path} | {seconds * 1000:.1f}ms", extra={'fields': dict(
+        fields, span=path, span_name=name, parent_span='/'.join(parent) or None,
+        duration_ms=round(seconds * 1000, 3)
+    )})
+
+
+@contextmanager
+def log_span(name: str, **fields):
+    """
+    记录代码块的耗时，结束时输出一条日志；span 可嵌套，子 span 的 parent_span 为外层路径
+
+    代码块内可以往返回的字典里补充字段，随 span 一起输出
+    """
+    token = _span_path.set(_span_path.get() + (name,))
+    start = time.perf_counter()
+    fields = dict(fields, status='ok')
+    try:
+        yield fields
+    except BaseException:
+        fields['status'] = 'error'
+        raise
+    finally:
+        _span_path.reset(token)
+        record_span(name, time.perf_counter() - start, **fields)
 
 
 def log_request_info(endpoint: str, method: str, **kwargs):
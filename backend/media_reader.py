@@ -0,0 +1,261 @@
+"""
+视频读取模块
+在 ffmpeg 解码阶段完成分辨率统一（缩放、加黑边或裁剪），
+帧到达 Python 时已经是目标尺寸和像素格式，无需逐帧重采样；
+有关键帧索引时，定位从目标之前最近的关键帧开始解码；
+片段的裁剪点（入点/出点）在解码器输入端生效，入点之前和出点之后的部分不解码；
+frame_transport='shared_memory' 时读取线程把 ffmpeg 输出的帧提前读入共享内存环形缓冲区（见 frame_transport）
+"""
+
+import bisect
+import math
+import os
+import subprocess as sp
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from moviepy.compat import DEVNULL
+from moviepy.config import get_setting
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.video.VideoClip import VideoClip
+from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+
+from frame_transport import FrameRing, RingDecoder
+from render_options import FRAME_TRANSPORTS, build_conform_filter
+
+
+def keyframe_before(keyframes: Sequence[float], t: float) -> float:
+    """返回不晚于 t 的最后一个关键帧时间，t 在第一个关键帧之前时返回 0"""
+    index = bisect.bisect_right(keyframes, t + 1e-6)
+    return keyframes[index - 1] if index else 0.0
+
+
+class ConformedVideoReader(FFMPEG_VideoReader):
+    """
+    在 ffmpeg 滤镜中完成尺寸统一的视频读取器
+
+    start/end 为裁剪点（源文件中的秒数）：读取器的时间从入点起算，时长只包含保留部分。
+    """
+
+    def __init__(self, filename: str, target_size: Optional[Tuple[int, int]] = None,
+                 fit_mode: str = 'contain', pad_color: str = 'black',
+                 keyframes: Optional[List[float]] = None,
+                 start: float = 0.0, end: Optional[float] = None, **kwargs):
+        self.keyframes = keyframes
+        self.start = start
+        self.end = end
+        self.target_size = tuple(target_size) if target_size else None
+        self.fit_mode = fit_mode
+        self.pad_color = pad_color
+        self.source_size = None
+        self.video_filter = None
+        if self.target_size:
+            # 父类要求 (高, 宽)，并在初始化时直接打开解码管道
+            kwargs['target_resolution'] = (self.target_size[1], self.target_size[0])
+        try:
+            super().__init__(filename, **kwargs)
+        except IOError:
+            # 父类初始化时从入点读取第一帧，入点超出时长时读不到帧
+            if start and start >= getattr(self, 'duration', float('inf')):
+                raise ValueError(f"入点 {start:g} 秒超出视频时长 {self.duration:g} 秒: {filename}") from None
+            raise
+        if start or end is not None:
+            if start >= self.duration:
+                self.close()
+                raise ValueError(f"入点 {start:g} 秒超出视频时长 {self.duration:g} 秒: {filename}")
+            self.end = self.duration if end is None else min(end, self.duration)
+            self.duration = self.ffmpeg_duration = self.end - start
+            self.nframes = int(self.duration * self.fps)
+
+    def _build_video_filter(self) -> str:
+        if self.source_size is None:
+            self.source_size = tuple(self.infos['video_size'])
+        if not self.target_size:
+            return "scale=%d:%d" % tuple(self.size)
+        return build_conform_filter(self.source_size, self.target_size, self.fit_mode, self.pad_color)
+
+    def _input_args(self, starttime: float):
+        """starttime 为源文件中的秒数"""
+        if starttime != 0 and self.keyframes:
+            # 输入端直接定位到最近的前一个关键帧（向下取整，避免格式化后越过关键帧），
+            # 输出端再精确丢弃到目标时间
+            keyframe = math.floor(keyframe_before(self.keyframes, starttime) * 1e6) / 1e6
+            return ['-ss', "%.06f" % keyframe,
+                    '-i', self.filename,
+                    '-ss', "%.06f" % (starttime - keyframe)]
+        if starttime != 0:
+            offset = min(1, starttime)
+            return ['-ss', "%.06f" % (starttime - offset),
+                    '-i', self.filename,
+                    '-ss', "%.06f" % offset]
+        return ['-i', self.filename]
+
+    def _decode_command(self, starttime: float) -> List[str]:
+        """从片段时间 starttime 开始输出目标尺寸原始帧的 ffmpeg 命令，尺寸统一由 -vf 完成"""
+        if self.video_filter is None:
+            self.video_filter = self._build_video_filter()
+        source_time = self.start + starttime
+        # 有出点时解码到出点为止
+        limit = ['-t', "%.06f" % (self.end - source_time)] if self.end is not None else []
+        return ([get_setting("FFMPEG_BINARY")] + self._input_args(source_time) + limit +
+                ['-loglevel', 'error',
+                 '-f', 'image2pipe',
+                 '-vf', self.video_filter,
+                 '-sws_flags', self.resize_algo,
+                 '-pix_fmt', self.pix_fmt,
+                 '-vcodec', 'rawvideo', '-'])
+
+    def initialize(self, starttime=0):
+        """打开文件并建立解码管道"""
+        self.close()
+
+        cmd = self._decode_command(starttime)
+        popen_params = {"bufsize": self.bufsize,
+                        "stdout": sp.PIPE,
+                        "stderr": sp.PIPE,
+                        "stdin": DEVNULL}
+
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000
+
+        self.proc = sp.Popen(cmd, **popen_params)
+
+    def get_frame(self, t):
+        """
+        向后跳转时按关键帧索引选择：目标之前最近的关键帧在当前解码位置之后，
+        重新定位更快；否则解码器无论如何都要解码中间帧，顺序跳过即可
+        （父类固定以 100 帧为界，不知道关键帧位置）
+        """
+        pos = int(self.fps * t + 0.00001) + 1
+        if not self.keyframes or not self.proc or pos <= self.pos + 1:
+            return super().get_frame(t)
+        # 关键帧索引是源文件时间，片段时间需要加上入点
+        if keyframe_before(self.keyframes, self.start + t) > self.start + self.pos / self.fps:
+            self.initialize(t)
+        else:
+            self.skip_frames(pos - self.pos - 1)
+        result = self.read_frame()
+        self.pos = pos
+        return result
+
+
+class _SharedFrame:
+    """
+    帧视图的 base 对象：通过数组接口暴露槽位内存（只读），同时持有 FrameRing，
+    共享内存在最后一个帧视图被回收之后才会真正关闭
+    """
+
+    def __init__(self, view: np.ndarray, ring: FrameRing):
+        interface = dict(view.__array_interface__)
+        interface['data'] = (interface['data'][0], True)
+        self.__array_interface__ = interface
+        # 元组按逆序释放：先释放视图，再释放 FrameRing
+        self._keep = (ring, view)
+
+
+class SharedMemoryVideoReader(ConformedVideoReader):
+    """
+    由读取线程把 ffmpeg 输出的帧提前读入共享内存环形缓冲区，解码与合成并行
+
+    read_frame 返回指向槽位的只读 NumPy 视图（与管道模式下 np.frombuffer 的结果一样只读），
+    在读取下一帧之前有效；moviepy 的合成都会生成新数组，不会跨帧持有视图。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.ring = None
+        self.decoder = None
+        super().__init__(*args, **kwargs)
+
+    def initialize(self, starttime=0):
+        """（重新）启动 ffmpeg 和读取线程，定位时复用同一块共享内存"""
+        self._stop_decoder()
+        cmd = self._decode_command(starttime)
+        width, height = self.size
+        if self.ring is None:
+            self.ring = FrameRing(width * height * self.depth)
+        self.decoder = RingDecoder(self.ring, cmd)
+        # 父类用 self.proc 判断解码是否已启动
+        self.proc = self.decoder
+
+    def read_frame(self):
+        slot = self.decoder.next_slot()
+        if slot is None:
+            # 与父类一致：读到文件末尾后重复最后一帧
+            if not hasattr(self, 'lastread'):
+                raise IOError(f"无法读取视频的第一帧: {self.filename}")
+            return self.lastread
+        width, height = self.size
+        view = np.frombuffer(self.ring.shm.buf, dtype=np.uint8, count=self.ring.frame_bytes,
+                             offset=self.ring.frame_offset(slot)).reshape(height, width, self.depth)
+        result = np.asarray(_SharedFrame(view, self.ring))
+        self.lastread = result
+        return result
+
+    def skip_frames(self, n=1):
+        """丢弃的帧只推进槽位，不拷贝数据"""
+        for _ in range(n):
+            if self.decoder.next_slot() is None:
+                break
+        self.pos += n
+
+    def _stop_decoder(self) -> None:
+        if self.decoder is not None:
+            self.decoder.stop()
+            self.decoder = None
+            self.proc = None
+
+    def close(self):
+        self._stop_decoder()
+        if hasattr(self, 'lastread'):
+            del self.lastread
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ConformedVideoFileClip(VideoFileClip):
+    """
+    解码时即统一尺寸的视频片段
+
+    与 VideoFileClip 用法相同，额外接受 target_size/fit_mode/pad_color，
+    上传时建立的关键帧索引 keyframes（秒，升序），帧传输方式 frame_transport（见 FRAME_TRANSPORTS），
+    以及裁剪点 start/end（源文件中的秒数，片段只包含这一段，音频同样裁剪）。
+    """
+
+    def __init__(self, filename: str, target_size: Optional[Tuple[int, int]] = None,
+                 fit_mode: str = 'contain', pad_color: str = 'black',
+                 keyframes: Optional[List[float]] = None, frame_transport: str = 'pipe',
+                 start: float = 0.0, end: Optional[float] = None,
+                 audio: bool = True, audio_buffersize: int = 200000,
+                 resize_algorithm: str = 'bicubic', audio_fps: int = 44100,
+                 audio_nbytes: int = 2, fps_source: str = 'tbr'):
+        VideoClip.__init__(self)
+
+        if frame_transport not in FRAME_TRANSPORTS:
+            raise ValueError(f"不支持的帧传输方式: {frame_transport}")
+        reader_class = SharedMemoryVideoReader if frame_transport == 'shared_memory' else ConformedVideoReader
+        self.reader = reader_class(
+            filename, target_size=target_size, fit_mode=fit_mode, pad_color=pad_color,
+            keyframes=keyframes, start=start, end=end,
+            pix_fmt="rgb24", resize_algo=resize_algorithm, fps_source=fps_source
+        )
+
+        self.duration = self.reader.duration
+        self.end = self.reader.duration
+        self.fps = self.reader.fps
+        self.size = self.reader.size
+        self.rotation = self.reader.rotation
+        self.filename = self.reader.filename
+        self.source_size = self.reader.source_size
+
+        self.make_frame = lambda t: self.reader.get_frame(t)
+
+        if audio and self.reader.infos['audio_found']:
+            self.audio = AudioFileClip(filename,
+                                       buffersize=audio_buffersize,
+                                       fps=audio_fps,
+                                       nbytes=audio_nbytes)
+            if self.reader.start or self.reader.end is not None:
+                # 音频读取器在跳转较远时同样从输入端定位
+                self.audio = self.audio.subclip(self.reader.start, self.reader.start + self.duration)
@@ -0,0 +1,386 @@
+"""
+运行指标模块
+以 Prometheus 文本格式暴露吞吐量、延迟和资源占用指标
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from state_store import StateStore, get_state_store
+
+
+LabelValues = Tuple[str, ...]
+
+# 默认的延迟分桶（秒），覆盖普通接口到长时间渲染
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape_label_value(value)}"' for name, value in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    指标基类
+
+    指标值保存在状态存储中（见 state_store），多个 gunicorn worker
+    写入同一份数据，/metrics 无论由哪个 worker 响应都返回全局数值。
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.store_key = f"metrics:{name}"
+        self.registry: Optional['MetricsRegistry'] = None
+
+    @property
+    def store(self) -> StateStore:
+        return self.registry.store if self.registry is not None else get_state_store()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @staticmethod
+    def _field(key: LabelValues, *suffix: str) -> str:
+        return json.dumps(list(key) + list(suffix), ensure_ascii=False)
+
+    def _stored_values(self) -> Dict[LabelValues, float]:
+        return {tuple(json.loads(field)): value for field, value in self.store.hgetall(self.store_key).items()}
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """返回 (指标名, 标签串, 值) 列表"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("计数器只能递增")
+        self.store.hincr(self.store_key, {self._field(self._label_values(labels)): amount})
+
+    def get(self, **labels) -> float:
+        return self.values().get(self._label_values(labels), 0.0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        """返回各组标签的当前值"""
+        return self._stored_values()
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labelnames, key), value)
+                for key, value in self.values().items()]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def set(self, value: float, **labels) -> None:
+        self.store.hset(self.store_key, {self._field(self._label_values(labels)): float(value)})
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self.store.hincr(self.store_key, {self._field(self._label_values(labels)): amount})
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self._stored_values().get(self._label_values(labels), 0.0)
+
+    def samples(self):
+        if self._collect is not None:
+            # 抓取时才计算的指标（例如磁盘占用）
+            values = self._collect()
+        else:
+            values = self._stored_values()
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        # 每组标签对应若干字段: 各分桶计数、count、sum
+        increments = {self._field(key, 'count'): 1, self._field(key, 'sum'): value}
+        if index < len(self.buckets):
+            increments[self._field(key, str(index))] = 1
+        self.store.hincr(self.store_key, increments)
+
+    def samples(self):
+        states: Dict[LabelValues, List[float]] = {}
+        for field, value in self._stored_values().items():
+            key, slot = field[:-1], field[-1]
+            state = states.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            if slot == 'count':
+                state[-2] = value
+            elif slot == 'sum':
+                state[-1] = value
+            else:
+                state[int(slot)] = value
+
+        result = []
+        for key, state in states.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                result.append((f"{self.name}_bucket",
+                               _format_labels(self.labelnames, key, {'le': _format_value(bound)}),
+                               cumulative))
+            result.append((f"{self.name}_bucket",
+                           _format_labels(self.labelnames, key, {'le': '+Inf'}), state[-2]))
+            result.append((f"{self.name}_count", _format_labels(self.labelnames, key), state[-2]))
+            result.append((f"{self.name}_sum", _format_labels(self.labelnames, key), state[-1]))
+        return result
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self, store: Optional[StateStore] = None):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._store = store
+
+    @property
+    def store(self) -> StateStore:
+        return self._store if self._store is not None else get_state_store()
+
+    def use_store(self, store: StateStore) -> None:
+        """切换指标的存储后端（例如多 worker 部署时使用共享存储）"""
+        self._store = store
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已注册: {metric.name}")
+            self._metrics[metric.name] = metric
+            metric.registry = self
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              collect: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """生成 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = MetricsRegistry()
+
+# 监控的目录，由应用启动时注册
+_watched_dirs: Dict[str, str] = {}
+
+# 目录占用的统计结果最多使用的秒数。遍历目录的开销随媒体库增长，抓取 /metrics 时只读取上次的结果，
+# 过期后在后台线程中重新统计，抓取不会因为遍历目录而超时
+DISK_USAGE_TTL = 60.0
+
+_usage_lock = threading.Lock()
+_usage: Dict[str, Tuple[int, int]] = {}
+_usage_updated_at: Optional[float] = None
+_usage_refreshing = False
+
+
+def watch_directory(name: str, path: str) -> None:
+    """登记需要统计磁盘占用的目录，并在后台开始统计"""
+    global _usage_updated_at
+    with _usage_lock:
+        _watched_dirs[name] = path
+        _usage_updated_at = None
+    _schedule_usage_refresh()
+
+
+def _scan_directory(path: str) -> Tuple[int, int]:
+    """遍历目录，返回 (总字节数, 文件数)"""
+    total_bytes = 0
+    total_files = 0
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for filename in files:
+                try:
+                    total_bytes += os.path.getsize(os.path.join(root, filename))
+                    total_files += 1
+                except OSError:
+                    continue
+    return total_bytes, total_files
+
+
+def refresh_directory_usage() -> Dict[str, Tuple[int, int]]:
+    """重新统计所有登记目录的占用（阻塞）"""
+    global _usage_updated_at, _usage_refreshing
+    try:
+        with _usage_lock:
+            watched = dict(_watched_dirs)
+        usage = {name: _scan_directory(path) for name, path in watched.items()}
+        with _usage_lock:
+            _usage.clear()
+            _usage.update(usage)
+            _usage_updated_at = time.monotonic()
+        return usage
+    finally:
+        with _usage_lock:
+            _usage_refreshing = False
+
+
+def _schedule_usage_refresh() -> None:
+    """统计结果过期且没有正在进行的统计时，启动后台统计线程"""
+    global _usage_refreshing
+    with _usage_lock:
+        fresh = _usage_updated_at is not None and time.monotonic() - _usage_updated_at < DISK_USAGE_TTL
+        if fresh or _usage_refreshing:
+            return
+        _usage_refreshing = True
+    threading.Thread(target=refresh_directory_usage, name='disk-usage', daemon=True).start()
+
+
+def _directory_usage() -> Dict[str, Tuple[int, int]]:
+    """上次统计的目录占用（首次统计完成前为空），过期时触发后台统计"""
+    _schedule_usage_refresh()
+    with _usage_lock:
+        return dict(_usage)
+
+
+def _collect_disk_bytes() -> Dict[LabelValues, float]:
+    return {(name,): used for name, (used, _) in _directory_usage().items()}
+
+
+def _collect_disk_files() -> Dict[LabelValues, float]:
+    return {(name,): files for name, (_, files) in _directory_usage().items()}
+
+
+class AppMetrics:
+    """应用指标集合"""
+
+    HTTP_LATENCY = REGISTRY.histogram(
+        'http_request_duration_seconds', '按接口统计的请求耗时（秒）',
+        ('endpoint', 'method', 'status'))
+    UPLOAD_BYTES = REGISTRY.counter(
+        'upload_bytes_total', '累计上传字节数')
+    UPLOAD_SECONDS = REGISTRY.counter(
+        'upload_seconds_total', '累计上传写盘耗时（秒），与 upload_bytes_total 相除得到字节/秒')
+    UPLOAD_THROUGHPUT = REGISTRY.histogram(
+        'upload_throughput_bytes_per_second', '单个文件的上传写盘吞吐（字节/秒）',
+        buckets=(1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9))
+    COMPOSE_QUEUE_DEPTH = REGISTRY.gauge(
+        'compose_queue_depth', '正在处理或等待处理的合成任务数')
+    COMPOSE_TOTAL = REGISTRY.counter(
+        'compose_jobs_total', '合成任务数', ('status',))
+    COMPOSE_CALLBACKS = REGISTRY.counter(
+        'compose_callbacks_total', '任务结束回调的投递结果', ('status',))
+    TASK_WAITS = REGISTRY.counter(
+        'task_long_polls_total', '长轮询任务状态的请求数（rejected 表示同时等待的请求已达上限，返回 503）', ('result',))
+    TRANSITION_PREVIEWS = REGISTRY.counter(
+        'transition_previews_total', '转场预览请求数（cache=hit 命中缓存，miss 需要渲染）', ('cache',))
+    BATCH_PIECES = REGISTRY.counter(
+        'batch_compose_pieces_total',
+        '批量合成的部分数（rendered 实际渲染，shared 被多个版本共用而省去，resumed 复用中断前的结果）', ('result',))
+    FILE_TRANSFERS = REGISTRY.counter(
+        'file_transfers_total', '下载和预览的文件发送次数（mode=direct 由 Web 进程发送，其他为交给前置代理）', ('mode',))
+    RENDER_FPS = REGISTRY.histogram(
+        'render_frames_per_second', '单次合成的渲染帧率',
+        buckets=(1, 2.5, 5, 10, 15, 24, 30, 60, 120, 240, 480))
+    ENCODE_PER_OUTPUT_SECOND = REGISTRY.histogram(
+        'encode_seconds_per_output_second', '每秒输出视频所需的编码耗时（秒）',
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32))
+    TRANSITION_RENDER_SECONDS = REGISTRY.histogram(
+        'transition_render_seconds', '按转场类型统计的转场窗口渲染耗时（秒）',
+        ('type',))
+    CACHE_REQUESTS = REGISTRY.counter(
+        'cache_requests_total',
+        '缓存查询次数（cache=probe 探测信息、keyframes 关键帧索引、audio_analysis 音频分析），'
+        '命中率为 result="hit" 与全部查询之比', ('cache', 'result'))
+    DISK_USAGE_BYTES = REGISTRY.gauge(
+        'storage_disk_usage_bytes', '目录磁盘占用（字节，后台每分钟统计一次）', ('directory',), collect=_collect_disk_bytes)
+    DISK_USAGE_FILES = REGISTRY.gauge(
+        'storage_files', '目录文件数（后台每分钟统计一次）', ('directory',), collect=_collect_disk_files)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """记录一次缓存查询"""
+    AppMetrics.CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_upload(size_bytes: int, elapsed: float) -> None:
+    """记录单个文件的上传量与耗时"""
+    AppMetrics.UPLOAD_BYTES.inc(size_bytes)
+    AppMetrics.UPLOAD_SECONDS.inc(max(elapsed, 0.0))
+    if elapsed > 0:
+        AppMetrics.UPLOAD_THROUGHPUT.observe(size_bytes / elapsed)
+
+
+def record_render_stats(stats: Dict) -> None:
+    """记录处理器返回的渲染统计（见 AdvancedVideoProcessor.last_render_stats）"""
+    if not stats:
+        return
+    if stats.get('render_fps'):
+        AppMetrics.RENDER_FPS.observe(stats['render_fps'])
+    if stats.get('encode_seconds_per_output_second') is not None:
+        AppMetrics.ENCODE_PER_OUTPUT_SECOND.observe(stats['encode_seconds_per_output_second'])
+    for transition_type, seconds in stats.get('transition_seconds', {}).items():
+        AppMetrics.TRANSITION_RENDER_SECONDS.observe(seconds, type=transition_type)
@@ -0,0 +1,353 @@
+"""
+渲染成本估算模块
+根据源视频的探测信息估算合成耗时，并据此做负载准入控制
+
+成本模型（单位：秒）:
+    耗时 = 固定开销
+         + 非转场帧数 × 每帧像素 × 基础速率 × 编码预设系数
+         + Σ 转场帧数 × 每帧像素 × 转场速率
+         + Σ 额外输出帧数 × 额外输出每帧像素 × 额外输出编码速率 × 编码预设系数
+
+速率以"秒/百万像素帧"表示，按引擎分别统计。moviepy 引擎的转场速率是合成一个转场帧
+（解码两侧片段并叠加）的耗时，基础速率覆盖其余全部开销（普通帧的解码和所有帧的编码）；
+ffmpeg 引擎不单独统计转场，全部帧按基础速率计。每个任务完成后把实际耗时累加到共享状态
+存储，速率取累计耗时/累计工作量，先验值作为若干个虚拟样本参与平均，样本较少时估算也比较稳定。
+"""
+
+import hashlib
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import record_cache_lookup
+from state_store import StateStore, get_state_store
+from ffmpeg_engine import (
+    probe_keyframes, probe_source, safe_transition_duration, trim_source, unsupported_transitions
+)
+from render_options import parse_clip
+
+# x264 编码预设相对 medium 的耗时系数
+PRESET_FACTORS = {
+    'ultrafast': 0.25, 'superfast': 0.35, 'veryfast': 0.5, 'faster': 0.7, 'fast': 0.85,
+    'medium': 1.0, 'slow': 1.6, 'slower': 2.5, 'veryslow': 5.0,
+}
+# 两个引擎当前都使用 libx264 -preset medium -crf 23 输出
+DEFAULT_PRESET = 'medium'
+
+# 先验速率（秒/百万像素帧，medium 预设），来自 3 段 640x360 5 秒合成素材、1 秒转场的实测
+# （上下滑动与左滑实现相同，沿用左滑的值）
+DEFAULT_BASE_RATES = {'moviepy': 0.07, 'ffmpeg': 0.066}
+DEFAULT_TRANSITION_RATES = {
+    'fade': 0.155,
+    'slide_left': 0.056, 'slide_right': 0.056, 'slide_up': 0.056, 'slide_down': 0.056,
+    'zoom_in': 0.28, 'zoom_out': 0.28,
+}
+# 额外输出（rendition）只增加缩放和编码，不参与校准；
+# 实测 testsrc2 720p/360p 缩放加 libx264 medium 编码约 0.032
+RENDITION_ENCODE_RATE = 0.035
+# 进程启动、探测和封装等与时长无关的开销（秒）
+JOB_OVERHEAD_SECONDS = {'moviepy': 1.0, 'ffmpeg': 0.3}
+
+# 先验值折合的工作量（百万像素帧），约等于一段 10 秒 720p 视频
+PRIOR_WORK = 250.0
+
+CALIBRATION_KEY = 'render_cost:calibration'
+# 探测信息缓存：同一个文件在预估和合成时只运行一次 ffmpeg 探测；
+# 上传时建立的关键帧索引也存在同一条缓存里
+PROBE_CACHE_PREFIX = 'probe:'
+PROBE_CACHE_TTL = 24 * 3600
+BACKLOG_KEY = 'render_cost:backlog'
+# 同步渲染的预留按预估耗时的倍数过期，Web 进程被强制终止时占用的容量会自动归还
+RESERVATION_TTL_FACTOR = 4
+RESERVATION_MIN_TTL = 300
+
+
+class AdmissionRejected(Exception):
+    """积压的渲染工作量已满，任务未被接受"""
+
+    def __init__(self, backlog_seconds: float):
+        super().__init__(f"渲染积压已满: {backlog_seconds:.1f}秒")
+        self.backlog_seconds = backlog_seconds
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """文件内容的 SHA-256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _probe_cache_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{PROBE_CACHE_PREFIX}{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cached_probe(path: str, store: Optional[StateStore] = None, keyframes: bool = False,
+                 digest: bool = False) -> Dict[str, Any]:
+    """
+    带缓存的 probe_source，缓存键包含文件大小和修改时间，文件被替换后自动失效
+
+    Args:
+        keyframes: 同时建立关键帧索引（结果中的 keyframes 字段），已有索引时直接复用
+        digest: 同时计算文件内容的 SHA-256（结果中的 sha256 字段），用作转场预览的缓存键
+    """
+    key = _probe_cache_key(path)
+    store = store or get_state_store()
+    info = store.get(key)
+    hit = not (info is None or (keyframes and 'keyframes' not in info) or (digest and 'sha256' not in info))
+    record_cache_lookup('probe', hit)
+    if not hit:
+        info = info or probe_source(path)
+        if keyframes and 'keyframes' not in info:
+            info = dict(info, keyframes=probe_keyframes(path))
+        if digest and 'sha256' not in info:
+            info = dict(info, sha256=file_digest(path))
+        store.set(key, info, ttl=PROBE_CACHE_TTL)
+    return dict(info, path=path, size=tuple(info['size']))
+
+
+def cached_clip(entry: Any, store: Optional[StateStore] = None, digest: bool = False) -> Dict[str, Any]:
+    """video_files 中一项的探测信息，带裁剪点时时长为保留部分（见 trim_source）"""
+    path, start, end = parse_clip(entry)
+    return trim_source(cached_probe(path, store, digest=digest), start, end)
+
+
+def cached_keyframes(path: str, store: Optional[StateStore] = None) -> Optional[List[float]]:
+    """读取已建立的关键帧索引，没有索引（未经上传接口或缓存已过期）时返回 None"""
+    info = (store or get_state_store()).get(_probe_cache_key(path))
+    keyframes = info.get('keyframes') if info else None
+    record_cache_lookup('keyframes', keyframes is not None)
+    return keyframes
+
+
+def rendition_work(frames: int, size: Tuple[int, int], renditions: List[int]) -> float:
+    """额外输出的编码工作量（百万像素帧），宽度按时间线比例缩放"""
+    width, height = size
+    return sum(frames * (target * width / height) * target / 1e6 for target in renditions)
+
+
+def plan_timeline(sources: List[Dict[str, Any]], transitions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    按合成规则计算输出时间线（与两个引擎一致）
+
+    Returns:
+        {'duration', 'fps', 'size', 'frames', 'transition_frames': {类型: 帧数}}
+    """
+    size = tuple(sources[0]['size'])
+    fps = max(source['fps'] for source in sources)
+    accumulated = sources[0]['duration']
+    transition_frames: Dict[str, int] = {}
+    for index in range(1, len(sources)):
+        config = transitions[index - 1] if index - 1 < len(transitions) else {}
+        transition_type = config.get('type', 'fade')
+        duration = safe_transition_duration(float(config.get('duration', 1.0)), accumulated,
+                                            sources[index]['duration'], fps)
+        transition_frames[transition_type] = (
+            transition_frames.get(transition_type, 0) + int(round(duration * fps))
+        )
+        accumulated = accumulated + sources[index]['duration'] - duration
+    return {
+        'duration': accumulated,
+        'fps': fps,
+        'size': size,
+        'frames': int(accumulated * fps),
+        'transition_frames': transition_frames,
+    }
+
+
+def plan_transition_preview(sources: List[Dict[str, Any]], transition: Dict[str, Any],
+                            padding: float) -> Dict[str, float]:
+    """
+    两个片段合成后的时间线上，转场预览要渲染的窗口（秒）
+
+    转场时长按合成规则计算（见 plan_timeline），窗口为转场前后各延伸 padding 秒，不超出时间线。
+
+    Returns:
+        {'start', 'end', 'transition_start', 'transition_duration'}
+    """
+    first, second = sources
+    fps = max(first['fps'], second['fps'])
+    duration = safe_transition_duration(float(transition.get('duration', 1.0)), first['duration'],
+                                        second['duration'], fps)
+    transition_start = first['duration'] - duration
+    return {
+        'start': max(0.0, transition_start - padding),
+        'end': min(first['duration'] + second['duration'] - duration, transition_start + duration + padding),
+        'transition_start': transition_start,
+        'transition_duration': duration,
+    }
+
+
+class RenderCostModel:
+    """渲染耗时估算，速率从历史任务中校准"""
+
+    def __init__(self, store: Optional[StateStore] = None):
+        self._store = store
+
+    @property
+    def store(self) -> StateStore:
+        return self._store or get_state_store()
+
+    def rates(self) -> Dict[str, Any]:
+        """当前校准后的速率（先验值与历史样本加权）"""
+        observed = self.store.hgetall(CALIBRATION_KEY)
+
+        def blended(key: str, prior: float) -> float:
+            seconds = observed.get(f'{key}:seconds', 0.0)
+            work = observed.get(f'{key}:work', 0.0)
+            return (prior * PRIOR_WORK + seconds) / (PRIOR_WORK + work)
+
+        return {
+            'base': {engine: blended(f'base:{engine}', prior) for engine, prior in DEFAULT_BASE_RATES.items()},
+            'transition': {kind: blended(f'transition:{kind}', prior)
+                           for kind, prior in DEFAULT_TRANSITION_RATES.items()},
+            'samples': {engine: int(observed.get(f'jobs:{engine}', 0)) for engine in DEFAULT_BASE_RATES},
+        }
+
+    def estimate(self, video_files: List[str], transitions: List[Dict[str, Any]],
+                 engine: str = 'moviepy', preset: str = DEFAULT_PRESET,
+                 sources: Optional[List[Dict[str, Any]]] = None,
+                 renditions: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        估算合成耗时
+
+        Args:
+            video_files: 视频文件路径或带裁剪点的片段列表（见 parse_clip）
+            transitions: 转场配置列表
+            engine: 请求的渲染引擎；ffmpeg 无法表达的转场按 moviepy 估算
+            preset: x264 编码预设
+            sources: 已有的探测信息（probe_source 的结果），省略时读取探测缓存
+            renditions: 额外输出的高度列表
+
+        Returns:
+            预测耗时及其构成
+        """
+        if sources is None:
+            sources = [cached_clip(entry, self._store) for entry in video_files]
+        if engine == 'ffmpeg' and unsupported_transitions(transitions):
+            engine = 'moviepy'
+
+        timeline = plan_timeline(sources, transitions)
+        megapixels = timeline['size'][0] * timeline['size'][1] / 1e6
+        rates = self.rates()
+        preset_factor = PRESET_FACTORS.get(preset, 1.0)
+
+        base_frames = timeline['frames']
+        transition_seconds = {}
+        if engine == 'moviepy':
+            for kind, frames in timeline['transition_frames'].items():
+                rate = rates['transition'].get(kind, max(DEFAULT_TRANSITION_RATES.values()))
+                transition_seconds[kind] = frames * megapixels * rate
+                base_frames -= frames
+        base_work = max(base_frames, 0) * megapixels
+        base_seconds = base_work * rates['base'][engine] * preset_factor
+        rendition_seconds = (rendition_work(timeline['frames'], timeline['size'], renditions or [])
+                             * RENDITION_ENCODE_RATE * preset_factor)
+        overhead = JOB_OVERHEAD_SECONDS[engine]
+
+        return {
+            'engine': engine,
+            'preset': preset,
+            'output_duration': timeline['duration'],
+            'output_frames': timeline['frames'],
+            'output_size': timeline['size'],
+            'megapixel_frames': round(base_work, 3),
+            'transition_frames': timeline['transition_frames'],
+            'breakdown': {
+                'overhead': overhead,
+                'frames': round(base_seconds, 3),
+                'transitions': {kind: round(value, 3) for kind, value in transition_seconds.items()},
+                'renditions': round(rendition_seconds, 3),
+            },
+            'estimated_seconds': round(overhead + base_seconds + sum(transition_seconds.values())
+                                       + rendition_seconds, 3),
+            'calibration_samples': rates['samples'][engine],
+        }
+
+    def observe(self, stats: Dict[str, Any], elapsed: float, preset: str = DEFAULT_PRESET) -> None:
+        """
+        用一次任务的实际耗时校准速率
+
+        Args:
+            stats: AdvancedVideoProcessor.last_render_stats
+            elapsed: 任务总耗时（秒）
+        """
+        engine = stats.get('engine')
+        size = stats.get('output_size')
+        if engine not in DEFAULT_BASE_RATES or not size or not stats.get('output_frames'):
+            return
+        megapixels = size[0] * size[1] / 1e6
+        preset_factor = PRESET_FACTORS.get(preset, 1.0)
+
+        increments = {f'jobs:{engine}': 1}
+        transition_total = 0.0
+        base_frames = stats['output_frames']
+        for kind, seconds in (stats.get('transition_seconds') or {}).items():
+            frames = (stats.get('transition_frames') or {}).get(kind)
+            if not frames:
+                continue
+            increments[f'transition:{kind}:seconds'] = seconds
+            increments[f'transition:{kind}:work'] = frames * megapixels
+            transition_total += seconds
+            base_frames -= frames
+
+        # 与 estimate 相同的划分：转场帧只按转场速率计，额外输出按固定编码速率扣除，
+        # 其余耗时摊到非转场帧上
+        heights = [output['height'] for output in stats.get('renditions') or []]
+        rendition_seconds = (rendition_work(stats['output_frames'], size, heights)
+                             * RENDITION_ENCODE_RATE * preset_factor)
+        base_seconds = max(elapsed - JOB_OVERHEAD_SECONDS[engine] - transition_total - rendition_seconds, 0.0)
+        increments[f'base:{engine}:seconds'] = base_seconds / preset_factor
+        increments[f'base:{engine}:work'] = max(base_frames, 0) * megapixels
+        self.store.hincr(CALIBRATION_KEY, increments)
+
+
+def admission_capacity(slots: int, max_wait_seconds: float) -> Optional[float]:
+    """可接受的积压工作量上限（秒），max_wait_seconds <= 0 表示不限制"""
+    return max(1, slots) * max_wait_seconds if max_wait_seconds > 0 else None
+
+
+def admission_decision(estimated_seconds: float, backlog_seconds: float, slots: int,
+                       max_wait_seconds: float) -> Dict[str, Any]:
+    """
+    负载准入判断
+
+    并行渲染槽位 slots 个，积压工作量（秒）超过 slots × max_wait_seconds 时拒绝。
+    当前没有积压时总是接受，避免单个大任务永远无法提交。
+
+    Returns:
+        {'admit', 'retry_after', 'expected_wait_seconds', 'backlog_seconds'}
+    """
+    slots = max(1, slots)
+    backlog_seconds = max(0.0, backlog_seconds)
+    capacity = admission_capacity(slots, max_wait_seconds)
+    admit = capacity is None or backlog_seconds <= 0 or backlog_seconds + estimated_seconds <= capacity
+    retry_after = 0 if admit else max(1, math.ceil((backlog_seconds + estimated_seconds - capacity) / slots))
+    return {
+        'admit': admit,
+        'retry_after': retry_after,
+        'expected_wait_seconds': round(backlog_seconds / slots, 3),
+        'backlog_seconds': round(backlog_seconds, 3),
+    }
+
+
+def reserve_backlog(job_id: str, seconds: float, capacity: Optional[float],
+                    store: Optional[StateStore] = None) -> Tuple[bool, float]:
+    """
+    同步合成模式下原子地做准入判断并登记该任务的预估耗时
+
+    Returns:
+        (是否接受, 登记前的积压工作量)
+    """
+    ttl = max(RESERVATION_MIN_TTL, seconds * RESERVATION_TTL_FACTOR)
+    return (store or get_state_store()).reserve(BACKLOG_KEY, job_id, seconds, capacity, ttl)
+
+
+def release_backlog(job_id: str, store: Optional[StateStore] = None) -> None:
+    (store or get_state_store()).release(BACKLOG_KEY, job_id)
+
+
+def sync_backlog_seconds(store: Optional[StateStore] = None) -> float:
+    return max(0.0, (store or get_state_store()).reserved(BACKLOG_KEY))
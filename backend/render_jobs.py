@@ -0,0 +1,625 @@
+"""
+渲染任务模块
+合成任务的执行逻辑，以及 Web 进程与渲染 worker 之间基于 Redis 的任务队列
+
+队列结构（键名均带 namespace 前缀）:
+    render:queue:<优先级>:<客户端>  该客户端在该优先级下等待中的任务 ID 列表
+    render:clients:<优先级>        有等待任务的客户端（有序集合，分值为最近一次被服务的时间）
+    render:running                各客户端正在运行的任务数
+    render:notify                 新任务/并发额度释放的唤醒信号
+    render:backlog                未结束任务的预估耗时（任务 ID -> 秒），用于准入控制
+    render:processing:<worker>    worker 已领取、正在处理的任务 ID
+    render:job:<id>              任务哈希（状态、参数、进度、结果）
+    render:events:<id>           任务状态变化的发布频道，长轮询状态接口订阅它
+    render:worker:<id>           worker 心跳，带过期时间
+    render:workers               已注册的 worker 集合
+"""
+
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from batch_compose import BatchRenderer, plan_batch
+from metrics import AppMetrics, record_render_stats
+from render_cost import RenderCostModel, AdmissionRejected
+from render_profiler import RenderProfiler
+from render_options import DEFAULT_FRAME_TRANSPORT, DEFAULT_MP4_LAYOUT, ProgressCallback
+from storage import Storage, localize_clip
+from webhooks import send_callback
+
+# 任务状态，与前端及 /api/task 接口保持一致
+PENDING = 'PENDING'
+STARTED = 'STARTED'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+CANCELLED = 'CANCELLED'
+FINISHED_STATES = (SUCCESS, FAILURE, CANCELLED)
+
+# 优先级类别，从高到低：草稿预览优先于正式导出
+PRIORITIES = ('draft', 'normal', 'final')
+DEFAULT_PRIORITY = 'normal'
+
+# 合成任务接受的参数
+JOB_OPTIONS = ('video_files', 'transitions', 'output_filename', 'fit_mode', 'pad_color', 'engine', 'profile',
+               'renditions', 'mp4_layout', 'callback_url', 'loudness_target')
+# 批量合成任务接受的参数，每个版本的参数见 batch_compose.VARIANT_OPTIONS
+BATCH_JOB_OPTIONS = ('variants', 'fit_mode', 'pad_color', 'mp4_layout', 'callback_url', 'loudness_target')
+
+
+def run_compose_job(payload: Dict[str, Any], output_dir: str, profile_dir: Optional[str] = None,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    checkpoint_dir: Optional[str] = None,
+                    frame_transport: str = DEFAULT_FRAME_TRANSPORT) -> Dict[str, Any]:
+    """
+    执行一次合成任务，记录指标并校准成本模型，Web 进程同步合成和渲染 worker 共用
+
+    Args:
+        payload: 合成参数（见 JOB_OPTIONS），已通过接口校验
+        output_dir: 输出目录
+        profile_dir: 函数级剖析结果的导出目录
+        progress_callback: 进度回调 (完成比例, 阶段)
+        checkpoint_dir: 分段检查点目录，任务中断后用同一目录重新运行时从最后完成的分段继续
+        frame_transport: moviepy 引擎的取帧方式（RENDER_FRAME_TRANSPORT，见 FRAME_TRANSPORTS）
+
+    Returns:
+        合成结果（output_path、output_filename、engine，启用剖析时包含 profile）；
+        批量合成任务（payload 中有 variants）的结果见 run_batch_job
+    """
+    if 'variants' in payload:
+        return run_batch_job(payload, output_dir, progress_callback, checkpoint_dir)
+
+    # moviepy/numpy 只在真正渲染时导入，API 进程启动和健康检查不承担这部分开销
+    from advanced_video_processor import AdvancedVideoProcessor
+
+    profile = payload.get('profile', False)
+    profiler = None
+    if profile:
+        profiler = RenderProfiler(profile_mode=None if profile is True else profile, dump_dir=profile_dir)
+    processor = AdvancedVideoProcessor(output_dir=output_dir, profiler=profiler,
+                                       progress_callback=progress_callback, checkpoint_dir=checkpoint_dir,
+                                       frame_transport=frame_transport)
+
+    start = time.perf_counter()
+    try:
+        output_path = processor.compose_videos_advanced(
+            # 对象存储中的片段先下载到本机缓存（已缓存的直接复用）
+            video_files=[localize_clip(entry) for entry in payload['video_files']],
+            transitions=list(payload.get('transitions') or []),
+            output_filename=payload.get('output_filename'),
+            fit_mode=payload.get('fit_mode', 'contain'),
+            pad_color=payload.get('pad_color', 'black'),
+            engine=payload.get('engine', 'moviepy'),
+            renditions=payload.get('renditions'),
+            mp4_layout=payload.get('mp4_layout', DEFAULT_MP4_LAYOUT),
+            loudness_target=payload.get('loudness_target')
+        )
+    except Exception:
+        AppMetrics.COMPOSE_TOTAL.inc(status='failure')
+        raise
+
+    record_render_stats(processor.last_render_stats)
+    AppMetrics.COMPOSE_TOTAL.inc(status='success')
+    # 用实际耗时校准成本模型（剖析会拖慢渲染、复用检查点的耗时偏短，都不参与校准）
+    if profiler is None and not processor.last_render_stats.get('resumed_segments'):
+        RenderCostModel().observe(processor.last_render_stats, time.perf_counter() - start)
+
+    result = {
+        'status': SUCCESS,
+        'output_path': output_path,
+        'output_filename': os.path.basename(output_path),
+        'engine': processor.last_render_stats.get('engine'),
+        'renditions': [
+            dict(output, output_filename=os.path.basename(output['output_path']))
+            for output in processor.last_render_stats.get('renditions') or []
+        ],
+        'message': '视频合成成功完成'
+    }
+    if 'loudness_gains_db' in processor.last_render_stats:
+        result['loudness_gains_db'] = processor.last_render_stats['loudness_gains_db']
+    if profiler is not None:
+        result['profile'] = processor.last_render_stats.get('profile')
+    return result
+
+
+def run_batch_job(payload: Dict[str, Any], output_dir: str,
+                  progress_callback: Optional[ProgressCallback] = None,
+                  checkpoint_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    执行批量合成任务：规划所有版本共享的部分，每个唯一的部分只渲染一次，再拼接出各个版本
+
+    Args:
+        payload: 批量合成参数（见 BATCH_JOB_OPTIONS），已通过接口校验
+        checkpoint_dir: 已渲染部分的存放目录，任务中断后用同一目录重新运行时直接复用；
+            省略时使用输出目录中的临时目录，任务结束后删除
+
+    Returns:
+        {'status', 'engine', 'variants': [{'output_path', 'output_filename', 'output_duration'}],
+         'pieces': {'total', 'unique', 'reused'}, 'rendered_frames', 'timeline_frames', 'message'}
+    """
+    variants = [
+        dict(variant, video_files=[localize_clip(entry) for entry in variant['video_files']],
+             output_filename=variant.get('output_filename') or f"advanced_composed_{uuid.uuid4().hex[:8]}.mp4")
+        for variant in payload['variants']
+    ]
+    fit_mode = payload.get('fit_mode', 'contain')
+    pad_color = payload.get('pad_color', 'black')
+    piece_dir = os.path.join(checkpoint_dir, 'pieces') if checkpoint_dir else \
+        os.path.join(output_dir, f".batch_{uuid.uuid4().hex[:8]}")
+    try:
+        plan = plan_batch(variants, fit_mode, pad_color, payload.get('loudness_target'))
+        os.makedirs(output_dir, exist_ok=True)
+        stats = BatchRenderer(piece_dir, payload.get('mp4_layout', DEFAULT_MP4_LAYOUT),
+                              progress_callback).render(plan, output_dir, fit_mode, pad_color)
+    except Exception:
+        AppMetrics.COMPOSE_TOTAL.inc(status='failure')
+        raise
+    finally:
+        if not checkpoint_dir:
+            shutil.rmtree(piece_dir, ignore_errors=True)
+
+    AppMetrics.COMPOSE_TOTAL.inc(status='success')
+    # 部分的尺寸各不相同，批量任务不参与成本模型校准
+    AppMetrics.BATCH_PIECES.inc(stats['pieces_unique'] - stats['reused_pieces'], result='rendered')
+    AppMetrics.BATCH_PIECES.inc(stats['pieces_total'] - stats['pieces_unique'], result='shared')
+    AppMetrics.BATCH_PIECES.inc(stats['reused_pieces'], result='resumed')
+
+    outputs = []
+    for variant, output in zip(plan['variants'], stats['outputs']):
+        output = dict(output, output_filename=variant['output_filename'])
+        if variant['loudness_gains_db'] is not None:
+            output['loudness_gains_db'] = variant['loudness_gains_db']
+        outputs.append(output)
+    return {
+        'status': SUCCESS,
+        'engine': stats['engine'],
+        'variants': outputs,
+        'pieces': {'total': stats['pieces_total'], 'unique': stats['pieces_unique'],
+                   'reused': stats['reused_pieces']},
+        'rendered_frames': stats['rendered_frames'],
+        'timeline_frames': stats['timeline_frames'],
+        'message': f"批量合成成功完成: {len(outputs)} 个版本"
+    }
+
+
+def output_filenames(result: Dict[str, Any]) -> List[str]:
+    """合成结果中的主输出文件名（批量合成为每个版本的输出）"""
+    return [output['output_filename'] for output in result.get('variants') or [result]]
+
+
+def publish_outputs(result: Dict[str, Any], storage: Storage) -> Dict[str, Any]:
+    """
+    把渲染结果（主输出和额外输出，批量合成为每个版本的输出）移入输出存储，output_path 改为存储中的位置
+
+    渲染写在任务临时目录中，完成后才移入存储，下载接口不会读到未写完的文件。
+    """
+    for main in result.get('variants') or [result]:
+        for output in [main] + main.get('renditions', []):
+            storage.save_file(output['output_filename'], output['output_path'], move=True)
+            output['output_path'] = storage.locator(output['output_filename'])
+    return result
+
+
+# 领取任务：按优先级从高到低，同一优先级内按客户端轮转（最久未被服务的客户端优先），
+# 跳过已达到并发上限的客户端；领取、计数和状态更新在一个脚本内原子完成
+_CLAIM_SCRIPT = """
+local prefix, worker, limit, now = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4]
+for i = 5, #ARGV do
+  local priority = ARGV[i]
+  local clients_key = prefix .. 'clients:' .. priority
+  for _, client in ipairs(redis.call('ZRANGE', clients_key, 0, -1)) do
+    local running = tonumber(redis.call('HGET', prefix .. 'running', client) or '0')
+    local queue_key = prefix .. 'queue:' .. priority .. ':' .. client
+    if running < limit then
+      local job_id = redis.call('RPOP', queue_key)
+      if job_id then
+        local job_key = prefix .. 'job:' .. job_id
+        redis.call('LPUSH', prefix .. 'processing:' .. worker, job_id)
+        redis.call('HINCRBY', prefix .. 'running', client, 1)
+        redis.call('HSET', job_key, 'state', 'STARTED', 'worker', worker, 'started_at', now)
+        local attempts = redis.call('HINCRBY', job_key, 'attempts', 1)
+        redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'STARTED')
+        if redis.call('LLEN', queue_key) == 0 then
+          redis.call('ZREM', clients_key, client)
+        else
+          redis.call('ZADD', clients_key, now, client)
+        end
+        return {job_id, redis.call('HGET', job_key, 'payload') or '', attempts,
+                redis.call('HGET', job_key, 'request_id') or ''}
+      end
+      redis.call('ZREM', clients_key, client)
+    end
+  end
+end
+return false
+"""
+
+# 积压工作量：未结束任务的预估耗时之和
+_BACKLOG = """
+local function backlog_total(prefix)
+  local total = 0
+  for _, seconds in ipairs(redis.call('HVALS', prefix .. 'backlog')) do
+    total = total + tonumber(seconds)
+  end
+  return total
+end
+"""
+
+# 提交任务：准入判断和入队在一个脚本内完成，并发提交不会同时越过容量上限
+_ENQUEUE_SCRIPT = _BACKLOG + """
+local prefix, job_id, client, priority, now = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5]
+local estimated, capacity = tonumber(ARGV[6]), tonumber(ARGV[7])
+local backlog = backlog_total(prefix)
+if capacity and backlog > 0 and backlog + estimated > capacity then
+  return {0, tostring(backlog)}
+end
+redis.call('HSET', prefix .. 'job:' .. job_id, unpack(ARGV, 8))
+redis.call('HSET', prefix .. 'backlog', job_id, ARGV[6])
+redis.call('LPUSH', prefix .. 'queue:' .. priority .. ':' .. client, job_id)
+redis.call('ZADD', prefix .. 'clients:' .. priority, 'NX', now, client)
+redis.call('LPUSH', prefix .. 'notify', 1)
+redis.call('LTRIM', prefix .. 'notify', 0, 0)
+return {1, tostring(backlog)}
+"""
+
+# 结束任务：从 worker 的处理列表移除并归还客户端并发额度（只归还一次），写入最终状态
+_FINISH_SCRIPT = """
+local prefix, worker, job_id, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local job_key = prefix .. 'job:' .. job_id
+if redis.call('LREM', prefix .. 'processing:' .. worker, 0, job_id) > 0 then
+  local client = redis.call('HGET', job_key, 'client')
+  if client and redis.call('HINCRBY', prefix .. 'running', client, -1) <= 0 then
+    redis.call('HDEL', prefix .. 'running', client)
+  end
+end
+redis.call('HDEL', prefix .. 'backlog', job_id)
+redis.call('HSET', job_key, unpack(ARGV, 5))
+redis.call('EXPIRE', job_key, ttl)
+redis.call('PUBLISH', prefix .. 'events:' .. job_id, redis.call('HGET', job_key, 'state'))
+redis.call('LPUSH', prefix .. 'notify', 1)
+redis.call('LTRIM', prefix .. 'notify', 0, 0)
+"""
+
+# 取消任务：等待中的任务直接移出队列；运行中的任务设置取消标记，由 worker 终止渲染进程
+_CANCEL_SCRIPT = """
+local prefix, job_id, now, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local job_key = prefix .. 'job:' .. job_id
+local state = redis.call('HGET', job_key, 'state')
+if not state then
+  return false
+end
+if state == 'PENDING' then
+  local priority = redis.call('HGET', job_key, 'priority')
+  local client = redis.call('HGET', job_key, 'client')
+  redis.call('LREM', prefix .. 'queue:' .. priority .. ':' .. client, 0, job_id)
+  redis.call('HDEL', prefix .. 'backlog', job_id)
+  redis.call('HSET', job_key, 'state', 'CANCELLED', 'finished_at', now)
+  redis.call('EXPIRE', job_key, ttl)
+  redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'CANCELLED')
+  return 'CANCELLED'
+end
+if state == 'STARTED' then
+  redis.call('HSET', job_key, 'cancel_requested', 1)
+  redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'CANCELLING')
+  return 'CANCELLING'
+end
+return state
+"""
+
+# 回收失联 worker 的一个任务：放回所属客户端队列的队首，并排到轮转的最前面
+_REQUEUE_SCRIPT = """
+local prefix, worker, max_attempts, now, ttl, error = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5], ARGV[6]
+local job_id = redis.call('RPOP', prefix .. 'processing:' .. worker)
+if not job_id then
+  return false
+end
+local job_key = prefix .. 'job:' .. job_id
+local client = redis.call('HGET', job_key, 'client')
+if client and redis.call('HINCRBY', prefix .. 'running', client, -1) <= 0 then
+  redis.call('HDEL', prefix .. 'running', client)
+end
+if redis.call('HGET', job_key, 'cancel_requested') == '1' then
+  redis.call('HDEL', prefix .. 'backlog', job_id)
+  redis.call('HSET', job_key, 'state', 'CANCELLED', 'finished_at', now)
+  redis.call('EXPIRE', job_key, ttl)
+  redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'CANCELLED')
+  return {job_id, 'CANCELLED'}
+end
+if tonumber(redis.call('HGET', job_key, 'attempts') or '0') >= max_attempts then
+  redis.call('HDEL', prefix .. 'backlog', job_id)
+  redis.call('HSET', job_key, 'state', 'FAILURE', 'error', error, 'finished_at', now)
+  redis.call('EXPIRE', job_key, ttl)
+  redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'FAILURE')
+  return {job_id, 'FAILURE'}
+end
+local priority = redis.call('HGET', job_key, 'priority')
+redis.call('RPUSH', prefix .. 'queue:' .. priority .. ':' .. client, job_id)
+redis.call('ZADD', prefix .. 'clients:' .. priority, 0, client)
+redis.call('HSET', job_key, 'state', 'PENDING', 'progress', 0, 'stage', '')
+redis.call('PUBLISH', prefix .. 'events:' .. job_id, 'PENDING')
+return {job_id, 'PENDING'}
+"""
+
+
+class RenderQueue:
+    """
+    基于 Redis 的渲染任务队列
+
+    每个 (优先级, 客户端) 一个等待列表；worker 领取时按优先级从高到低、
+    同优先级内按客户端轮转，单个客户端同时运行的任务数不超过 client_concurrency，
+    避免一个用户提交大量任务时占满所有渲染节点。
+    """
+
+    def __init__(self, url: str, namespace: str = 'video_synthesis:',
+                 heartbeat_ttl: float = 30, job_ttl: float = 7 * 24 * 3600, max_attempts: int = 3,
+                 client_concurrency: int = 2):
+        import redis  # 仅在启用任务队列时导入
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.namespace = namespace
+        self.prefix = namespace + 'render:'
+        self.heartbeat_ttl = heartbeat_ttl
+        self.job_ttl = job_ttl
+        self.max_attempts = max_attempts
+        self.client_concurrency = client_concurrency
+        self._enqueue = self.client.register_script(_ENQUEUE_SCRIPT)
+        self._claim = self.client.register_script(_CLAIM_SCRIPT)
+        self._finish_job = self.client.register_script(_FINISH_SCRIPT)
+        self._cancel = self.client.register_script(_CANCEL_SCRIPT)
+        self._requeue = self.client.register_script(_REQUEUE_SCRIPT)
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ':'.join(parts)
+
+    def _processing_key(self, worker_id: str) -> str:
+        return self._key('processing', worker_id)
+
+    def _job_key(self, job_id: str) -> str:
+        return self._key('job', job_id)
+
+    # ---- Web 进程 ----
+
+    def enqueue(self, payload: Dict[str, Any], client_id: str = 'anonymous',
+                priority: str = DEFAULT_PRIORITY, estimated_seconds: float = 0.0,
+                capacity_seconds: Optional[float] = None, job_id: Optional[str] = None,
+                request_id: Optional[str] = None) -> str:
+        """
+        提交任务
+
+        Args:
+            payload: 合成参数
+            client_id: 提交任务的客户端，用于公平调度和并发限制
+            priority: 优先级类别（见 PRIORITIES）
+            estimated_seconds: 预估渲染耗时，计入积压工作量直到任务结束
+            capacity_seconds: 积压工作量上限，None 表示不限制；当前没有积压时总是接受
+            request_id: 提交任务的请求 ID，worker 渲染时附加到日志，便于把请求和渲染日志关联起来
+
+        Returns:
+            任务 ID
+
+        Raises:
+            AdmissionRejected: 积压工作量加上本任务超过 capacity_seconds
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"不支持的优先级: {priority}，可选: {', '.join(PRIORITIES)}")
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        fields = {
+            'state': PENDING,
+            'payload': json.dumps(payload, ensure_ascii=False),
+            'client': client_id,
+            'priority': priority,
+            'progress': 0,
+            'stage': '',
+            'attempts': 0,
+            'estimated_seconds': estimated_seconds,
+            'callback_url': payload.get('callback_url') or '',
+            'request_id': request_id or '',
+            'created_at': now,
+        }
+        args = [self.prefix, job_id, client_id, priority, now, repr(float(estimated_seconds)),
+                '' if capacity_seconds is None else capacity_seconds]
+        for field, value in fields.items():
+            args += [field, value]
+        admitted, backlog = self._enqueue(args=args)
+        if not admitted:
+            raise AdmissionRejected(float(backlog))
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态，不存在时返回 None"""
+        data = self.client.hgetall(self._job_key(job_id))
+        if not data:
+            return None
+        job = {
+            'id': job_id,
+            'state': data.get('state', PENDING),
+            'client': data.get('client'),
+            'priority': data.get('priority'),
+            'progress': float(data.get('progress') or 0),
+            'stage': data.get('stage') or None,
+            'worker': data.get('worker') or None,
+            'attempts': int(data.get('attempts') or 0),
+            'estimated_seconds': float(data.get('estimated_seconds') or 0),
+            'cancel_requested': data.get('cancel_requested') == '1',
+            'error': data.get('error') or None,
+            'result': json.loads(data['result']) if data.get('result') else None,
+            'callback_url': data.get('callback_url') or None,
+            'request_id': data.get('request_id') or None,
+        }
+        for field in ('created_at', 'started_at', 'finished_at'):
+            job[field] = float(data[field]) if data.get(field) else None
+        return job
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        取消任务
+
+        Returns:
+            CANCELLED（等待中的任务已移出队列）、CANCELLING（运行中的任务将被 worker 终止）、
+            已结束任务的最终状态，任务不存在时返回 None
+        """
+        state = self._cancel(args=[self.prefix, job_id, time.time(), int(self.job_ttl)]) or None
+        if state == CANCELLED:
+            self._notify_finished(job_id)
+        return state
+
+    def wait_for_change(self, job_id: str, state: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        长轮询：阻塞直到任务状态不再是 state 或超时
+
+        先订阅任务的事件频道再读取状态，订阅之前发生的变化不会被漏掉。
+
+        Returns:
+            最新的任务状态，任务不存在时返回 None
+        """
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self._key('events', job_id))
+            deadline = time.monotonic() + timeout
+            while True:
+                job = self.get_job(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job['state'] != state or remaining <= 0:
+                    return job
+                pubsub.get_message(timeout=remaining)
+        finally:
+            pubsub.close()
+
+    def pending_count(self, priority: Optional[str] = None) -> int:
+        """等待中的任务数"""
+        total = 0
+        for name in ([priority] if priority else PRIORITIES):
+            clients = self.client.zrange(self._key('clients', name), 0, -1)
+            if clients:
+                pipe = self.client.pipeline(transaction=False)
+                for client_id in clients:
+                    pipe.llen(self._key('queue', name, client_id))
+                total += sum(pipe.execute())
+        return total
+
+    def backlog_seconds(self) -> float:
+        """等待中和运行中任务的预估耗时之和"""
+        return sum(float(seconds) for seconds in self.client.hvals(self._key('backlog')))
+
+    def running_by_client(self) -> Dict[str, int]:
+        """各客户端正在运行的任务数"""
+        return {client_id: int(count) for client_id, count in self.client.hgetall(self._key('running')).items()}
+
+    def workers(self) -> List[Dict[str, Any]]:
+        """存活 worker 的心跳信息"""
+        alive = []
+        for worker_id in sorted(self.client.smembers(self._key('workers'))):
+            info = self.client.get(self._key('worker', worker_id))
+            if info:
+                alive.append(json.loads(info))
+        return alive
+
+    # ---- 渲染 worker ----
+
+    def heartbeat(self, worker_id: str, info: Optional[Dict[str, Any]] = None) -> None:
+        """刷新 worker 心跳，超过 heartbeat_ttl 未刷新视为失联"""
+        info = dict(info or {}, id=worker_id, heartbeat_at=time.time())
+        pipe = self.client.pipeline(transaction=False)
+        pipe.sadd(self._key('workers'), worker_id)
+        pipe.set(self._key('worker', worker_id), json.dumps(info, ensure_ascii=False),
+                 px=int(self.heartbeat_ttl * 1000))
+        pipe.execute()
+
+    def unregister(self, worker_id: str) -> None:
+        """worker 正常退出时注销"""
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self._key('worker', worker_id))
+        pipe.srem(self._key('workers'), worker_id)
+        pipe.execute()
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        领取一个可运行的任务（不阻塞），任务 ID 原子地移入该 worker 的处理列表
+
+        Returns:
+            {'id', 'payload', 'attempts', 'request_id'}，没有可运行的任务时返回 None
+        """
+        claimed = self._claim(args=[self.prefix, worker_id, self.client_concurrency, time.time(), *PRIORITIES])
+        if not claimed:
+            return None
+        job_id, payload, attempts, request_id = claimed
+        if not payload:
+            # 任务哈希已过期或被删除
+            self.fail(worker_id, job_id, '任务数据丢失')
+            return None
+        return {'id': job_id, 'payload': json.loads(payload), 'attempts': int(attempts),
+                'request_id': request_id or None}
+
+    def wait_for_work(self, timeout: float) -> None:
+        """阻塞等待新任务入队或有任务结束（并发额度释放），最多 timeout 秒"""
+        self.client.blpop(self._key('notify'), timeout=timeout)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        return self.client.hget(self._job_key(job_id), 'cancel_requested') == '1'
+
+    def update_progress(self, job_id: str, progress: float, stage: str) -> None:
+        self.client.hset(self._job_key(job_id), mapping={'progress': round(progress, 4), 'stage': stage})
+
+    def _finish(self, worker_id: str, job_id: str, mapping: Dict[str, Any]) -> None:
+        fields = []
+        for field, value in dict(mapping, finished_at=time.time()).items():
+            fields += [field, value]
+        self._finish_job(args=[self.prefix, worker_id, job_id, int(self.job_ttl), *fields])
+        self._notify_finished(job_id)
+
+    def _notify_finished(self, job_id: str) -> None:
+        """任务结束后向提交时指定的 callback_url 投递回调（后台线程）"""
+        job = self.get_job(job_id)
+        if job is not None and job['callback_url']:
+            send_callback(job['callback_url'], job_id, job['state'], job['result'], job['error'])
+
+    def complete(self, worker_id: str, job_id: str, result: Dict[str, Any]) -> None:
+        self._finish(worker_id, job_id, {
+            'state': SUCCESS, 'progress': 1, 'stage': 'done',
+            'result': json.dumps(result, ensure_ascii=False),
+        })
+
+    def fail(self, worker_id: str, job_id: str, error: str) -> None:
+        self._finish(worker_id, job_id, {'state': FAILURE, 'error': error})
+
+    def mark_cancelled(self, worker_id: str, job_id: str) -> None:
+        self._finish(worker_id, job_id, {'state': CANCELLED, 'stage': 'cancelled'})
+
+    def requeue_orphans(self) -> List[str]:
+        """
+        回收心跳超时的 worker 手中的任务
+
+        重新入队的任务由接手的 worker 从检查点继续（检查点目录见 RenderWorker 的 checkpoint_root，
+        只有它是所有 worker 共享的存储时才能在另一台机器上继续，否则从头渲染；ffmpeg 引擎没有分段检查点）；
+        超过 max_attempts 的任务标记为失败，已请求取消的任务直接标记为已取消。
+
+        Returns:
+            被重新入队的任务 ID
+        """
+        requeued = []
+        for worker_id in self.client.smembers(self._key('workers')):
+            if self.client.exists(self._key('worker', worker_id)):
+                continue
+            while True:
+                outcome = self._requeue(args=[
+                    self.prefix, worker_id, self.max_attempts, time.time(), int(self.job_ttl),
+                    f'渲染 worker 失联，已重试 {self.max_attempts} 次'
+                ])
+                if not outcome:
+                    break
+                job_id, state = outcome
+                if state == PENDING:
+                    requeued.append(job_id)
+                else:
+                    AppMetrics.COMPOSE_QUEUE_DEPTH.dec()
+                    self._notify_finished(job_id)
+            self.client.srem(self._key('workers'), worker_id)
+        return requeued
+
+
+def default_worker_id() -> str:
+    """主机名 + 进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
@@ -0,0 +1,111 @@
+"""
+合成参数定义
+片段裁剪点、渲染引擎、MP4 封装方式、额外输出、转场预览、尺寸适配方式、填充颜色、帧传输方式的取值，以及对应的 ffmpeg 尺寸统一滤镜。
+不依赖 moviepy/numpy，API 进程做参数校验时只导入这个模块，启动保持在毫秒级。
+"""
+
+import re
+from typing import Any, Callable, Optional, Tuple
+
+# 可选的渲染引擎：moviepy 逐帧合成，ffmpeg 单进程滤镜图
+ENGINES = ('moviepy', 'ffmpeg')
+
+# 进度回调: (完成比例 0~1, 当前阶段)
+ProgressCallback = Callable[[float, str], None]
+
+# MP4 封装方式及对应的 -movflags：
+#   faststart  编码结束后把 moov 移到文件头，浏览器拿到开头几百 KB 即可开始播放（默认）
+#   fragmented 分片 MP4，moov 在文件头且不含样本表，边写边可播放，适合超长输出
+#   standard   moov 在文件末尾（ffmpeg 默认行为），播放前需要先取到文件尾部
+MP4_LAYOUTS = {
+    'faststart': ['-movflags', '+faststart'],
+    'fragmented': ['-movflags', '+frag_keyframe+empty_moov+default_base_moof'],
+    'standard': [],
+}
+DEFAULT_MP4_LAYOUT = 'faststart'
+
+# 额外输出（rendition）：时间线合成一次，按高度等比缩放后分别编码
+MAX_RENDITIONS = 4
+RENDITION_HEIGHT_RANGE = (144, 4320)
+
+# 转场预览：只渲染转场窗口和前后各 PREVIEW_PADDING_SECONDS 秒，默认按 PREVIEW_HEIGHT 高度缩小
+PREVIEW_HEIGHT = 240
+PREVIEW_PADDING_SECONDS = 1.0
+
+# moviepy 引擎从解码器取帧的方式：
+#   pipe           在合成进程内读取 ffmpeg 管道（默认）
+#   shared_memory  读取线程把帧提前读入共享内存环形缓冲区，合成按视图取帧，解码与合成并行
+FRAME_TRANSPORTS = ('pipe', 'shared_memory')
+DEFAULT_FRAME_TRANSPORT = 'pipe'
+
+
+def parse_clip(entry: Any) -> Tuple[str, float, Optional[float]]:
+    """
+    解析 video_files 中的一项
+
+    每一项是文件路径，或带裁剪点的 {'file': 路径, 'in': 入点秒, 'out': 出点秒}，
+    省略 in 表示从头开始，省略 out 表示到结尾。
+
+    Returns:
+        (路径, 入点, 出点或 None)
+    """
+    if isinstance(entry, str):
+        return entry, 0.0, None
+    end = entry.get('out')
+    return entry['file'], float(entry.get('in') or 0.0), float(end) if end is not None else None
+
+
+def validate_clip(entry: Any) -> Optional[str]:
+    """校验 video_files 中的一项（不检查文件是否存在），返回错误信息，合法时返回 None"""
+    if isinstance(entry, str):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get('file'), str):
+        return f'视频片段必须是文件路径或 {{"file", "in", "out"}} 对象: {entry}'
+    for key in ('in', 'out'):
+        value = entry.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not 0 <= value < float('inf')):
+            return f"裁剪点 {key} 必须是非负数: {value}"
+    if entry.get('out') is not None and entry['out'] <= (entry.get('in') or 0):
+        return f"出点必须晚于入点: {entry['file']} ({entry.get('in') or 0} ~ {entry['out']})"
+    return None
+
+
+# 尺寸适配方式
+FIT_MODES = ('contain', 'cover', 'stretch')
+
+# 填充颜色：颜色名或 #RRGGBB / 0xRRGGBB，会直接拼进滤镜字符串，不能包含滤镜语法字符
+PAD_COLOR_PATTERN = re.compile(r'^(?:[A-Za-z]+|#[0-9A-Fa-f]{6}|0x[0-9A-Fa-f]{6})$')
+
+
+def is_valid_pad_color(pad_color: str) -> bool:
+    return isinstance(pad_color, str) and PAD_COLOR_PATTERN.match(pad_color) is not None
+
+
+def build_conform_filter(source_size: Tuple[int, int], target_size: Tuple[int, int],
+                         fit_mode: str = 'contain', pad_color: str = 'black') -> str:
+    """
+    生成 ffmpeg 尺寸统一滤镜
+
+    Args:
+        source_size: 源视频尺寸 (宽, 高)
+        target_size: 目标尺寸 (宽, 高)
+        fit_mode: contain 保持比例并加边，cover 保持比例并裁剪，stretch 直接拉伸
+        pad_color: contain 模式下的填充颜色
+
+    Returns:
+        -vf 参数字符串
+    """
+    if fit_mode not in FIT_MODES:
+        raise ValueError(f"不支持的尺寸适配方式: {fit_mode}，可选: {', '.join(FIT_MODES)}")
+    if not is_valid_pad_color(pad_color):
+        raise ValueError(f"不支持的填充颜色: {pad_color}，可用颜色名或 #RRGGBB")
+
+    width, height = target_size
+    if tuple(source_size) == (width, height) or fit_mode == 'stretch':
+        return f"scale={width}:{height}"
+    if fit_mode == 'contain':
+        return (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color={pad_color},setsar=1")
+    return (f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+            f"crop={width}:{height},setsar=1")
@@ -0,0 +1,179 @@
+"""
+渲染性能剖析模块
+按流水线阶段（加载、解码、转场合成、音频、编码）统计墙钟时间和 CPU 时间
+"""
+
+import cProfile
+import importlib.util
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+
+# 支持的函数级剖析器
+PROFILE_MODES = ('cprofile', 'pyinstrument')
+# 需要额外安装的剖析器对应的模块
+_OPTIONAL_PROFILERS = {'pyinstrument': 'pyinstrument'}
+
+
+def profile_mode_available(profile_mode: str) -> bool:
+    """剖析器是否可用（pyinstrument 为可选依赖）"""
+    module = _OPTIONAL_PROFILERS.get(profile_mode)
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def _children_cpu() -> float:
+    """已结束子进程（ffmpeg 等）累计的 CPU 时间"""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class _StageStats:
+    """单个阶段的累计统计"""
+
+    __slots__ = ('calls', 'wall', 'cpu', 'child_cpu', 'self_wall', 'self_cpu')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self.self_wall = 0.0
+        self.self_cpu = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'wall_seconds': round(self.wall, 6),
+            'cpu_seconds': round(self.cpu, 6),
+            'self_wall_seconds': round(self.self_wall, 6),
+            'self_cpu_seconds': round(self.self_cpu, 6),
+            'subprocess_cpu_seconds': round(self.child_cpu, 6),
+        }
+
+
+class RenderProfiler:
+    """
+    渲染阶段计时器
+
+    阶段可以嵌套：moviepy 是惰性求值的，解码和转场合成都发生在编码阶段
+    逐帧拉取的过程中。因此每个阶段同时记录包含子阶段的总耗时（wall/cpu）
+    和扣除子阶段后的自身耗时（self_wall/self_cpu），例如编码阶段的自身耗时
+    即为 x264 编码和管道写入的开销。
+    """
+
+    def __init__(self, profile_mode: Optional[str] = None, dump_dir: Optional[str] = None):
+        if profile_mode is not None and profile_mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的剖析模式: {profile_mode}，可选: {', '.join(PROFILE_MODES)}")
+        if profile_mode is not None and not profile_mode_available(profile_mode):
+            raise ValueError(f"剖析模式 {profile_mode} 需要安装 {_OPTIONAL_PROFILERS[profile_mode]}")
+        self.profile_mode = profile_mode
+        self.dump_dir = dump_dir
+        self.profile_path: Optional[str] = None
+        self._stages: Dict[str, _StageStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_at: Optional[float] = None
+        self._total_wall = 0.0
+
+    def _stack(self) -> List[List[float]]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name: str, wall: float, cpu: float, child_wall: float,
+                child_cpu_inner: float, subprocess_cpu: float) -> None:
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = _StageStats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.self_wall += wall - child_wall
+            stats.self_cpu += cpu - child_cpu_inner
+            stats.child_cpu += subprocess_cpu
+
+    @contextmanager
+    def stage(self, name: str):
+        """统计一个阶段的耗时，可嵌套"""
+        stack = self._stack()
+        # [子阶段墙钟时间, 子阶段CPU时间]
+        frame = [0.0, 0.0]
+        stack.append(frame)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        children_start = _children_cpu()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            self._record(name, wall, cpu, frame[0], frame[1], _children_cpu() - children_start)
+
+    def timed(self, name: str, func: Callable, *args, **kwargs):
+        """在指定阶段内调用函数"""
+        with self.stage(name):
+            return func(*args, **kwargs)
+
+    def wrap_clip(self, clip, name: str):
+        """包装 moviepy 片段，使其逐帧取帧计入指定阶段"""
+        return clip.fl(lambda get_frame, t: self.timed(name, get_frame, t))
+
+    @contextmanager
+    def session(self, name: str = 'total'):
+        """一次完整合成的剖析会话，按需启用 cProfile/pyinstrument"""
+        function_profiler = None
+        if self.profile_mode == 'cprofile':
+            function_profiler = cProfile.Profile()
+            function_profiler.enable()
+        elif self.profile_mode == 'pyinstrument':
+            from pyinstrument import Profiler  # 可选依赖，仅在启用时导入
+            function_profiler = Profiler()
+            function_profiler.start()
+
+        self._started_at = time.time()
+        wall_start = time.perf_counter()
+        try:
+            with self.stage(name):
+                yield self
+        finally:
+            self._total_wall = time.perf_counter() - wall_start
+            if function_profiler is not None:
+                self._dump(function_profiler)
+
+    def _dump(self, function_profiler) -> None:
+        dump_dir = self.dump_dir or '.'
+        os.makedirs(dump_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self._started_at))
+        if self.profile_mode == 'cprofile':
+            function_profiler.disable()
+            self.profile_path = os.path.join(dump_dir, f"render_{stamp}_{id(self):x}.prof")
+            function_profiler.dump_stats(self.profile_path)
+        else:
+            function_profiler.stop()
+            self.profile_path = os.path.join(dump_dir, f"render_{stamp}_{id(self):x}.html")
+            with open(self.profile_path, 'w', encoding='utf-8') as f:
+                f.write(function_profiler.output_html())
+
+    def report(self) -> Dict[str, Any]:
+        """生成剖析报告，转场阶段（名称以 transition 开头）单独列出"""
+        with self._lock:
+            stages = {name: stats.to_dict() for name, stats in self._stages.items()}
+        transitions = [
+            dict(stage=name, **stats) for name, stats in stages.items()
+            if name.startswith('transition')
+        ]
+        return {
+            'total_wall_seconds': round(self._total_wall, 6),
+            'stages': {name: stats for name, stats in stages.items() if not name.startswith('transition')},
+            'transitions': transitions,
+            'profile_dump': self.profile_path,
+        }
@@ -0,0 +1,328 @@
+"""
+渲染 worker
+从 Redis 任务队列领取合成任务并渲染，定期上报心跳和进度。
+上传和输出文件通过与 Web 进程相同的 STORAGE_URL 读写：本地存储需要与 Web 进程共享目录
+（同一台机器或共享存储挂载到相同路径），对象存储则不需要共享磁盘，源片段下载到本机缓存后渲染。
+
+每个任务在独立的子进程（独立进程组）中渲染，输出先写到 outputs/.jobs/<任务ID>/，
+完成后移入输出存储。任务被取消时整个进程组（包括 ffmpeg 子进程）被立即终止，
+临时目录随即删除。
+
+moviepy 引擎的分段检查点写在 CHECKPOINT_FOLDER/<任务ID>/（默认 outputs/.checkpoints），任务结束
+（成功、失败或取消）后删除。worker 失联时检查点保留下来，任务被回收后接手的 worker 从最后完成的分段继续；
+要在另一台机器上继续，CHECKPOINT_FOLDER 必须是所有 worker 挂载到相同路径的共享存储，否则只能从头渲染。
+
+worker 启动时预热：确认 ffmpeg 可用，并由 forkserver 服务进程预先导入 moviepy 等渲染依赖，
+任务子进程从预热好的服务进程 fork，领取任务后不再花时间导入模块。
+
+用法:
+    RENDER_QUEUE_URL=redis://localhost:6379/0 STATE_STORE_URL=redis://localhost:6379/0 \\
+        python render_worker.py
+
+可以在多台机器上各启动若干个 worker，水平扩展渲染能力而无需扩容 API 层。
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app import checkpoint_root, load_config
+from logger_config import setup_logging, stop_logging, AppLoggers, get_log_context, log_context
+from metrics import REGISTRY, AppMetrics
+from render_options import DEFAULT_FRAME_TRANSPORT
+from ffmpeg_engine import resolve_ffmpeg_binary
+from render_jobs import RenderQueue, run_compose_job, publish_outputs, output_filenames, default_worker_id
+from state_store import configure_state_store
+from storage import configure_storage, create_storages, storage_settings
+from webhooks import configure_callbacks, wait_for_callbacks
+
+logger = AppLoggers.WORKER
+
+# 子进程不能直接从 worker 主进程 fork：主进程持有心跳线程和日志线程，fork 后状态不可靠。
+# forkserver 从一个干净的单线程服务进程 fork，平台不支持时退回 spawn
+_mp = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# forkserver 服务进程预先导入的渲染模块
+PREWARM_MODULES = ['render_jobs', 'advanced_video_processor']
+
+
+def prewarm() -> str:
+    """
+    预热渲染环境，在启动心跳和领取任务之前调用
+
+    Returns:
+        ffmpeg 可执行文件路径（不可用时抛出 RuntimeError）
+    """
+    binary = resolve_ffmpeg_binary()
+    if _mp.get_start_method() == 'forkserver':
+        from multiprocessing import forkserver
+
+        _mp.set_forkserver_preload(PREWARM_MODULES)
+        forkserver.ensure_running()
+    return binary
+
+
+def throttle_progress(report: Callable[[float, str], None],
+                      interval: float) -> Callable[[float, str], None]:
+    """节流的进度回调：每个阶段的开始和结束立即上报，其余按时间间隔上报"""
+    state = {'stage': None, 'reported_at': 0.0}
+
+    def throttled(progress: float, stage: str) -> None:
+        now = time.monotonic()
+        if (stage == state['stage'] and progress < 1.0
+                and now - state['reported_at'] < interval):
+            return
+        state['stage'] = stage
+        state['reported_at'] = now
+        report(progress, stage)
+
+    return throttled
+
+
+def _render_process(payload: Dict[str, Any], scratch_dir: str, checkpoint_dir: str, profile_dir: Optional[str],
+                    log_level: str, log_format: str, log_fields: Dict[str, Any], state_store_url: str,
+                    messages, progress_interval: float, storage: Optional[Dict[str, Any]] = None,
+                    frame_transport: str = DEFAULT_FRAME_TRANSPORT) -> None:
+    """渲染子进程入口，结果和进度通过 messages 队列发回主进程"""
+    if hasattr(os, 'setpgrp'):
+        # 独立进程组，取消时连同 ffmpeg 子进程一起终止
+        os.setpgrp()
+    setup_logging(log_level, log_format)
+    REGISTRY.use_store(configure_state_store(state_store_url))
+    if storage:
+        configure_storage(storage)
+    report = throttle_progress(lambda progress, stage: messages.put(('progress', progress, stage)),
+                               progress_interval)
+    try:
+        # worker 异常退出后任务被重新入队，接手的 worker 用同一个检查点目录从最后完成的分段继续
+        with log_context(**log_fields):
+            result = run_compose_job(payload, scratch_dir, profile_dir, progress_callback=report,
+                                     checkpoint_dir=checkpoint_dir, frame_transport=frame_transport)
+    except Exception as e:
+        messages.put(('error', str(e)))
+    else:
+        messages.put(('result', result))
+    finally:
+        # 子进程退出时不执行 atexit，先把队列中的日志写完
+        stop_logging()
+
+
+class RenderWorker:
+    """单个渲染 worker，一次处理一个任务"""
+
+    def __init__(self, render_queue: RenderQueue, output_dir: str, profile_dir: Optional[str] = None,
+                 worker_id: Optional[str] = None, heartbeat_interval: float = 5.0,
+                 progress_interval: float = 1.0, cancel_poll_interval: float = 0.5,
+                 log_level: str = 'INFO', state_store_url: str = 'memory://', log_format: str = 'text',
+                 storage: Optional[Dict[str, Any]] = None, checkpoint_root: Optional[str] = None,
+                 frame_transport: str = DEFAULT_FRAME_TRANSPORT):
+        self.queue = render_queue
+        self.output_dir = output_dir
+        self.profile_dir = profile_dir
+        self.worker_id = worker_id or default_worker_id()
+        self.heartbeat_interval = heartbeat_interval
+        self.progress_interval = progress_interval
+        self.cancel_poll_interval = cancel_poll_interval
+        self.log_level = log_level
+        self.log_format = log_format
+        self.state_store_url = state_store_url
+        # 存储配置（见 storage.STORAGE_SETTINGS），渲染子进程按它解析对象存储中的片段
+        self.storage = storage or storage_settings({'UPLOAD_FOLDER': output_dir, 'OUTPUT_FOLDER': output_dir})
+        self.outputs = create_storages(self.storage)['outputs']
+        # 分段检查点的根目录，跨机器续渲需要是共享存储（见模块说明）
+        self.checkpoint_root = checkpoint_root or os.path.join(output_dir, '.checkpoints')
+        # moviepy 引擎的取帧方式，原样传给渲染子进程
+        self.frame_transport = frame_transport
+        self.current_job: Optional[str] = None
+        self.jobs_done = 0
+        self._stop = threading.Event()
+
+    def stop(self, *_) -> None:
+        """处理完当前任务后退出"""
+        if not self._stop.is_set():
+            logger.info(f"收到退出信号 | worker: {self.worker_id} | 当前任务: {self.current_job or '无'}")
+        self._stop.set()
+
+    def _info(self) -> Dict[str, Any]:
+        return {'pid': os.getpid(), 'job_id': self.current_job, 'jobs_done': self.jobs_done}
+
+    def _heartbeat_loop(self) -> None:
+        # 独立线程上报心跳，长时间渲染期间也不会被判定为失联
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.queue.heartbeat(self.worker_id, self._info())
+            except Exception as e:
+                logger.warning(f"心跳上报失败: {e}")
+
+    @staticmethod
+    def _kill(proc) -> None:
+        """终止渲染子进程及其进程组内的 ffmpeg"""
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            # 子进程尚未建立进程组或已经退出
+            proc.kill()
+        proc.join()
+
+    def _run_child(self, job_id: str, payload: Dict[str, Any], scratch_dir: str, checkpoint_dir: str,
+                   log_fields: Optional[Dict[str, Any]] = None):
+        """
+        在子进程中渲染，期间转发进度并检查取消标记
+
+        Returns:
+            ('result', 结果) / ('error', 错误信息) / ('cancelled', None)
+        """
+        messages = _mp.Queue()
+        proc = _mp.Process(
+            target=_render_process, name=f'render-{job_id}',
+            args=(payload, scratch_dir, checkpoint_dir, self.profile_dir, self.log_level, self.log_format, log_fields or {},
+                  self.state_store_url, messages, self.progress_interval, self.storage, self.frame_transport)
+        )
+        proc.start()
+        last_cancel_check = time.monotonic()
+        try:
+            while True:
+                try:
+                    kind, *data = messages.get(timeout=self.cancel_poll_interval)
+                except queue.Empty:
+                    kind, data = None, None
+                if kind == 'progress':
+                    self.queue.update_progress(job_id, *data)
+                elif kind is not None:
+                    proc.join()
+                    return kind, data[0]
+
+                now = time.monotonic()
+                if now - last_cancel_check >= self.cancel_poll_interval:
+                    last_cancel_check = now
+                    if self.queue.is_cancel_requested(job_id):
+                        self._kill(proc)
+                        return 'cancelled', None
+                if kind is None and not proc.is_alive():
+                    return 'error', f'渲染进程异常退出，退出码: {proc.exitcode}'
+        finally:
+            if proc.is_alive():
+                self._kill(proc)
+            messages.close()
+
+    def process(self, job: Dict[str, Any]) -> None:
+        """渲染一个已领取的任务，期间的日志（包括渲染子进程）附带任务 ID 和提交任务的请求 ID"""
+        with log_context(job_id=job['id'], request_id=job.get('request_id'), worker=self.worker_id):
+            self._process(job)
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        self.current_job = job_id
+        self.queue.heartbeat(self.worker_id, self._info())
+        logger.info(f"开始渲染 | 任务: {job_id} | 第 {job['attempts']} 次尝试 | "
+                    + (f"版本数量: {len(job['payload']['variants'])}" if 'variants' in job['payload']
+                       else f"视频数量: {len(job['payload'].get('video_files', []))}"))
+        start = time.perf_counter()
+        scratch_dir = os.path.join(self.output_dir, '.jobs', job_id)
+        checkpoint_dir = os.path.join(self.checkpoint_root, job_id)
+        try:
+            kind, value = self._run_child(job_id, job['payload'], scratch_dir, checkpoint_dir,
+                                          log_fields=get_log_context())
+            if kind == 'result':
+                publish_outputs(value, self.outputs)
+                self.queue.complete(self.worker_id, job_id, value)
+                logger.info(f"渲染完成 | 任务: {job_id} | 输出: {', '.join(output_filenames(value))} | "
+                            f"耗时: {time.perf_counter() - start:.2f}秒")
+            elif kind == 'cancelled':
+                self.queue.mark_cancelled(self.worker_id, job_id)
+                AppMetrics.COMPOSE_TOTAL.inc(status='cancelled')
+                logger.info(f"任务已取消 | 任务: {job_id} | 已终止渲染进程")
+            else:
+                logger.error(f"渲染失败 | 任务: {job_id} | {value}")
+                self.queue.fail(self.worker_id, job_id, value)
+        except Exception as e:
+            logger.error(f"渲染失败 | 任务: {job_id} | {e}")
+            self.queue.fail(self.worker_id, job_id, str(e))
+        finally:
+            # 以上各分支都已结束任务，检查点不再需要；worker 失联时不会执行到这里，检查点留给接手的 worker
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            AppMetrics.COMPOSE_QUEUE_DEPTH.dec()
+            self.current_job = None
+            self.jobs_done += 1
+
+    def run(self, max_jobs: Optional[int] = None) -> None:
+        """主循环：回收失联 worker 的任务，领取并渲染任务"""
+        self.queue.heartbeat(self.worker_id, self._info())
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='heartbeat', daemon=True)
+        heartbeat.start()
+        logger.info(f"渲染 worker 已启动 | {self.worker_id} | 输出目录: {self.output_dir}")
+
+        try:
+            while not self._stop.is_set():
+                requeued = self.queue.requeue_orphans()
+                if requeued:
+                    logger.warning(f"回收失联 worker 的任务: {', '.join(requeued)}")
+
+                job = self.queue.claim(self.worker_id)
+                if job is None:
+                    self.queue.wait_for_work(timeout=max(1, int(self.heartbeat_interval)))
+                    continue
+                self.process(job)
+                if max_jobs is not None and self.jobs_done >= max_jobs:
+                    break
+        finally:
+            self._stop.set()
+            self.queue.unregister(self.worker_id)
+            # 等待任务结束回调投递完（含重试），超时仍未送达的放弃
+            if wait_for_callbacks(timeout=30):
+                logger.warning("部分任务结束回调未能在退出前送达")
+            logger.info(f"渲染 worker 已退出 | {self.worker_id} | 完成任务: {self.jobs_done}")
+
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description="视频合成渲染 worker")
+    parser.add_argument('--queue-url', default=os.environ.get('RENDER_QUEUE_URL'),
+                        help="Redis 地址，默认读取 RENDER_QUEUE_URL")
+    parser.add_argument('--worker-id', default=None, help="worker 标识，默认 主机名-进程号")
+    parser.add_argument('--heartbeat-interval', type=float, default=5.0, help="心跳间隔（秒）")
+    parser.add_argument('--client-concurrency', type=int,
+                        default=int(os.environ.get('RENDER_CLIENT_CONCURRENCY', '2')),
+                        help="单个客户端同时运行的任务数上限，默认读取 RENDER_CLIENT_CONCURRENCY")
+    parser.add_argument('--max-jobs', type=int, default=None, help="处理指定数量的任务后退出")
+    args = parser.parse_args()
+
+    if not args.queue_url:
+        parser.error("需要 --queue-url 或环境变量 RENDER_QUEUE_URL")
+
+    setup_logging(config['LOG_LEVEL'], config['LOG_FORMAT'])
+    # 指标写入与 Web 进程相同的共享存储，/metrics 可以看到 worker 的渲染统计
+    REGISTRY.use_store(configure_state_store(config['STATE_STORE_URL']))
+    os.makedirs(config['OUTPUT_FOLDER'], exist_ok=True)
+    configure_storage(config)
+    configure_callbacks(config['CALLBACK_ALLOWED_HOSTS'])
+    started = time.perf_counter()
+    binary = prewarm()
+    logger.info(f"渲染环境已预热 | ffmpeg: {binary} | 耗时: {time.perf_counter() - started:.2f}秒")
+
+    render_queue = RenderQueue(args.queue_url, heartbeat_ttl=args.heartbeat_interval * 3,
+                               client_concurrency=args.client_concurrency)
+    worker = RenderWorker(render_queue, config['OUTPUT_FOLDER'], config['PROFILE_FOLDER'],
+                          worker_id=args.worker_id, heartbeat_interval=args.heartbeat_interval,
+                          log_level=config['LOG_LEVEL'], state_store_url=config['STATE_STORE_URL'],
+                          log_format=config['LOG_FORMAT'], storage=storage_settings(config),
+                          checkpoint_root=checkpoint_root(config), frame_transport=config['RENDER_FRAME_TRANSPORT'])
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(max_jobs=args.max_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+共享状态存储模块
+为多进程（gunicorn 多 worker）部署提供跨进程共享的键值/哈希存储，
+用于指标、准入控制的容量预留和探测信息缓存
+
+支持的地址格式:
+    memory://                    进程内存储，仅适合单进程开发服务器
+    sqlite:///path/to/state.db   单机多进程共享
+    redis://host:6379/0          多机共享
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _decode(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return json.loads(value)
+
+
+class StateStore:
+    """状态存储接口，值统一以 JSON 形式保存"""
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def hincr(self, key: str, increments: Dict[str, float]) -> None:
+        """原子地累加哈希中的多个数值字段"""
+        raise NotImplementedError
+
+    def hset(self, key: str, mapping: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def hgetall(self, key: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def reserve(self, key: str, member: str, amount: float, capacity: Optional[float],
+                ttl: float) -> Tuple[bool, float]:
+        """
+        原子地检查容量并登记一笔预留（每笔预留单独过期，进程异常退出时不会永久占用容量）
+
+        当前没有有效预留、capacity 为 None 或登记后总量不超过 capacity 时登记成功。
+
+        Returns:
+            (是否登记成功, 登记前的有效预留总量)
+        """
+        raise NotImplementedError
+
+    def release(self, key: str, member: str) -> None:
+        """释放一笔预留"""
+        raise NotImplementedError
+
+    def reserved(self, key: str) -> float:
+        """当前有效预留总量"""
+        raise NotImplementedError
+
+
+def _fits(total: float, amount: float, capacity: Optional[float]) -> bool:
+    return capacity is None or total <= 0 or total + amount <= capacity
+
+
+class MemoryStateStore(StateStore):
+    """进程内存储"""
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._hashes: Dict[str, Dict[str, Any]] = {}
+        self._reservations: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, key: str) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+            return True
+        return False
+
+    def get(self, key):
+        with self._lock:
+            if self._expired(key):
+                return None
+            return self._values.get(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = value
+            if ttl:
+                self._expires[key] = time.time() + ttl
+            else:
+                self._expires.pop(key, None)
+
+    def hincr(self, key, increments):
+        with self._lock:
+            values = self._hashes.setdefault(key, {})
+            for field, amount in increments.items():
+                values[field] = values.get(field, 0) + amount
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._hashes.setdefault(key, {}).update(mapping)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hashes.get(key, {}))
+
+    def _live_reservations(self, key: str) -> Dict[str, Tuple[float, float]]:
+        now = time.time()
+        live = {member: entry for member, entry in self._reservations.get(key, {}).items() if entry[1] > now}
+        self._reservations[key] = live
+        return live
+
+    def reserve(self, key, member, amount, capacity, ttl):
+        with self._lock:
+            live = self._live_reservations(key)
+            total = sum(amount for amount, _ in live.values())
+            if not _fits(total, amount, capacity):
+                return False, total
+            live[member] = (amount, time.time() + ttl)
+            return True, total
+
+    def release(self, key, member):
+        with self._lock:
+            self._reservations.get(key, {}).pop(member, None)
+
+    def reserved(self, key):
+        with self._lock:
+            return sum(amount for amount, _ in self._live_reservations(key).values())
+
+
+class SQLiteStateStore(StateStore):
+    """基于 SQLite 的单机多进程共享存储（WAL 模式）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value, expires_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS hash (key TEXT, field TEXT, value, "
+                         "PRIMARY KEY (key, field))")
+            conn.execute("CREATE TABLE IF NOT EXISTS reservation (key TEXT, member TEXT, amount REAL, "
+                         "expires_at REAL, PRIMARY KEY (key, member))")
+
+    def _connection(self) -> sqlite3.Connection:
+        # 连接按线程和进程隔离，fork 之后的 worker 会重新建立连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, _encode(value), expires_at)
+        )
+
+    def hincr(self, key, increments):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO hash (key, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(key, field) DO UPDATE SET value = hash.value + excluded.value",
+                [(key, field, amount) for field, amount in increments.items()]
+            )
+
+    def hset(self, key, mapping):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO hash (key, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(key, field) DO UPDATE SET value = excluded.value",
+                [(key, field, value if isinstance(value, (int, float)) else _encode(value))
+                 for field, value in mapping.items()]
+            )
+
+    def hgetall(self, key):
+        rows = self._connection().execute("SELECT field, value FROM hash WHERE key = ?", (key,)).fetchall()
+        return {field: _decode(value) for field, value in rows}
+
+    def reserve(self, key, member, amount, capacity, ttl):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            # 写事务内先清理过期预留再求和，并发的登记请求依次执行
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM reservation WHERE key = ? AND expires_at <= ?", (key, now))
+            total = conn.execute("SELECT COALESCE(SUM(amount), 0) FROM reservation WHERE key = ?",
+                                 (key,)).fetchone()[0]
+            if not _fits(total, amount, capacity):
+                return False, total
+            conn.execute(
+                "INSERT INTO reservation (key, member, amount, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key, member) DO UPDATE SET amount = excluded.amount, expires_at = excluded.expires_at",
+                (key, member, amount, now + ttl)
+            )
+            return True, total
+
+    def release(self, key, member):
+        self._connection().execute("DELETE FROM reservation WHERE key = ? AND member = ?", (key, member))
+
+    def reserved(self, key):
+        return self._connection().execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM reservation WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()[0]
+
+
+# 预留保存在哈希（成员 -> 数量）中，过期时间记在有序集合 <key>:expires 里
+_RESERVE_SCRIPT = """
+local key, expires_key = KEYS[1], KEYS[2]
+local member, amount, now, expires_at = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4]
+local capacity = tonumber(ARGV[5])
+for _, expired in ipairs(redis.call('ZRANGEBYSCORE', expires_key, '-inf', now)) do
+  redis.call('HDEL', key, expired)
+end
+redis.call('ZREMRANGEBYSCORE', expires_key, '-inf', now)
+local total = 0
+for _, value in ipairs(redis.call('HVALS', key)) do
+  total = total + tonumber(value)
+end
+if capacity and total > 0 and total + amount > capacity then
+  return {0, tostring(total)}
+end
+redis.call('HSET', key, member, ARGV[2])
+redis.call('ZADD', expires_key, expires_at, member)
+return {1, tostring(total)}
+"""
+
+
+class RedisStateStore(StateStore):
+    """基于 Redis 的多机共享存储"""
+
+    def __init__(self, url: str, namespace: str = 'video_synthesis:'):
+        import redis  # 仅在使用 Redis 时导入
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self._reserve = self.client.register_script(_RESERVE_SCRIPT)
+
+    def _key(self, key: str) -> str:
+        return self.namespace + key
+
+    def get(self, key):
+        return _decode(self.client.get(self._key(key)))
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self._key(key), _encode(value), px=int(ttl * 1000) if ttl else None)
+
+    def hincr(self, key, increments):
+        pipe = self.client.pipeline(transaction=True)
+        for field, amount in increments.items():
+            pipe.hincrbyfloat(self._key(key), field, amount)
+        pipe.execute()
+
+    def hset(self, key, mapping):
+        if mapping:
+            self.client.hset(self._key(key), mapping={f: _encode(v) for f, v in mapping.items()})
+
+    def hgetall(self, key):
+        return {field.decode('utf-8'): _decode(value)
+                for field, value in self.client.hgetall(self._key(key)).items()}
+
+    def reserve(self, key, member, amount, capacity, ttl):
+        now = time.time()
+        reserved, total = self._reserve(
+            keys=[self._key(key), self._key(key) + ':expires'],
+            args=[member, repr(float(amount)), now, now + ttl, '' if capacity is None else capacity]
+        )
+        return bool(reserved), float(total)
+
+    def release(self, key, member):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hdel(self._key(key), member)
+        pipe.zrem(self._key(key) + ':expires', member)
+        pipe.execute()
+
+    def reserved(self, key):
+        now = time.time()
+        values = self.client.hgetall(self._key(key))
+        if not values:
+            return 0.0
+        expires = dict(self.client.zrangebyscore(self._key(key) + ':expires', now, '+inf', withscores=True))
+        return sum(float(amount) for member, amount in values.items() if member in expires)
+
+
+def create_state_store(url: Optional[str]) -> StateStore:
+    """根据地址创建存储"""
+    if not url or url.startswith('memory://'):
+        return MemoryStateStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateStore(url)
+    raise ValueError(f"不支持的状态存储地址: {url}")
+
+
+_state_store: Optional[StateStore] = None
+
+
+def configure_state_store(url: Optional[str]) -> StateStore:
+    """设置全局状态存储"""
+    global _state_store
+    _state_store = create_state_store(url)
+    return _state_store
+
+
+def get_state_store() -> StateStore:
+    """获取全局状态存储，未配置时使用进程内存储"""
+    global _state_store
+    if _state_store is None:
+        _state_store = MemoryStateStore()
+    return _state_store
@@ -0,0 +1,635 @@
+"""
+媒体存储
+上传文件和合成输出通过统一的存储接口读写，Web 进程和渲染 worker 不再依赖同一块本地磁盘。
+
+支持的地址格式（STORAGE_URL）:
+    空 / file://                          本地目录（UPLOAD_FOLDER / OUTPUT_FOLDER），按文件名哈希分片
+    s3://bucket/prefix?endpoint=http://127.0.0.1:9000&region=us-east-1
+                                          S3 兼容的对象存储（AWS S3、MinIO 等），
+                                          访问密钥读取 AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+
+写入按块流式进行，对象存储超过一个分片时使用分片上传，内存占用不随文件大小增长；
+读取支持字节范围，预览和下载接口按 Range 请求转发。ffmpeg 需要本地文件，
+对象存储中的媒体在首次使用时下载到本机缓存目录（按 ETag 区分版本），之后直接复用。
+
+只依赖标准库（S3 请求签名为 AWS Signature V4），API 进程可以直接导入。
+"""
+
+import datetime
+import hashlib
+import hmac
+import http.client
+import os
+import shutil
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+from render_options import parse_clip
+
+# 流式读写的块大小
+CHUNK_SIZE = 1024 * 1024
+# 对象存储分片上传的分片大小（S3 要求除最后一片外不小于 5MB）
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# 本地存储的分片层数，每层两位十六进制（256 个子目录）
+SHARD_DEPTH = 2
+
+# 预签名 URL 的默认有效期（秒），只用于把单次下载交给前置代理，不需要很长
+PRESIGN_EXPIRES = 300
+
+# configure_storage 使用的配置项，渲染 worker 原样传给渲染子进程
+STORAGE_SETTINGS = ('STORAGE_URL', 'UPLOAD_FOLDER', 'OUTPUT_FOLDER', 'STORAGE_CACHE_FOLDER', 'STORAGE_SHARD_DEPTH')
+
+_EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+_S3_NS = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+
+class StorageError(IOError):
+    """对象存储请求失败"""
+
+
+def _check_name(name: str) -> str:
+    """存储中的文件名只能是单个路径分量"""
+    if not name or name != os.path.basename(name) or name in ('.', '..'):
+        raise ValueError(f"不合法的文件名: {name}")
+    return name
+
+
+def _read_full(stream, size: int) -> bytes:
+    """从流中读满 size 字节（流结束时可能更少）"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(min(remaining, CHUNK_SIZE))
+        if not chunk:
+            break
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(parts)
+
+
+class Storage:
+    """存储接口，文件按名称（单个路径分量）寻址"""
+
+    def locator(self, name: str) -> str:
+        """接口返回给客户端、合成请求的 video_files 中使用的位置"""
+        raise NotImplementedError
+
+    def stat(self, name: str) -> Optional[Dict[str, Any]]:
+        """{'size', 'modified'}（修改时间为时间戳），文件不存在时返回 None"""
+        raise NotImplementedError
+
+    def save_stream(self, name: str, stream) -> int:
+        """
+        从可读流（带 read 方法）流式写入，写完之前读取方看不到这个文件
+
+        Returns:
+            写入的字节数
+        """
+        raise NotImplementedError
+
+    def save_file(self, name: str, path: str, move: bool = False) -> int:
+        """写入一个本地文件，move 时源文件交给存储（移动到存储或本机缓存中）"""
+        with open(path, 'rb') as f:
+            size = self.save_stream(name, f)
+        if move:
+            os.remove(path)
+        return size
+
+    def read_range(self, name: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """按块读取 [start, start + length) 范围的内容，length 为 None 时读到文件末尾"""
+        raise NotImplementedError
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        """列出全部文件 [{'filename', 'size', 'modified'}]，不含以 . 开头的临时文件"""
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def direct_path(self, name: str) -> Optional[str]:
+        """可以直接读取的本地路径（本地存储），对象存储返回 None"""
+        return None
+
+    def presigned_url(self, name: str, expires: int = PRESIGN_EXPIRES) -> Optional[str]:
+        """不带凭证即可在有效期内读取文件的 URL（对象存储），本地存储返回 None"""
+        return None
+
+    def local_path(self, name: str) -> str:
+        """
+        供 ffmpeg 读取的本地文件路径，对象存储在首次使用时下载到本机缓存
+
+        Raises:
+            FileNotFoundError: 文件不存在
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """
+    本地目录存储
+
+    文件按名称的哈希分片到 root/ab/cd/<name>，单个目录内的文件数保持在较小的规模；
+    分片之前直接放在 root 下的文件仍然可以读取。
+    """
+
+    def __init__(self, root: str, shard_depth: int = SHARD_DEPTH):
+        self.root = root
+        self.shard_depth = shard_depth
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """文件写入的位置"""
+        digest = hashlib.sha1(_check_name(name).encode('utf-8')).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, name)
+
+    def direct_path(self, name: str) -> Optional[str]:
+        for path in (self.path(name), os.path.join(self.root, name)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def locator(self, name: str) -> str:
+        return self.direct_path(name) or self.path(name)
+
+    def local_path(self, name: str) -> str:
+        path = self.direct_path(name)
+        if path is None:
+            raise FileNotFoundError(f"文件不存在: {name}")
+        return path
+
+    def stat(self, name: str) -> Optional[Dict[str, Any]]:
+        path = self.direct_path(name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'modified': stat.st_mtime}
+
+    def _temp_path(self, path: str) -> str:
+        directory, name = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.partial")
+
+    def save_stream(self, name: str, stream) -> int:
+        path = self.path(name)
+        temp_path = self._temp_path(path)
+        try:
+            with open(temp_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size
+
+    def save_file(self, name: str, path: str, move: bool = False) -> int:
+        target = self.path(name)
+        if move:
+            # 同一文件系统内直接重命名，不复制数据
+            temp_path = self._temp_path(target)
+            shutil.move(path, temp_path)
+            os.replace(temp_path, target)
+            return os.path.getsize(target)
+        return super().save_file(name, path)
+
+    def read_range(self, name: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        with open(self.local_path(name), 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        files = []
+        for root, dirs, names in os.walk(self.root):
+            # 跳过 .jobs、.previews 等隐藏目录
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append({'filename': name, 'size': stat.st_size, 'modified': stat.st_mtime})
+        return files
+
+    def delete(self, name: str) -> None:
+        path = self.direct_path(name)
+        if path is not None:
+            os.remove(path)
+
+
+def sign_v4(method: str, host: str, path: str, query: Dict[str, str], headers: Dict[str, str],
+            payload_hash: str, access_key: str, secret_key: str, region: str, service: str = 's3',
+            now: Optional[datetime.datetime] = None) -> Dict[str, str]:
+    """
+    AWS Signature V4 签名
+
+    Args:
+        path: 已编码的请求路径
+        query: 未编码的查询参数
+        headers: 需要签名的请求头（不含 Host，由 host 参数提供）
+
+    Returns:
+        加上 Host、X-Amz-Date、X-Amz-Content-Sha256 和 Authorization 的请求头
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    headers = dict(headers, Host=host)
+    headers['X-Amz-Date'] = amz_date
+    headers['X-Amz-Content-Sha256'] = payload_hash
+
+    canonical_headers = sorted((key.lower(), ' '.join(str(value).split())) for key, value in headers.items())
+    signature, scope, signed_headers = _signature(method, path, query, canonical_headers, payload_hash,
+                                                  amz_date, secret_key, region, service)
+    headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    return headers
+
+
+def presign_v4(method: str, host: str, path: str, access_key: str, secret_key: str, region: str,
+               expires: int, service: str = 's3', now: Optional[datetime.datetime] = None) -> str:
+    """
+    AWS Signature V4 查询串签名（预签名 URL），只签 Host 头，载荷不签名
+
+    Args:
+        path: 已编码的请求路径
+
+    Returns:
+        编码好的查询串（不含 '?'），拼在 path 后面即可直接访问
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    query = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f"{access_key}/{scope}",
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(expires),
+        'X-Amz-SignedHeaders': 'host',
+    }
+    signature, _, _ = _signature(method, path, query, [('host', host)], 'UNSIGNED-PAYLOAD',
+                                 amz_date, secret_key, region, service)
+    return f"{_canonical_query(query)}&X-Amz-Signature={signature}"
+
+
+def _canonical_query(query: Dict[str, str]) -> str:
+    return '&'.join(f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}" for key, value in sorted(query.items()))
+
+
+def _signature(method: str, path: str, query: Dict[str, str], canonical_headers: List[Tuple[str, str]],
+               payload_hash: str, amz_date: str, secret_key: str, region: str, service: str):
+    """计算 V4 签名，返回 (签名, 凭证范围, 已签名的请求头列表)"""
+    date = amz_date[:8]
+    signed_headers = ';'.join(key for key, _ in canonical_headers)
+    canonical_request = '\n'.join([
+        method, path, _canonical_query(query),
+        ''.join(f"{key}:{value}\n" for key, value in canonical_headers),
+        signed_headers, payload_hash,
+    ])
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    key = f"AWS4{secret_key}".encode('utf-8')
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest(), scope, signed_headers
+
+
+class S3Storage(Storage):
+    """S3 兼容的对象存储（路径风格寻址：endpoint/bucket/key）"""
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint: Optional[str] = None, region: str = 'us-east-1',
+                 access_key: str = '', secret_key: str = '', cache_dir: Optional[str] = None,
+                 part_size: int = MULTIPART_PART_SIZE, timeout: float = 60.0):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        parsed = urlparse(endpoint or f"https://s3.{region}.amazonaws.com")
+        self.scheme = parsed.scheme
+        self.host = parsed.netloc
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.cache_dir = cache_dir
+        self.part_size = part_size
+        self.timeout = timeout
+
+    def _key(self, name: str) -> str:
+        return self.prefix + _check_name(name)
+
+    def locator(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self._key(name)}"
+
+    def name_for(self, locator: str) -> Optional[str]:
+        """locator 属于本存储时返回文件名，否则返回 None"""
+        head = f"s3://{self.bucket}/{self.prefix}"
+        if not locator.startswith(head):
+            return None
+        name = locator[len(head):]
+        return name if name and '/' not in name else None
+
+    def presigned_url(self, name: str, expires: int = PRESIGN_EXPIRES) -> Optional[str]:
+        path = quote(f"/{self.bucket}/{self._key(name)}", safe='/-_.~')
+        query = presign_v4('GET', self.host, path, self.access_key, self.secret_key, self.region, expires)
+        return f"{self.scheme}://{self.host}{path}?{query}"
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _request(self, method: str, key: Optional[str] = None, query: Optional[Dict[str, str]] = None,
+                 headers: Optional[Dict[str, str]] = None, body: bytes = b'',
+                 expect=(200,)) -> http.client.HTTPResponse:
+        """
+        发送签名请求，返回未读取的响应（调用方负责读完并关闭连接）
+
+        Raises:
+            FileNotFoundError: 对象不存在（404 且不在 expect 中）
+            StorageError: 其他非预期状态码或网络错误
+        """
+        query = query or {}
+        path = quote(f"/{self.bucket}" + (f"/{key}" if key is not None else ''), safe='/-_.~')
+        payload_hash = hashlib.sha256(body).hexdigest() if body else _EMPTY_SHA256
+        signed = sign_v4(method, self.host, path, query, headers or {}, payload_hash,
+                         self.access_key, self.secret_key, self.region)
+        if query:
+            path += '?' + '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in query.items())
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body or None, headers=signed)
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise StorageError(f"对象存储请求失败: {method} {key or self.bucket}: {e}")
+        if response.status in expect:
+            response.connection = conn
+            return response
+        detail = response.read()[:300].decode('utf-8', errors='replace')
+        conn.close()
+        if response.status == 404:
+            raise FileNotFoundError(f"文件不存在: {key}")
+        raise StorageError(f"对象存储请求失败: {method} {key or self.bucket} HTTP {response.status}: {detail}")
+
+    def _call(self, method: str, key: Optional[str] = None, **kwargs) -> http.client.HTTPResponse:
+        """发送请求并读完响应体，返回已读取的响应（响应体在 response.data 中）"""
+        response = self._request(method, key, **kwargs)
+        try:
+            response.data = response.read()
+        finally:
+            response.connection.close()
+        return response
+
+    def stat(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self._call('HEAD', self._key(name))
+        except FileNotFoundError:
+            return None
+        modified = response.getheader('Last-Modified')
+        return {
+            'size': int(response.getheader('Content-Length', '0')),
+            'modified': (datetime.datetime.strptime(modified, '%a, %d %b %Y %H:%M:%S GMT')
+                         .replace(tzinfo=datetime.timezone.utc).timestamp() if modified else 0.0),
+            'etag': (response.getheader('ETag') or '').strip('"'),
+        }
+
+    def _cache_path(self, name: str, etag: str) -> Optional[str]:
+        if not self.cache_dir or not etag:
+            return None
+        return os.path.join(self.cache_dir, self.bucket, etag.replace('/', '_'), name)
+
+    def _keep_in_cache(self, name: str, etag: str, path: str) -> None:
+        """把刚上传的内容留作本机缓存，之后渲染和探测不必再下载"""
+        cache_path = self._cache_path(name, etag)
+        if cache_path is None:
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        shutil.move(path, cache_path)
+
+    def save_stream(self, name: str, stream) -> int:
+        if not self.cache_dir:
+            return self._upload(self._key(name), stream)[1]
+        # 上传的同时写一份到本机缓存
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tee_path = os.path.join(self.cache_dir, f".{name}.{uuid.uuid4().hex[:8]}.partial")
+        try:
+            with open(tee_path, 'wb') as tee:
+                etag, size = self._upload(self._key(name), stream, tee)
+            self._keep_in_cache(name, etag, tee_path)
+        finally:
+            if os.path.exists(tee_path):
+                os.remove(tee_path)
+        return size
+
+    def save_file(self, name: str, path: str, move: bool = False) -> int:
+        with open(path, 'rb') as f:
+            etag, size = self._upload(self._key(name), f)
+        if move:
+            self._keep_in_cache(name, etag, path)
+        return size
+
+    def _upload(self, key: str, stream, tee=None):
+        """
+        上传一个流，超过一个分片时使用分片上传，内存中最多保留一个分片
+
+        Returns:
+            (ETag, 字节数)
+        """
+        part = _read_full(stream, self.part_size)
+        if tee:
+            tee.write(part)
+        if len(part) < self.part_size:
+            return self._call('PUT', key, body=part).getheader('ETag', '').strip('"'), len(part)
+
+        response = self._call('POST', key, query={'uploads': ''})
+        upload_id = ET.fromstring(response.data).findtext(f'{_S3_NS}UploadId')
+        parts = []
+        size = 0
+        try:
+            while part:
+                number = len(parts) + 1
+                response = self._call('PUT', key, query={'partNumber': str(number), 'uploadId': upload_id},
+                                      body=part)
+                parts.append((number, response.getheader('ETag')))
+                size += len(part)
+                part = _read_full(stream, self.part_size)
+                if tee:
+                    tee.write(part)
+            body = ('<CompleteMultipartUpload>' + ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>' for number, etag in parts
+            ) + '</CompleteMultipartUpload>').encode('utf-8')
+            root = ET.fromstring(self._call('POST', key, query={'uploadId': upload_id}, body=body).data)
+            # CompleteMultipartUpload 出错时也可能返回 200，错误在响应体中
+            if root.tag == 'Error':
+                raise StorageError(f"对象存储分片上传失败: {key}: {root.findtext('Message')}")
+        except BaseException:
+            # 放弃上传，不留下未完成的分片
+            try:
+                self._call('DELETE', key, query={'uploadId': upload_id}, expect=(200, 204))
+            except OSError:
+                pass
+            raise
+        return (root.findtext(f'{_S3_NS}ETag') or '').strip('"'), size
+
+    def read_range(self, name: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        headers = {}
+        if start or length is not None:
+            end = '' if length is None else str(start + length - 1)
+            headers['Range'] = f"bytes={start}-{end}"
+        response = self._request('GET', self._key(name), headers=headers, expect=(200, 206))
+        try:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            response.connection.close()
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        files = []
+        query = {'list-type': '2', 'prefix': self.prefix}
+        while True:
+            root = ET.fromstring(self._call('GET', query=query).data)
+            for item in root.findall(f'{_S3_NS}Contents'):
+                name = item.findtext(f'{_S3_NS}Key')[len(self.prefix):]
+                if not name or '/' in name or name.startswith('.'):
+                    continue
+                modified = item.findtext(f'{_S3_NS}LastModified')
+                files.append({
+                    'filename': name,
+                    'size': int(item.findtext(f'{_S3_NS}Size')),
+                    'modified': datetime.datetime.fromisoformat(modified.replace('Z', '+00:00')).timestamp(),
+                })
+            token = root.findtext(f'{_S3_NS}NextContinuationToken')
+            if root.findtext(f'{_S3_NS}IsTruncated') != 'true' or not token:
+                return files
+            query = dict(query, **{'continuation-token': token})
+
+    def delete(self, name: str) -> None:
+        self._call('DELETE', self._key(name), expect=(200, 204))
+
+    def local_path(self, name: str) -> str:
+        stat = self.stat(name)
+        if stat is None:
+            raise FileNotFoundError(f"文件不存在: {name}")
+        cache_path = self._cache_path(name, stat['etag'])
+        if cache_path is None:
+            raise StorageError("对象存储需要配置 STORAGE_CACHE_FOLDER 才能读取媒体文件")
+        if not os.path.isfile(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{uuid.uuid4().hex[:8]}.partial"
+            try:
+                with open(temp_path, 'wb') as f:
+                    for chunk in self.read_range(name):
+                        f.write(chunk)
+                os.replace(temp_path, cache_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return cache_path
+
+
+def create_storage(url: Optional[str], area: str, root: str, cache_dir: Optional[str] = None,
+                   shard_depth: int = SHARD_DEPTH) -> Storage:
+    """
+    根据地址创建一个区域（uploads / outputs）的存储
+
+    Args:
+        url: STORAGE_URL，为空时使用本地目录 root
+        area: 区域名，对象存储中作为键前缀的最后一级
+        root: 本地存储的目录
+        cache_dir: 对象存储的本机缓存目录
+    """
+    if not url or url.startswith('file://'):
+        return LocalStorage(root, shard_depth=shard_depth)
+    if url.startswith('s3://'):
+        parsed = urlparse(url)
+        options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        prefix = '/'.join(part for part in (parsed.path.strip('/'), area) if part)
+        return S3Storage(
+            parsed.netloc, prefix, endpoint=options.get('endpoint'), region=options.get('region', 'us-east-1'),
+            access_key=os.environ.get('AWS_ACCESS_KEY_ID', ''),
+            secret_key=os.environ.get('AWS_SECRET_ACCESS_KEY', ''),
+            cache_dir=cache_dir,
+        )
+    raise ValueError(f"不支持的存储地址: {url}")
+
+
+_storages: Dict[str, Storage] = {}
+
+
+def storage_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """configure_storage 需要的配置项"""
+    return {key: config.get(key) for key in STORAGE_SETTINGS}
+
+
+def create_storages(config: Dict[str, Any]) -> Dict[str, Storage]:
+    """按配置（见 STORAGE_SETTINGS）创建上传和输出存储"""
+    shard_depth = config.get('STORAGE_SHARD_DEPTH')
+    return {
+        area: create_storage(config.get('STORAGE_URL'), area, config[folder],
+                             cache_dir=config.get('STORAGE_CACHE_FOLDER'),
+                             shard_depth=SHARD_DEPTH if shard_depth is None else shard_depth)
+        for area, folder in (('uploads', 'UPLOAD_FOLDER'), ('outputs', 'OUTPUT_FOLDER'))
+    }
+
+
+def configure_storage(config: Dict[str, Any]) -> Dict[str, Storage]:
+    """设置全局的上传和输出存储，对象存储的位置按它们解析"""
+    _storages.clear()
+    _storages.update(create_storages(config))
+    return dict(_storages)
+
+
+def get_storage(area: str) -> Storage:
+    """获取全局存储（uploads / outputs）"""
+    if area not in _storages:
+        raise RuntimeError(f"存储未配置: {area}")
+    return _storages[area]
+
+
+def _find_object(path: str):
+    """对象存储的位置对应的 (存储, 文件名)"""
+    for storage in _storages.values():
+        if isinstance(storage, S3Storage):
+            name = storage.name_for(path)
+            if name is not None:
+                return storage, name
+    raise ValueError(f"不属于已配置存储的位置: {path}")
+
+
+def media_exists(path: str) -> bool:
+    """本地路径或对象存储位置指向的文件是否存在"""
+    if path.startswith('s3://'):
+        storage, name = _find_object(path)
+        return storage.stat(name) is not None
+    return os.path.isfile(path)
+
+
+def resolve_media(path: str) -> str:
+    """把对象存储的位置换成本机缓存中的文件路径，本地路径原样返回"""
+    if path.startswith('s3://'):
+        storage, name = _find_object(path)
+        return storage.local_path(name)
+    return path
+
+
+def localize_clip(entry: Any) -> Any:
+    """video_files 中的一项（见 parse_clip）换成本地路径，裁剪点保持不变"""
+    path = parse_clip(entry)[0]
+    if isinstance(entry, dict):
+        return dict(entry, file=resolve_media(path))
+    return resolve_media(path)
@@ -0,0 +1,593 @@
+"""
+测试 REST API（Flask 测试客户端）
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from app import FILE_SERVING_MODES, attachment_disposition, create_app, get_client_id
+from benchmark import generate_clip
+from ffmpeg_engine import probe_source
+from render_cost import reserve_backlog
+from render_profiler import profile_mode_available
+from test_logger_config import capture_logs
+from test_storage import ACCESS_KEY, SECRET_KEY, S3StandIn
+from test_webhooks import CallbackReceiver
+
+
+def _app(work_dir, **config):
+    app = create_app(dict({
+        'UPLOAD_FOLDER': os.path.join(work_dir, 'uploads'),
+        'OUTPUT_FOLDER': os.path.join(work_dir, 'outputs'),
+        'PROFILE_FOLDER': os.path.join(work_dir, 'profiles'),
+        'STATE_STORE_URL': 'memory://',
+        'RENDER_QUEUE_URL': None,
+        'JOB_STORE_PATH': os.path.join(work_dir, 'jobs.db'),
+        'JOB_RESUME_INTERVAL': 0,
+    }, **config))
+    app.testing = True
+    return app
+
+
+def test_app_import_is_lightweight():
+    """API 进程启动时不导入 moviepy/numpy，只在渲染时按需加载"""
+    code = ("import sys, app; "
+            "print(sorted({m.split('.')[0] for m in sys.modules} & {'moviepy', 'numpy', 'imageio', 'PIL'}))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]', output
+    print("✅ API 进程不加载渲染依赖")
+
+
+def test_upload():
+    """上传视频返回探测信息，不支持的格式返回 400"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(tmp)
+        client = app.test_client()
+        clip = generate_clip(tmp, 320, 240, 2)
+        with open(clip, 'rb') as f:
+            response = client.post('/api/upload', data={'files': [(f, 'clip.mp4')]},
+                                   content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        uploaded = response.get_json()['files'][0]
+        assert uploaded['original_name'] == 'clip.mp4'
+        # 本地存储按文件名哈希分片，path 可以直接用于合成请求
+        assert uploaded['path'].startswith(app.config['UPLOAD_FOLDER']) and os.path.isfile(uploaded['path'])
+        assert os.path.basename(uploaded['path']) == uploaded['filename']
+        assert uploaded['info']['size'] == [320, 240]
+        assert abs(uploaded['info']['duration'] - 2.0) < 0.1
+        assert uploaded['info']['has_audio'] is True
+        assert uploaded['info']['keyframes'] >= 1
+        loudness = uploaded['info']['loudness']
+        assert -30 < loudness['integrated_lufs'] < -10 and loudness['true_peak_dbfs'] < 0
+
+        response = client.post('/api/upload', data={'files': [(io.BytesIO(b'text'), 'notes.txt')]},
+                               content_type='multipart/form-data')
+        assert response.status_code == 400
+
+        # 波形在上传时已经分析并缓存
+        response = client.get(f"/api/waveform/{uploaded['filename']}")
+        assert response.status_code == 200
+        waveform = response.get_json()
+        assert waveform['has_audio'] and waveform['loudness'] == loudness
+        assert abs(len(waveform['peaks']) - 2 * waveform['peaks_per_second']) <= 2
+        assert max(waveform['peaks']) > 0 and all(0 <= peak <= 255 for peak in waveform['peaks'])
+        assert client.get('/api/waveform/missing.mp4').status_code == 404
+        print("✅ 上传接口正确")
+
+
+def test_upload_probes_in_parallel(monkeypatch):
+    """多个文件并行探测，单个文件失败不影响其他文件"""
+    probe = app_module.probe_video_info
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_probe(path):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.3)
+        with lock:
+            running[0] -= 1
+        return probe(path)
+
+    monkeypatch.setattr(app_module, 'probe_video_info', slow_probe)
+    with tempfile.TemporaryDirectory() as tmp:
+        client = _app(tmp, UPLOAD_PROBE_WORKERS=4).test_client()
+        clip = generate_clip(tmp, 160, 120, 1)
+        with open(clip, 'rb') as f:
+            content = f.read()
+        files = [(io.BytesIO(content), f'clip{i}.mp4') for i in range(3)]
+        files.append((io.BytesIO(b'not a video'), 'broken.mp4'))
+
+        start = time.perf_counter()
+        response = client.post('/api/upload', data={'files': files}, content_type='multipart/form-data')
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200
+        uploaded = response.get_json()['files']
+        assert [item['original_name'] for item in uploaded] == ['clip0.mp4', 'clip1.mp4', 'clip2.mp4', 'broken.mp4']
+        assert all(item['info']['size'] == [160, 120] for item in uploaded[:3])
+        assert 'error' in uploaded[3]['info']
+        print(f"4 个文件上传耗时: {elapsed:.2f}秒, 最大并行探测数: {peak[0]}")
+        assert peak[0] > 1 and elapsed < 4 * 0.3
+    print("✅ 上传文件并行探测")
+
+
+def test_compose_validation():
+    """转场参数不合法时返回 400 和明确的错误信息"""
+    with tempfile.TemporaryDirectory() as tmp:
+        client = _app(tmp).test_client()
+        clip = generate_clip(tmp, 160, 120, 1)
+        cases = [
+            ({'transitions': 'fade'}, 'transitions 必须是列表'),
+            ({'transitions': ['fade']}, '第 1 个转场配置必须是对象'),
+            ({'transitions': [{'type': 'spin'}]}, '第 1 个转场类型不支持: spin'),
+            ({'transitions': [{'type': 'fade', 'duration': 'abc'}]}, '第 1 个转场时长必须是正数: abc'),
+            ({'transitions': [{'type': 'fade', 'duration': 0}]}, '第 1 个转场时长必须是正数: 0'),
+        ]
+        for color in ('black,drawbox=c=red:t=fill', 'red[x]', '#12345'):
+            cases.append(({'pad_color': color}, f'不支持的填充颜色: {color}，可用颜色名或 #RRGGBB'))
+        cases += [
+            ({'mp4_layout': 'webm'}, '不支持的 MP4 封装方式: webm，可选: faststart, fragmented, standard'),
+            ({'mp4_layout': ['faststart']}, "不支持的 MP4 封装方式: ['faststart']，可选: faststart, fragmented, standard"),
+            ({'renditions': 720}, 'renditions 必须是列表'),
+            ({'renditions': [720, 481]}, '额外输出高度必须是 144~4320 之间的偶数: 481'),
+            ({'renditions': [True]}, '额外输出高度必须是 144~4320 之间的偶数: True'),
+            ({'renditions': [720, 720]}, '额外输出高度不能重复'),
+            ({'renditions': [144, 240, 360, 480, 720]}, '额外输出最多 4 个'),
+            ({'callback_url': 'ftp://example.com/hook'}, 'callback_url 必须是 http(s) 地址: ftp://example.com/hook'),
+            ({'callback_url': 'http://169.254.169.254/latest/meta-data/'},
+             '回调主机 169.254.169.254 解析到内网或保留地址: 169.254.169.254'),
+            ({'loudness_target': -60}, 'loudness_target 必须是 -40~-5 之间的响度 (LUFS): -60'),
+            ({'loudness_target': '-16'}, 'loudness_target 必须是 -40~-5 之间的响度 (LUFS): -16'),
+            ({'video_files': [clip, {'path': clip}]},
+             f"视频片段必须是文件路径或 {{\"file\", \"in\", \"out\"}} 对象: {{'path': '{clip}'}}"),
+            ({'video_files': [clip, {'file': clip, 'in': -1}]}, '裁剪点 in 必须是非负数: -1'),
+            ({'video_files': [clip, {'file': clip, 'out': '3'}]}, '裁剪点 out 必须是非负数: 3'),
+            ({'video_files': [clip, {'file': clip, 'in': 0.5, 'out': 0.5}]}, f'出点必须晚于入点: {clip} (0.5 ~ 0.5)'),
+            ({'video_files': [clip, {'file': 'missing.mp4', 'in': 0.5}]}, '视频文件不存在: missing.mp4'),
+        ]
+        if not profile_mode_available('pyinstrument'):
+            cases.append(({'profile': 'pyinstrument'}, '剖析模式 pyinstrument 不可用，服务器未安装 pyinstrument'))
+        for extra, message in cases:
+            for endpoint in ('/api/compose', '/api/compose/estimate'):
+                response = client.post(endpoint, json=dict({'video_files': [clip, clip]}, **extra))
+                assert response.status_code == 400, (endpoint, extra)
+                assert response.get_json()['error'] == message
+        print("✅ 合成参数校验正确")
+
+
+def test_compose_estimate():
+    """预估接口返回耗时构成和准入判断，不登记积压"""
+    with tempfile.TemporaryDirectory() as tmp:
+        client = _app(tmp).test_client()
+        clips = [generate_clip(tmp, 320, 240, 2, index=i) for i in range(2)]
+        response = client.post('/api/compose/estimate', json={
+            'video_files': clips, 'transitions': [{'type': 'fade', 'duration': 0.5}]
+        })
+        assert response.status_code == 200
+        data = response.get_json()
+        print(f"预估: {data['estimate']['estimated_seconds']}秒")
+        assert data['estimate']['engine'] == 'moviepy'
+        assert data['estimate']['output_size'] == [320, 240]
+        assert abs(data['estimate']['output_duration'] - 3.5) < 1e-6
+        assert data['estimate']['estimated_seconds'] > 0
+        assert data['admission'] == {'admit': True, 'retry_after': 0, 'expected_wait_seconds': 0,
+                                     'backlog_seconds': 0, 'slots': 1}
+
+        # 裁剪后按保留部分估算；入点超出时长时返回 400
+        response = client.post('/api/compose/estimate', json={
+            'video_files': [{'file': clips[0], 'in': 0.5}, {'file': clips[1], 'out': 1.0}],
+            'transitions': [{'type': 'fade', 'duration': 0.2}]
+        })
+        assert abs(response.get_json()['estimate']['output_duration'] - 2.3) < 1e-6
+        response = client.post('/api/compose/estimate', json={'video_files': [{'file': clips[0], 'in': 5}]})
+        assert response.status_code == 400 and '入点 5 秒超出视频时长' in response.get_json()['error']
+        print("✅ 预估接口正确")
+
+
+def test_compose_rejected_when_backlogged():
+    """积压超过容量时返回 429 和 Retry-After，不开始渲染"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(tmp, ADMISSION_MAX_WAIT_SECONDS=60, RENDER_SLOTS=2)
+        client = app.test_client()
+        clips = [generate_clip(tmp, 320, 240, 2, index=i) for i in range(2)]
+        # 另一个请求正在渲染，登记了 200 秒的工作量
+        reserve_backlog('other-job', 200, None)
+
+        response = client.post('/api/compose', json={'video_files': clips})
+        assert response.status_code == 429
+        data = response.get_json()
+        assert data['admission']['backlog_seconds'] == 200
+        assert data['admission']['slots'] == 2
+        assert int(response.headers['Retry-After']) == data['retry_after'] >= (200 - 2 * 60) / 2
+        assert not [name for name in os.listdir(app.config['OUTPUT_FOLDER']) if name.endswith('.mp4')]
+
+        estimate = client.post('/api/compose/estimate', json={'video_files': clips}).get_json()
+        assert estimate['admission']['admit'] is False
+        print("✅ 积压时拒绝合成请求")
+
+
+def test_resume_interrupted_job():
+    """Web 进程中途退出的同步合成任务由其他进程接管完成，任务状态可查询，临时文件不出现在文件列表中"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoints = os.path.join(tmp, 'shared_checkpoints')
+        app = _app(tmp, CHECKPOINT_FOLDER=checkpoints)
+        client = app.test_client()
+        clips = [generate_clip(tmp, 160, 120, 1, index=i) for i in range(2)]
+        job_store = app.extensions['job_store']
+        job_store.lease_seconds = 0.1
+        # 中断前写下的检查点（布局与本次渲染不同，接管后从头渲染）
+        os.makedirs(os.path.join(checkpoints, 'interrupted'))
+        with open(os.path.join(checkpoints, 'interrupted', 'manifest.json'), 'w') as f:
+            f.write('{"layout": {}, "done": []}')
+        job_store.create('interrupted', {'video_files': clips, 'output_filename': 'resumed.mp4'}, 'dead-worker')
+        # 中断时留下的临时文件
+        with open(os.path.join(app.config['OUTPUT_FOLDER'], '.resumed.partial.mp4'), 'wb') as f:
+            f.write(b'partial')
+        time.sleep(0.2)
+
+        assert app_module.resume_interrupted_jobs(app) == 1
+        status = client.get('/api/task/interrupted').get_json()
+        assert status['state'] == 'SUCCESS' and status['attempts'] == 2
+        assert status['result']['output_filename'] == 'resumed.mp4'
+        assert not os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], '.jobs', 'interrupted'))
+        assert not os.path.exists(os.path.join(checkpoints, 'interrupted'))
+
+        files = client.get('/api/files').get_json()['output_files']
+        assert [item['filename'] for item in files] == ['resumed.mp4']
+        assert client.get('/api/task/unknown').status_code == 404
+        print("✅ 中断的合成任务被接管完成")
+
+
+def test_task_long_poll_and_callback():
+    """同步合成结束后投递回调；长轮询在状态变化时返回，状态不变时等到超时"""
+    receiver = CallbackReceiver()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = _app(tmp, TASK_WAIT_MAX_SECONDS=0.5, TASK_WAIT_MAX_CONCURRENT=1, CALLBACK_ALLOWED_HOSTS=['127.0.0.1'])
+            client = app.test_client()
+            clips = [generate_clip(tmp, 160, 120, 1, index=i) for i in range(2)]
+            response = client.post('/api/compose', json={'video_files': clips, 'callback_url': receiver.url})
+            assert response.status_code == 200
+            task_id = response.get_json()['task_id']
+            assert receiver.received.wait(5)
+            body = receiver.requests[0][1]
+            assert body['task_id'] == task_id and body['state'] == 'SUCCESS'
+            assert body['result']['output_filename'] == response.get_json()['result']['output_filename']
+
+            # 任务已结束：调用方传入过时的状态时立即返回
+            start = time.monotonic()
+            status = client.get(f'/api/task/{task_id}?wait=30&state=STARTED').get_json()
+            assert status['state'] == 'SUCCESS' and time.monotonic() - start < 0.5
+            # 状态不变：阻塞到 TASK_WAIT_MAX_SECONDS
+            start = time.monotonic()
+            assert client.get(f'/api/task/{task_id}?wait=30').get_json()['state'] == 'SUCCESS'
+            assert time.monotonic() - start >= 0.5
+
+            job_store = app.extensions['job_store']
+            job_store.create('running', {'video_files': clips}, 'web-1')
+            threading.Timer(0.2, job_store.fail, args=('running', 'boom')).start()
+            status = client.get('/api/task/running?wait=5').get_json()
+            assert status['state'] == 'FAILURE' and status['error'] == 'boom'
+            assert client.get('/api/task/running?wait=abc').status_code == 400
+
+            # 同时等待的请求达到上限：不再阻塞，返回 503；状态已变化的请求不占名额
+            app.config['TASK_WAIT_MAX_SECONDS'] = 5
+            job_store.create('slow', {'video_files': clips}, 'web-1')
+            waiting = threading.Thread(target=lambda: app.test_client().get('/api/task/slow?wait=5'))
+            waiting.start()
+            time.sleep(0.2)
+            response = client.get('/api/task/slow?wait=5')
+            assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+            assert response.get_json()['state'] == 'STARTED'
+            assert client.get('/api/task/slow?wait=5&state=PENDING').status_code == 200
+            job_store.fail('slow', 'boom')
+            waiting.join(5)
+            assert client.get('/api/task/slow?wait=5&state=STARTED').status_code == 200
+            metrics = client.get('/metrics').get_data(as_text=True)
+            assert 'task_long_polls_total{result="rejected"} 1' in metrics
+            print("✅ 任务长轮询和结束回调正确")
+    finally:
+        receiver.close()
+
+
+def test_json_request_log():
+    """JSON 日志：访问日志带请求 ID、耗时和字节数，合成的阶段 span 带任务 ID"""
+    with tempfile.TemporaryDirectory() as tmp:
+        client = _app(tmp, LOG_FORMAT='json').test_client()
+        clips = [generate_clip(tmp, 160, 120, 1, index=i) for i in range(2)]
+        with capture_logs() as lines:
+            response = client.post('/api/compose', json={'video_files': clips}, headers={'X-Request-Id': 'req-42'})
+            assert client.get('/api/health').headers['X-Request-Id'] != 'req-42'
+        assert response.status_code == 200 and response.headers['X-Request-Id'] == 'req-42'
+        task_id = response.get_json()['task_id']
+
+        entries = [json.loads(line) for line in lines]
+        access = [entry for entry in entries if entry.get('latency_ms') is not None]
+        assert access[0]['request_id'] == 'req-42' and access[0]['endpoint'] == '/api/compose'
+        assert access[0]['status'] == 200 and access[0]['bytes_in'] > 0 and access[0]['bytes_out'] > 0
+        spans = [entry for entry in entries if 'span' in entry]
+        assert {entry['span'] for entry in spans} >= {'compose', 'compose/load', 'compose/encode',
+                                                      'compose/transition'}
+        assert all(entry['job_id'] == task_id and entry['request_id'] == 'req-42' for entry in spans)
+        print("✅ JSON 请求日志正确")
+
+
+def test_transition_preview():
+    """转场预览只渲染转场窗口，按片段内容和转场配置缓存，内容相同的另一个文件也能命中"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(tmp)
+        client = app.test_client()
+        clips = [generate_clip(tmp, 640, 360, 3, index=i) for i in range(2)]
+        request = {'video_files': clips, 'transition': {'type': 'fade', 'duration': 1.0}}
+
+        response = client.post('/api/preview/transition', json=request)
+        assert response.status_code == 200, response.get_json()
+        result = response.get_json()
+        assert result['cached'] is False
+        window = result['window']
+        # 转场 0.9 秒（两侧时长的 30%），前后各 1 秒
+        assert abs(window['transition_start'] - 2.1) < 1e-6 and abs(window['transition_duration'] - 0.9) < 1e-6
+        assert abs(window['start'] - 1.1) < 1e-6 and abs(window['end'] - 4.0) < 1e-6
+
+        video = client.get(result['preview_url'])
+        assert video.status_code == 200 and video.mimetype == 'video/mp4'
+        assert 'immutable' in video.headers['Cache-Control']
+        preview_path = os.path.join(tmp, 'preview.mp4')
+        with open(preview_path, 'wb') as f:
+            f.write(video.data)
+        video.close()
+        info = probe_source(preview_path)
+        assert info['size'] == (426, 240) and info['has_audio']
+        assert abs(info['duration'] - (window['end'] - window['start'])) < 0.1, info['duration']
+
+        # 缺省字段按默认值计；内容相同的副本命中同一个缓存
+        copy = os.path.join(tmp, 'copy.mp4')
+        shutil.copy(clips[1], copy)
+        start = time.perf_counter()
+        response = client.post('/api/preview/transition',
+                               json={'video_files': [clips[0], copy], 'transition': {'duration': 1}})
+        assert response.get_json()['cached'] is True
+        assert response.get_json()['preview_url'] == result['preview_url']
+        assert time.perf_counter() - start < 1.0
+
+        response = client.post('/api/preview/transition', json=dict(request, transition={'type': 'slide_left'}))
+        assert response.get_json()['cached'] is False
+        assert response.get_json()['preview_url'] != result['preview_url']
+
+        metrics = client.get('/metrics').get_data(as_text=True)
+        assert 'transition_previews_total{cache="hit"} 1\n' in metrics
+        assert 'transition_previews_total{cache="miss"} 2\n' in metrics
+        # 预览缓存不出现在文件列表中
+        assert client.get('/api/files').get_json()['output_files'] == []
+
+        # 交给前置代理发送时保留长期缓存的响应头
+        app.config['FILE_SERVING'] = 'x-accel-redirect'
+        video = client.get(result['preview_url'])
+        target = video.headers['X-Accel-Redirect']
+        assert target.startswith('/protected/outputs/.previews/') and video.data == b''
+        assert os.path.isfile(os.path.join(app.config['OUTPUT_FOLDER'], target[len('/protected/outputs/'):]))
+        assert 'immutable' in video.headers['Cache-Control']
+        app.config['FILE_SERVING'] = 'direct'
+
+        assert client.post('/api/preview/transition', json={'video_files': clips[:1]}).status_code == 400
+        assert client.post('/api/preview/transition',
+                           json=dict(request, transition={'type': 'spin'})).status_code == 400
+        assert client.post('/api/preview/transition', json=dict(request, height=241)).status_code == 400
+        assert client.get('/api/preview/transition/' + 'f' * 64).status_code == 404
+        assert client.get('/api/preview/transition/..').status_code == 404
+        print("✅ 转场预览与缓存正确")
+
+
+def test_object_storage(monkeypatch):
+    """上传、合成、预览、下载和文件列表都经过对象存储，Web 进程的本地目录只存放缓存和临时文件"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', ACCESS_KEY)
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', SECRET_KEY)
+    stand_in = S3StandIn()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = _app(tmp, STORAGE_URL=stand_in.url('media'),
+                       STORAGE_CACHE_FOLDER=os.path.join(tmp, 'cache'))
+            client = app.test_client()
+            paths = []
+            for index in range(2):
+                with open(generate_clip(tmp, 160, 120, 1, index=index), 'rb') as f:
+                    response = client.post('/api/upload', data={'files': [(f, f'clip{index}.mp4')]},
+                                           content_type='multipart/form-data')
+                uploaded = response.get_json()['files'][0]
+                assert uploaded['path'] == f"s3://media/media/uploads/{uploaded['filename']}"
+                assert uploaded['info']['size'] == [160, 120]
+                paths.append(uploaded['path'])
+            assert not os.listdir(app.config['UPLOAD_FOLDER'])
+
+            response = client.post('/api/compose', json={
+                'video_files': [paths[0], {'file': paths[1], 'in': 0.2}], 'output_filename': 'result.mp4',
+                'transitions': [{'type': 'fade', 'duration': 0.3}]})
+            assert response.status_code == 200, response.get_json()
+            result = response.get_json()['result']
+            assert result['output_path'] == 's3://media/media/outputs/result.mp4'
+            assert 'media/outputs/result.mp4' in stand_in.objects
+            assert not [name for name in os.listdir(app.config['OUTPUT_FOLDER']) if not name.startswith('.')]
+
+            content = stand_in.objects['media/outputs/result.mp4'][0]
+            response = client.get('/api/download/result.mp4', headers={'Range': 'bytes=100-199'})
+            assert response.status_code == 206 and response.data == content[100:200]
+            assert response.headers['Content-Range'] == f'bytes 100-199/{len(content)}'
+            assert 'attachment' in response.headers['Content-Disposition']
+            response = client.get('/api/preview/result.mp4')
+            assert response.status_code == 200 and response.data == content
+            assert client.get('/api/download/missing.mp4').status_code == 404
+
+            # nginx 通过内部路径代理预签名地址；x-sendfile 只能发送本地文件，仍由 Web 进程转发
+            app.config['FILE_SERVING'] = 'x-accel-redirect'
+            response = client.get('/api/download/result.mp4')
+            assert response.data == b'' and 'attachment' in response.headers['Content-Disposition']
+            target = response.headers['X-Accel-Redirect']
+            endpoint = stand_in.endpoint.replace('://', '/', 1)
+            assert target.startswith(f"/protected/s3/{endpoint}/media/media/outputs/result.mp4?")
+            assert 'X-Amz-Expires=300&' in target and '&X-Amz-Signature=' in target
+            app.config['FILE_SERVING'] = 'x-sendfile'
+            response = client.get('/api/preview/result.mp4')
+            assert 'X-Sendfile' not in response.headers and response.data == content
+            app.config['FILE_SERVING'] = 'direct'
+
+            files = client.get('/api/files').get_json()
+            assert len(files['upload_files']) == 2
+            assert [item['filename'] for item in files['output_files']] == ['result.mp4']
+
+            response = client.post('/api/compose/estimate', json={'video_files': ['s3://media/other/a.mp4']})
+            assert response.status_code == 400
+            assert response.get_json()['error'] == '不属于已配置存储的位置: s3://media/other/a.mp4'
+        print("✅ 对象存储读写正确")
+    finally:
+        stand_in.close()
+
+
+def test_batch_compose():
+    """批量合成共用相同的部分，各版本的输出写入存储，参数错误时指明是哪个版本"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(tmp)
+        client = app.test_client()
+        clips = [generate_clip(tmp, 320, 240, 2, index=index) for index in range(3)]
+        request = {
+            'variants': [
+                {'video_files': clips, 'transitions': [{'type': 'fade', 'duration': 0.4}] * 2,
+                 'output_filename': 'market_a.mp4'},
+                {'video_files': clips[:2], 'transitions': [{'type': 'fade', 'duration': 0.4}]},
+            ],
+            'loudness_target': -20,
+        }
+
+        response = client.post('/api/compose/batch', json=dict(request, dry_run=True))
+        assert response.status_code == 200, response.get_json()
+        estimate = response.get_json()['estimate']
+        assert (estimate['pieces_total'], estimate['pieces_unique']) == (8, 6)
+        assert estimate['rendered_frames'] < estimate['timeline_frames']
+
+        response = client.post('/api/compose/batch', json=request)
+        assert response.status_code == 200, response.get_json()
+        result = response.get_json()['result']
+        assert result['pieces'] == {'total': 8, 'unique': 6, 'reused': 0}
+        names = [variant['output_filename'] for variant in result['variants']]
+        assert names[0] == 'market_a.mp4' and names[1].startswith('batch_')
+        assert all(len(variant['loudness_gains_db']) == len(variant_request['video_files'])
+                   for variant, variant_request in zip(result['variants'], request['variants']))
+        for variant in result['variants']:
+            assert variant['output_path'].startswith(app.config['OUTPUT_FOLDER'] + os.sep)
+            assert client.get(f"/api/download/{variant['output_filename']}").status_code == 200
+        assert sorted(item['filename'] for item in client.get('/api/files').get_json()['output_files']) == \
+            sorted(names)
+        metrics = client.get('/metrics').get_data(as_text=True)
+        assert 'batch_compose_pieces_total{result="shared"} 2\n' in metrics
+
+        for bad, message in (
+                ({'variants': []}, 'variants 必须是非空列表'),
+                ({'variants': [{'video_files': clips, 'transitions': [{'type': 'zoom_out'}]}]},
+                 '第 1 个版本: 批量合成不支持转场 zoom_out'),
+                ({'variants': [{'video_files': clips}, {'video_files': ['missing.mp4']}]},
+                 '第 2 个版本: 视频文件不存在: missing.mp4'),
+                ({'variants': [{'video_files': clips, 'output_filename': 'x.mp4'}] * 2}, '输出文件名重复: x.mp4'),
+                ({'variants': [{'video_files': clips, 'engine': 'moviepy'}]},
+                 '第 1 个版本包含不支持的参数: engine，可选: video_files, transitions, output_filename'),
+                (dict(request, fit_mode='zoom'), '第 1 个版本: 不支持的尺寸适配方式: zoom')):
+            response = client.post('/api/compose/batch', json=bad)
+            assert response.status_code == 400 and response.get_json()['error'] == message, response.get_json()
+        print("✅ 批量合成正确")
+
+
+def test_file_serving_offload():
+    """配置 FILE_SERVING 后下载和预览只返回响应头，由前置代理按内部路径或绝对路径发送文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _app(tmp, FILE_SERVING='x-accel-redirect', FILE_SERVING_PREFIX='/internal')
+        client = app.test_client()
+        storages = app.extensions['storage']
+        clip = generate_clip(tmp, 160, 120, 1)
+        storages['uploads'].save_file('clip.mp4', clip)
+        storages['outputs'].save_file('result.mp4', clip)
+        upload_path = storages['uploads'].direct_path('clip.mp4')
+
+        response = client.get('/api/download/result.mp4')
+        assert response.status_code == 200 and response.data == b'' and response.mimetype == 'video/mp4'
+        relative = os.path.relpath(storages['outputs'].direct_path('result.mp4'), app.config['OUTPUT_FOLDER'])
+        assert response.headers['X-Accel-Redirect'] == '/internal/outputs/' + relative.replace(os.sep, '/')
+        assert response.headers['Content-Disposition'] == \
+            'attachment; filename="result.mp4"; filename*=UTF-8\'\'result.mp4'
+        assert attachment_disposition('合成 "a";b.mp4') == \
+            'attachment; filename=" \\"a\\";b.mp4"; filename*=UTF-8\'\'%E5%90%88%E6%88%90%20%22a%22%3Bb.mp4'
+        response = client.get('/api/preview/clip.mp4')
+        relative = os.path.relpath(upload_path, app.config['UPLOAD_FOLDER'])
+        assert response.headers['X-Accel-Redirect'] == '/internal/uploads/' + relative.replace(os.sep, '/')
+        assert 'Content-Disposition' not in response.headers
+        assert client.get('/api/download/missing.mp4').status_code == 404
+
+        app.config['FILE_SERVING'] = 'x-sendfile'
+        response = client.get('/api/preview/clip.mp4')
+        assert response.headers['X-Sendfile'] == upload_path and response.data == b''
+
+        app.config['FILE_SERVING'] = 'direct'
+        response = client.get('/api/preview/clip.mp4')
+        assert 'X-Sendfile' not in response.headers and len(response.data) == os.path.getsize(clip)
+        response.close()
+
+        metrics = client.get('/metrics').get_data(as_text=True)
+        for mode in FILE_SERVING_MODES:
+            assert f'file_transfers_total{{mode="{mode}"}} ' in metrics
+        with pytest.raises(ValueError):
+            _app(tmp, FILE_SERVING='sendfile')
+        print("✅ 文件发送交给前置代理")
+
+
+def test_client_id_header_requires_trust():
+    """X-Client-Id 只有在配置为可信时才生效，否则按来源 IP 限制并发"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for trusted, expected in ((False, '10.0.0.7'), (True, 'tenant-a')):
+            app = _app(tmp, TRUST_CLIENT_ID_HEADER=trusted)
+            with app.test_request_context('/api/compose', headers={'X-Client-Id': 'tenant-a'},
+                                          environ_base={'REMOTE_ADDR': '10.0.0.7'}):
+                assert get_client_id() == expected
+        print("✅ 客户端标识正确")
+
+
+def test_frame_transport_setting(monkeypatch):
+    """帧传输方式从配置读取并传给渲染，不支持的取值在启动时报错"""
+    monkeypatch.setenv('RENDER_FRAME_TRANSPORT', 'Shared_Memory')
+    assert app_module.load_config()['RENDER_FRAME_TRANSPORT'] == 'shared_memory'
+
+    calls = []
+    run_compose_job = app_module.run_compose_job
+    monkeypatch.setattr(app_module, 'run_compose_job',
+                        lambda *args, **kwargs: calls.append(kwargs) or run_compose_job(*args, **kwargs))
+    with tempfile.TemporaryDirectory() as tmp:
+        client = _app(tmp, RENDER_FRAME_TRANSPORT='shared_memory').test_client()
+        clips = [generate_clip(tmp, 160, 120, 1, index=i) for i in range(2)]
+        assert client.post('/api/compose', json={'video_files': clips}).status_code == 200
+        assert calls[0]['frame_transport'] == 'shared_memory'
+        with pytest.raises(ValueError):
+            _app(tmp, RENDER_FRAME_TRANSPORT='socket')
+    print("✅ 帧传输方式按配置生效")
+
+
+if __name__ == "__main__":
+    test_app_import_is_lightweight()
+    test_upload()
+    test_compose_validation()
+    test_compose_estimate()
+    test_compose_rejected_when_backlogged()
+    test_resume_interrupted_job()
+    test_task_long_poll_and_callback()
+    test_json_request_log()
+    test_transition_preview()
+    test_batch_compose()
+    test_file_serving_offload()
+    test_client_id_header_requires_trust()
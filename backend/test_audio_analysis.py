@@ -0,0 +1,86 @@
+"""
+测试上传时的音频分析（响度和波形）
+"""
+
+import os
+import subprocess
+import tempfile
+
+import audio_analysis
+from audio_analysis import (
+    MAX_LOUDNESS_GAIN_DB, TRUE_PEAK_CEILING_DB, cached_audio_analysis, clip_gains, loudness_gain_db,
+    loudness_summary
+)
+from benchmark import generate_clip
+from ffmpeg_engine import resolve_ffmpeg_binary
+from state_store import MemoryStateStore
+
+
+def _variant(source, path, *args):
+    """在已有片段的基础上用 ffmpeg 生成变体（视频流直接复制）"""
+    subprocess.run([resolve_ffmpeg_binary(), '-y', '-loglevel', 'error', '-i', source, *args, path], check=True)
+    return path
+
+
+def test_analysis_and_cache():
+    """一次解码得到响度和峰值波形，结果按文件缓存"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = generate_clip(tmp, 160, 120, 3)
+        store = MemoryStateStore()
+        analysis = cached_audio_analysis(clip, store)
+
+        assert analysis['has_audio']
+        assert -30 < analysis['integrated_lufs'] < -10
+        assert -25 < analysis['true_peak_dbfs'] < 0
+        assert abs(len(analysis['peaks']) - 3 * analysis['peaks_per_second']) <= 2
+        # 正弦波的峰值几乎恒定（首尾受编码器起止的瞬态影响）
+        steady = analysis['peaks'][2:-2]
+        assert max(steady) - min(steady) <= 8
+        assert loudness_summary(analysis) == {key: analysis[key] for key in
+                                              ('integrated_lufs', 'loudness_range_lu', 'true_peak_dbfs')}
+
+        # 再次读取直接命中缓存，不再解码
+        calls = []
+        original = audio_analysis.analyze_audio
+        audio_analysis.analyze_audio = lambda *args: calls.append(args)
+        try:
+            assert cached_audio_analysis(clip, store) == analysis
+        finally:
+            audio_analysis.analyze_audio = original
+        assert not calls
+
+        # 静音的音轨没有响度，没有音轨的文件没有波形
+        silent = _variant(clip, os.path.join(tmp, 'silent.mp4'), '-c:v', 'copy', '-af', 'volume=0', '-c:a', 'aac')
+        silent_analysis = cached_audio_analysis(silent, store)
+        assert silent_analysis['has_audio'] and silent_analysis['integrated_lufs'] is None
+        assert max(silent_analysis['peaks']) == 0
+        mute = _variant(clip, os.path.join(tmp, 'mute.mp4'), '-c:v', 'copy', '-an')
+        assert cached_audio_analysis(mute, store) == {'has_audio': False}
+        assert loudness_summary({'has_audio': False}) is None
+
+        gains = clip_gains([clip, {'file': silent, 'in': 1.0}, mute], -23.0, store)
+        assert abs(gains[0] - (-23.0 - analysis['integrated_lufs'])) < 0.01
+        assert gains[1:] == [0.0, 0.0]
+        print("✅ 音频分析正确")
+
+
+def test_loudness_gain_limits():
+    """增益限制在上限之内，提升音量时不超过真峰值上限"""
+    def analysis(lufs, peak):
+        return {'has_audio': True, 'integrated_lufs': lufs, 'true_peak_dbfs': peak}
+
+    assert loudness_gain_db(analysis(-20.0, -5.0), -23.0) == -3.0
+    assert loudness_gain_db(analysis(-30.0, -10.0), -23.0) == 7.0
+    # 提升 7dB 会让真峰值到 -3dBTP，受 TRUE_PEAK_CEILING_DB 限制
+    assert loudness_gain_db(analysis(-30.0, -4.0), -23.0) == TRUE_PEAK_CEILING_DB + 4.0
+    assert loudness_gain_db(analysis(-30.0, 0.0), -23.0) == 0.0
+    assert loudness_gain_db(analysis(-69.0, -60.0), -16.0) == MAX_LOUDNESS_GAIN_DB
+    assert loudness_gain_db(analysis(0.0, 0.0), -40.0) == -MAX_LOUDNESS_GAIN_DB
+    assert loudness_gain_db(analysis(None, None), -23.0) == 0.0
+    assert loudness_gain_db({'has_audio': False}, -23.0) == 0.0
+    print("✅ 响度增益计算正确")
+
+
+if __name__ == "__main__":
+    test_analysis_and_cache()
+    test_loudness_gain_limits()
@@ -0,0 +1,95 @@
+"""
+测试批量合成（共享部分的规划、渲染和拼接）
+"""
+
+import os
+import re
+import subprocess
+import tempfile
+
+from batch_compose import BatchRenderer, batch_work, estimate_batch, plan_batch, split_timeline
+from benchmark import generate_clip
+from conftest import source_info
+from ffmpeg_engine import FilterGraphEngine, probe_source, resolve_ffmpeg_binary
+from state_store import MemoryStateStore
+
+
+def _frames(path):
+    """实际解码出的视频帧数"""
+    stderr = subprocess.run([resolve_ffmpeg_binary(), '-i', path, '-map', '0:v', '-f', 'null', '-'],
+                            capture_output=True, text=True).stderr
+    return int(re.findall(r'frame=\s*(\d+)', stderr)[-1])
+
+
+def _psnr(first, second):
+    stderr = subprocess.run([resolve_ffmpeg_binary(), '-i', first, '-i', second, '-lavfi', '[0:v][1:v]psnr',
+                             '-f', 'null', '-'], capture_output=True, text=True).stderr
+    return float(re.search(r'average:([\d.]+|inf)', stderr).group(1))
+
+
+def test_split_timeline():
+    """时间线拆成片段主体和转场窗口，相同的部分在不同版本间共用"""
+    a, b, c, d = (source_info(name, 4.0, size=(640, 360)) for name in ('a.mp4', 'b.mp4', 'c.mp4', 'd.mp4'))
+    fade = [{'type': 'fade', 'duration': 1.0}] * 2
+
+    first = split_timeline([a, b, c], fade)
+    assert [(piece['kind'], piece['frames']) for piece in first] == [
+        ('body', 75), ('transition', 25), ('body', 50), ('transition', 25), ('body', 75)]
+    assert first[1]['clips'][0]['start'] == 3.0 and first[1]['clips'][1]['start'] == 0.0
+    assert first[2]['clips'][0]['start'] == 1.0
+
+    # 只换最后一个片段：前三个部分完全相同
+    second = split_timeline([a, b, d], fade)
+    assert first[:3] == second[:3] and first[3:] != second[3:]
+    # 裁剪点计入起点；转场窗口重叠时无法拆分
+    trimmed = split_timeline([dict(a, duration=2.0, trim_start=1.0), b], fade[:1])
+    # 转场截短到 2 秒的 30%（15 帧）
+    assert trimmed[0]['frames'] == 35 and trimmed[1]['clips'][0]['start'] == 2.4
+    assert split_timeline([a, source_info('short.mp4', 0.4, size=(640, 360)), c], fade) is None
+    print("✅ 时间线拆分正确")
+
+
+def test_batch_render():
+    """唯一的部分只渲染一次，各版本的帧数与单次渲染一致，中断后复用已完成的部分"""
+    with tempfile.TemporaryDirectory() as tmp:
+        a, b, c = (generate_clip(tmp, 320, 240, 2, index=index) for index in range(3))
+        fade = {'type': 'fade', 'duration': 0.4}
+        variants = [
+            {'video_files': [a, b, c], 'transitions': [fade, {'type': 'slide_left', 'duration': 0.4}],
+             'output_filename': 'abc.mp4'},
+            {'video_files': [a, b], 'transitions': [fade], 'output_filename': 'ab.mp4'},
+            {'video_files': [c, {'file': b, 'in': 0.5}], 'output_filename': 'cb.mp4'},
+        ]
+        store = MemoryStateStore()
+        plan = plan_batch(variants, store=store)
+        work = batch_work(plan)
+        assert work['pieces_total'] == 11 and work['pieces_unique'] == 9
+        assert work['rendered_frames'] < work['timeline_frames']
+        assert estimate_batch(plan)['estimated_seconds'] > 0
+
+        progress = []
+        piece_dir = os.path.join(tmp, 'pieces')
+        stats = BatchRenderer(piece_dir, progress_callback=lambda value, stage: progress.append(value)).render(
+            plan, tmp)
+        assert stats['reused_pieces'] == 0 and progress[-1] == 1.0
+        for variant, output in zip(plan['variants'], stats['outputs']):
+            assert output['output_path'] == os.path.join(tmp, variant['output_filename'])
+            assert _frames(output['output_path']) == variant['frames']
+            assert probe_source(output['output_path'])['has_audio']
+
+        # 转场时长是整数帧时，与单次 ffmpeg 渲染的画面一致
+        single = os.path.join(tmp, 'single.mp4')
+        FilterGraphEngine().render([a, b], [fade], single)
+        assert _frames(single) == plan['variants'][1]['frames']
+        assert _psnr(os.path.join(tmp, 'ab.mp4'), single) > 35
+
+        stats = BatchRenderer(piece_dir).render(plan, tmp)
+        assert stats['reused_pieces'] == work['pieces_unique']
+        assert _frames(os.path.join(tmp, 'abc.mp4')) == plan['variants'][0]['frames']
+        assert not [name for name in os.listdir(tmp) if 'partial' in name]
+        print("✅ 批量渲染正确")
+
+
+if __name__ == "__main__":
+    test_split_timeline()
+    test_batch_render()
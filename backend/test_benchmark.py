@@ -0,0 +1,32 @@
+"""
+测试基准报告比较
+"""
+
+from benchmark import compare_reports
+
+
+def _result(transition, run, seconds, ok=True):
+    return {'resolution': '640x360', 'clip_duration': 5.0, 'clip_count': 2, 'transition': transition,
+            'run': run, 'ok': ok, 'elapsed_seconds': seconds}
+
+
+def test_compare_reports_uses_median_of_repeats():
+    """重复运行按中位数汇总后再比较，失败的运行不参与"""
+    baseline = {'results': [_result('fade', 0, 10.0), _result('fade', 1, 30.0), _result('fade', 2, 12.0),
+                            _result('zoom_in', 0, 8.0)]}
+    current = {'results': [_result('fade', 0, 6.0), _result('fade', 1, 7.0), _result('fade', 2, 0, ok=False),
+                           _result('slide_left', 0, 5.0)]}
+
+    comparison = compare_reports(baseline, current)
+    print(comparison)
+    assert len(comparison) == 1
+    row = comparison[0]
+    assert row['case'] == '640x360|5s|2clips|fade'
+    assert row['baseline_seconds'] == 12.0 and row['baseline_runs'] == 3
+    assert row['current_seconds'] == 6.5 and row['current_runs'] == 2
+    assert abs(row['ratio'] - 6.5 / 12.0) < 1e-9
+    print("✅ 基准比较使用重复运行的中位数")
+
+
+if __name__ == "__main__":
+    test_compare_reports_uses_median_of_repeats()
@@ -0,0 +1,138 @@
+"""
+测试 ffmpeg 滤镜图构建
+"""
+
+import os
+
+import moviepy.config
+import pytest
+
+import ffmpeg_engine
+from conftest import source_info
+from ffmpeg_engine import (
+    FilterGraphEngine, build_filter_graph, resolve_ffmpeg_binary, trim_source, unsupported_transitions
+)
+
+
+def test_filter_graph_offsets():
+    """转场偏移量和总时长与 moviepy 引擎的规则一致"""
+    sources = [source_info('a.mp4', 10.0), source_info('b.mp4', 10.0), source_info('c.mp4', 10.0)]
+    transitions = [{'type': 'fade', 'duration': 1.0}, {'type': 'slide_left', 'duration': 2.0}]
+
+    graph = build_filter_graph(sources, transitions)
+
+    print("=== 滤镜图 ===")
+    print(graph['filter_complex'].replace(';', ';\n'))
+
+    assert 'xfade=transition=fade:duration=1.000000:offset=9.000000' in graph['filter_complex']
+    assert 'xfade=transition=slideleft:duration=2.000000:offset=17.000000' in graph['filter_complex']
+    assert graph['video_label'] == 'vx2'
+    assert graph['audio_label'] == 'ax2'
+    assert abs(graph['duration'] - 27.0) < 1e-6
+    print("✅ 转场偏移量正确")
+
+
+def test_filter_graph_conform_and_silence():
+    """尺寸不同的片段加边统一，无音轨的片段补静音"""
+    sources = [source_info('a.mp4', 5.0), source_info('b.mp4', 5.0, size=(720, 1280), has_audio=False)]
+
+    graph = build_filter_graph(sources, [{'type': 'fade', 'duration': 1.0}])
+
+    assert 'force_original_aspect_ratio=decrease,pad=1280:720' in graph['filter_complex']
+    assert 'anullsrc' in graph['filter_complex']
+    print("✅ 尺寸统一和静音补齐正确")
+
+
+def test_trimmed_sources():
+    """裁剪点在输入端生效（-ss/-t 位于 -i 之前），转场偏移按保留部分的时长计算"""
+    sources = [trim_source(source_info('a.mp4', 60.0), 50.0, 55.0), trim_source(source_info('b.mp4', 10.0), 2.0),
+               trim_source(source_info('c.mp4', 10.0), 0.0, 30.0)]
+    assert sources[0]['duration'] == 5.0 and sources[1]['duration'] == 8.0
+    assert 'trim_start' not in sources[2] and sources[2]['duration'] == 10.0
+    with pytest.raises(ValueError):
+        trim_source(source_info('a.mp4', 5.0), 5.0)
+
+    cmd, graph = FilterGraphEngine(ffmpeg_binary='ffmpeg').build_command(
+        sources, [{'type': 'fade', 'duration': 1.0}] * 2, 'out.mp4')
+    inputs = ' '.join(cmd[cmd.index('-nostdin') + 1:cmd.index('-filter_complex')])
+    assert inputs == ('-ss 50.000000 -t 5.000000 -i a.mp4 -ss 2.000000 -t 8.000000 -i b.mp4 -i c.mp4'), inputs
+    assert 'xfade=transition=fade:duration=1.000000:offset=4.000000' in graph['filter_complex']
+    assert abs(graph['duration'] - 21.0) < 1e-6
+    print("✅ 片段裁剪正确")
+
+
+def test_audio_gain():
+    """响度归一化的增益在对应片段的音频链中生效，无音轨的片段仍补静音"""
+    sources = [dict(source_info('a.mp4', 5.0), gain_db=-3.5), dict(source_info('b.mp4', 5.0), gain_db=0.0),
+               dict(source_info('c.mp4', 5.0, has_audio=False), gain_db=6.0)]
+
+    graph = build_filter_graph(sources, [{'type': 'fade', 'duration': 1.0}] * 2)
+
+    chains = graph['filter_complex'].split(';')
+    assert 'volume=-3.50dB' in next(chain for chain in chains if chain.startswith('[0:a]'))
+    assert 'volume' not in next(chain for chain in chains if chain.startswith('[1:a]'))
+    assert graph['filter_complex'].count('volume=') == 1
+    print("✅ 音频增益正确")
+
+
+def test_unsupported_transitions():
+    """xfade 无法表达的转场需要回退到 moviepy"""
+    assert unsupported_transitions([{'type': 'fade'}, {'type': 'zoom_in'}]) == []
+    assert unsupported_transitions([{'type': 'zoom_out'}]) == ['zoom_out']
+    print("✅ 回退判断正确")
+
+
+def test_pad_color_injection_rejected():
+    """填充颜色不能携带额外的滤镜"""
+    sources = [source_info('a.mp4', 5.0), source_info('b.mp4', 5.0, size=(640, 480))]
+    for color in ('black,movie=/etc/passwd', 'black[x];[x]null', 'red:t=fill'):
+        with pytest.raises(ValueError):
+            build_filter_graph(sources, [{'type': 'fade'}], pad_color=color)
+    assert 'color=#FF8800' in build_filter_graph(sources, [{'type': 'fade'}], pad_color='#FF8800')['filter_complex']
+    print("✅ 填充颜色注入被拦截")
+
+
+def test_progress_with_verbose_stderr():
+    """读取进度时 stderr 大量输出不会让 ffmpeg 阻塞"""
+    engine = FilterGraphEngine()
+    # showinfo 每帧输出一行日志，总量远超管道缓冲区
+    cmd = [engine.ffmpeg_binary, '-y', '-loglevel', 'info', '-nostdin',
+           '-f', 'lavfi', '-i', 'testsrc2=size=64x64:rate=50:duration=10', '-vf', 'showinfo', '-f', 'null', '-']
+    progress = []
+    returncode, stderr = engine._run_with_progress(cmd, 10.0, lambda value, stage: progress.append(value))
+    print(f"stderr: {len(stderr)} 字节, 进度回调: {len(progress)} 次")
+    assert returncode == 0
+    assert len(stderr) > 65536
+    assert progress and progress[-1] == 1.0
+    print("✅ stderr 输出不阻塞进度读取")
+
+
+
+def test_resolve_ffmpeg_binary(monkeypatch):
+    """ffmpeg 路径只解析检查一次，不可用时给出明确错误"""
+    resolve_ffmpeg_binary.cache_clear()
+    binary = resolve_ffmpeg_binary()
+    assert os.access(binary, os.X_OK)
+    calls = []
+    monkeypatch.setattr(ffmpeg_engine.sp, 'run', lambda *args, **kwargs: calls.append(args))
+    assert resolve_ffmpeg_binary() == binary and not calls
+
+    monkeypatch.undo()
+    monkeypatch.setattr(moviepy.config, 'get_setting', lambda name: '/nonexistent/ffmpeg')
+    resolve_ffmpeg_binary.cache_clear()
+    try:
+        with pytest.raises(RuntimeError, match='ffmpeg 不可用: /nonexistent/ffmpeg'):
+            resolve_ffmpeg_binary()
+    finally:
+        resolve_ffmpeg_binary.cache_clear()
+    print("✅ ffmpeg 路径检查正确")
+
+
+if __name__ == "__main__":
+    test_filter_graph_offsets()
+    test_filter_graph_conform_and_silence()
+    test_trimmed_sources()
+    test_audio_gain()
+    test_unsupported_transitions()
+    test_pad_color_injection_rejected()
+    test_progress_with_verbose_stderr()
@@ -0,0 +1,133 @@
+"""
+测试共享内存环形缓冲区（用 Python 子进程代替 ffmpeg 输出定长帧）
+"""
+
+import logging
+import os
+import sys
+import time
+
+from frame_transport import FrameRing, RingDecoder
+from test_logger_config import capture_logs
+
+FRAME_BYTES = 16
+
+
+def _producer(frames, then=''):
+    """输出 frames 帧（第 i 帧的每个字节都是 i）后执行 then 的命令"""
+    script = ("import os, sys\n"
+              f"for i in range({frames}):\n"
+              f"    sys.stdout.buffer.write(bytes([i]) * {FRAME_BYTES})\n"
+              "sys.stdout.buffer.flush()\n" + then)
+    return [sys.executable, '-c', script]
+
+
+def _shm_names():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+def _frame(ring, slot):
+    offset = ring.frame_offset(slot)
+    return bytes(ring.shm.buf[offset:offset + ring.frame_bytes])
+
+
+def test_ring_wraparound():
+    """帧数超过槽位数时循环使用槽位，按顺序读出每一帧，结束后返回 None"""
+    before = _shm_names()
+    ring = FrameRing(FRAME_BYTES, slots=3)
+    decoder = RingDecoder(ring, _producer(10))
+    try:
+        slots = []
+        for index in range(10):
+            slot = decoder.next_slot()
+            slots.append(slot)
+            assert _frame(ring, slot) == bytes([index]) * FRAME_BYTES
+        assert slots == [0, 1, 2] * 3 + [0]
+        assert decoder.next_slot() is None and decoder.next_slot() is None
+    finally:
+        decoder.stop()
+        ring.close()
+    assert _shm_names() - before == set()
+    print("✅ 环形缓冲区循环使用槽位")
+
+
+def test_slow_consumer():
+    """合成持有的槽位在读取下一帧之前不会被覆盖，读取线程最多领先槽位数减一帧"""
+    ring = FrameRing(FRAME_BYTES, slots=2)
+    decoder = RingDecoder(ring, _producer(6))
+    try:
+        for index in range(6):
+            slot = decoder.next_slot()
+            time.sleep(0.1)
+            assert _frame(ring, slot) == bytes([index]) * FRAME_BYTES
+        assert decoder.next_slot() is None
+    finally:
+        decoder.stop()
+        ring.close()
+    print("✅ 慢速读取时帧不被覆盖")
+
+
+def test_producer_dies():
+    """解码进程中途退出：已写好的帧照常读出，之后按结束处理并记录退出码；被终止时不阻塞"""
+    before = _shm_names()
+    ring = FrameRing(FRAME_BYTES)
+    with capture_logs(logging.Formatter('%(message)s')) as lines:
+        decoder = RingDecoder(ring, _producer(2, then=f"sys.stdout.buffer.write(b'x' * {FRAME_BYTES // 2})\n"
+                                                      "sys.stdout.buffer.flush()\nos._exit(3)\n"))
+        try:
+            assert [_frame(ring, decoder.next_slot())[0] for _ in range(2)] == [0, 1]
+            assert decoder.next_slot() is None
+        finally:
+            decoder.stop()
+    assert any('退出码: 3' in line for line in lines), lines
+
+    decoder = RingDecoder(ring, _producer(1, then="import time\ntime.sleep(60)\n"))
+    try:
+        assert _frame(ring, decoder.next_slot())[0] == 0
+        decoder.process.kill()
+        assert decoder.next_slot() is None
+    finally:
+        decoder.stop()
+        ring.close()
+    assert decoder.process.poll() is not None
+    assert _shm_names() - before == set()
+    print("✅ 解码进程退出后正常结束")
+
+
+def test_reader_error_raised():
+    """读取线程出错时取帧抛出 IOError，而不是一直等待"""
+    ring = FrameRing(FRAME_BYTES)
+    ring.shm.close()
+    decoder = RingDecoder(ring, _producer(3))
+    try:
+        decoder.next_slot()
+    except IOError as e:
+        assert '读取解码输出失败' in str(e)
+    else:
+        raise AssertionError('读取线程出错时应抛出 IOError')
+    finally:
+        decoder.stop()
+        ring.shm.unlink()
+    print("✅ 读取线程的错误被抛出")
+
+
+def test_close_with_live_view():
+    """关闭时仍有视图未释放：记录警告，名称照常删除，视图释放后解除映射"""
+    before = _shm_names()
+    ring = FrameRing(FRAME_BYTES)
+    view = ring.shm.buf[:FRAME_BYTES]
+    with capture_logs(logging.Formatter('%(message)s')) as lines:
+        ring.close()
+    assert any('帧视图未释放' in line for line in lines), lines
+    assert _shm_names() - before == set()
+    view.release()
+    ring.shm.close()
+    print("✅ 未释放的帧视图被记录")
+
+
+if __name__ == "__main__":
+    test_ring_wraparound()
+    test_slow_consumer()
+    test_producer_dies()
+    test_reader_error_raised()
+    test_close_with_live_view()
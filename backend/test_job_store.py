@@ -0,0 +1,55 @@
+"""
+测试合成任务持久化
+"""
+
+import os
+import tempfile
+import time
+
+from job_store import JobStore
+from render_jobs import STARTED, SUCCESS, FAILURE
+
+
+def test_job_lifecycle():
+    """任务登记、完成和失败后的状态"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, 'jobs.db'))
+        store.create('a', {'video_files': ['x.mp4']}, 'web-1')
+        job = store.get('a')
+        assert job['state'] == STARTED and job['payload'] == {'video_files': ['x.mp4']}
+        assert job['owner'] == 'web-1' and job['attempts'] == 1
+
+        store.complete('a', {'output_filename': 'out.mp4'})
+        assert store.get('a')['state'] == SUCCESS
+        assert store.get('a')['result'] == {'output_filename': 'out.mp4'}
+        assert store.renew('a', 'web-1') is False
+        assert store.get('missing') is None
+        print("✅ 任务状态持久化正确")
+
+
+def test_claim_interrupted():
+    """租约过期的任务被接管一次；持续续期的任务不会被接管；多次中断后标记失败"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, 'jobs.db'), lease_seconds=0.3, max_attempts=2)
+        store.create('dead', {'n': 1}, 'web-1')
+        store.create('alive', {'n': 2}, 'web-2')
+        with store.lease('alive', 'web-2'):
+            time.sleep(0.5)
+            assert store.claim_interrupted('web-3')['id'] == 'dead'
+            # 已被接管的任务在新租约内不会再被领取
+            assert store.claim_interrupted('web-4') is None
+        assert store.get('dead')['owner'] == 'web-3' and store.get('dead')['attempts'] == 2
+        # 原进程已失去任务，续期失败
+        assert store.renew('dead', 'web-1') is False
+
+        # 接管者也退出：达到最大运行次数，标记失败
+        time.sleep(0.4)
+        claimed = store.claim_interrupted('web-4')
+        assert claimed['id'] == 'alive'
+        assert store.get('dead')['state'] == FAILURE
+        print("✅ 中断任务接管正确")
+
+
+if __name__ == "__main__":
+    test_job_lifecycle()
+    test_claim_interrupted()
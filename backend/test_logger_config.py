@@ -0,0 +1,77 @@
+"""
+测试日志格式和上下文
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+
+from logger_config import (
+    AppLoggers, JSONFormatter, ColoredFormatter, _ContextFilter, log_context, log_span, record_span
+)
+
+
+@contextmanager
+def capture_logs(formatter=None):
+    """把根日志器的记录按指定格式收集到列表（默认 JSON，解析为字典）"""
+    lines = []
+    formatter = formatter or JSONFormatter()
+
+    class Collector(logging.Handler):
+        def emit(self, record):
+            lines.append(formatter.format(record))
+
+    handler = Collector()
+    handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    try:
+        yield lines
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(level)
+
+
+def test_json_lines():
+    """JSON 格式每行带上下文字段和结构化字段，span 记录父路径和耗时"""
+    with capture_logs() as lines:
+        with log_context(request_id='req-1'):
+            AppLoggers.API.info("上传 %d 个文件", 2, extra={'fields': {'bytes_in': 1024}})
+            with log_context(job_id='job-1'), log_span('compose', clips=2) as span:
+                with log_span('encode'):
+                    pass
+                record_span('transition', 0.25, type='fade')
+                span['engine'] = 'moviepy'
+        AppLoggers.API.info("上下文已结束")
+
+    entries = [json.loads(line) for line in lines]
+    assert entries[0]['message'] == '上传 2 个文件' and entries[0]['module'] == 'API'
+    assert entries[0]['request_id'] == 'req-1' and entries[0]['bytes_in'] == 1024
+    assert 'job_id' not in entries[0]
+
+    spans = {entry['span']: entry for entry in entries if 'span' in entry}
+    assert set(spans) == {'compose', 'compose/encode', 'compose/transition'}
+    assert spans['compose/encode']['parent_span'] == 'compose'
+    assert spans['compose']['parent_span'] is None
+    assert spans['compose/transition']['duration_ms'] == 250
+    assert spans['compose']['engine'] == 'moviepy' and spans['compose']['clips'] == 2
+    assert all(entry['job_id'] == 'job-1' and entry['request_id'] == 'req-1' for entry in spans.values())
+    assert 'request_id' not in entries[-1]
+    print("✅ JSON 日志正确")
+
+
+def test_text_format_keeps_module_prefix():
+    formatter = ColoredFormatter(fmt='%(levelname)s | %(message)s')
+    with capture_logs(formatter) as lines:
+        AppLoggers.COMPOSE.info("开始合成 | %s", '成功')
+        logging.getLogger('werkzeug').warning('原始日志')
+    assert lines[0].endswith('| [合成] 开始合成 | 成功')
+    assert lines[1].endswith('| 原始日志')
+    print("✅ 文本日志格式不变")
+
+
+if __name__ == "__main__":
+    test_json_lines()
+    test_text_format_keeps_module_prefix()
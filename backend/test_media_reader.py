@@ -0,0 +1,140 @@
+"""
+测试关键帧索引和按索引定位的视频读取
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from benchmark import get_ffmpeg_binary
+from ffmpeg_engine import probe_keyframes
+from media_reader import ConformedVideoFileClip, keyframe_before
+from render_options import FRAME_TRANSPORTS
+from test_logger_config import capture_logs
+
+
+def _clip_with_gop(work_dir, gop, duration=6, fps=25):
+    """生成固定 GOP、关闭场景切换关键帧的测试视频"""
+    path = os.path.join(work_dir, f'gop{gop}.mp4')
+    subprocess.run([
+        get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=160x120:rate={fps}:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0', path
+    ], check=True)
+    return path
+
+
+def test_keyframe_before():
+    """二分查找不晚于目标时间的最后一个关键帧"""
+    keyframes = [0.0, 2.0, 4.0]
+    assert keyframe_before(keyframes, 0) == 0.0
+    assert keyframe_before(keyframes, 1.99) == 0.0
+    assert keyframe_before(keyframes, 2.0) == 2.0
+    assert keyframe_before(keyframes, 5.5) == 4.0
+    assert keyframe_before([0.5], 0.2) == 0.0
+    print("✅ 关键帧查找正确")
+
+
+def test_probe_keyframes():
+    """按 GOP 间隔列出关键帧时间"""
+    with tempfile.TemporaryDirectory() as tmp:
+        keyframes = probe_keyframes(_clip_with_gop(tmp, 50))
+        print(f"关键帧: {keyframes}")
+        assert keyframes == [0.0, 2.0, 4.0]
+    print("✅ 关键帧索引正确")
+
+
+def test_seek_with_keyframes_matches_default():
+    """使用关键帧索引定位读到的帧与 moviepy 默认定位一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _clip_with_gop(tmp, 50)
+        keyframes = probe_keyframes(path)
+        indexed = ConformedVideoFileClip(path, keyframes=keyframes, audio=False)
+        default = ConformedVideoFileClip(path, audio=False)
+        try:
+            # 依次覆盖：首次定位、跨关键帧的向后跳转、同一 GOP 内的向后跳转、向前回退
+            for t in (3.0, 4.4, 5.2, 1.0, 1.04):
+                assert np.array_equal(indexed.get_frame(t), default.get_frame(t)), t
+        finally:
+            indexed.close()
+            default.close()
+    print("✅ 关键帧定位结果正确")
+
+
+def test_shared_memory_transport_matches_pipe():
+    """共享内存传输读到的帧与管道传输一致，帧只读，关闭后不残留共享内存"""
+    before = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _clip_with_gop(tmp, 50, duration=4)
+        keyframes = probe_keyframes(path)
+        shared = ConformedVideoFileClip(path, keyframes=keyframes, audio=False, frame_transport='shared_memory')
+        pipe = ConformedVideoFileClip(path, keyframes=keyframes, audio=False)
+        try:
+            # 顺序读取、跳帧、跨关键帧定位、回退，以及读到末尾后重复最后一帧
+            for t in (0.0, 0.04, 0.08, 0.5, 2.6, 1.0, 3.96, 5.0):
+                frame = shared.get_frame(t)
+                assert np.array_equal(frame, pipe.get_frame(t)), t
+            assert not frame.flags.writeable
+            count = sum(1 for _ in shared.iter_frames())
+            assert count == sum(1 for _ in pipe.iter_frames()) == 100, count
+            # 关闭前释放持有的帧视图，共享内存随即解除映射
+            del frame
+        finally:
+            with capture_logs(logging.Formatter('%(message)s')) as lines:
+                shared.close()
+            pipe.close()
+        assert not [line for line in lines if '帧视图未释放' in line], lines
+    if os.path.isdir('/dev/shm'):
+        assert set(os.listdir('/dev/shm')) - before == set()
+    print("✅ 共享内存帧传输结果正确")
+
+
+def test_trimmed_reader():
+    """裁剪后的片段从入点开始、到出点结束，帧与未裁剪片段对应时间的帧一致；入点从最近的关键帧开始解码"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _clip_with_gop(tmp, 25, duration=6)
+        keyframes = probe_keyframes(path)
+        full = ConformedVideoFileClip(path, keyframes=keyframes, audio=False)
+        clips = [ConformedVideoFileClip(path, keyframes=keyframes, audio=False, start=2.4, end=4.0,
+                                        frame_transport=transport) for transport in FRAME_TRANSPORTS]
+        try:
+            for trimmed in clips:
+                assert abs(trimmed.duration - 1.6) < 1e-6
+                command = trimmed.reader._decode_command(0)
+                assert command[command.index('-i') - 1] == '2.000000' and '-t' in command
+                for t in (0.0, 0.04, 0.8, 1.56, 0.2):
+                    assert np.array_equal(trimmed.get_frame(t), full.get_frame(2.4 + t)), t
+                assert sum(1 for _ in trimmed.iter_frames()) == 40
+        finally:
+            for clip in clips + [full]:
+                clip.close()
+        try:
+            ConformedVideoFileClip(path, start=6.0)
+        except ValueError as e:
+            assert '入点' in str(e)
+        else:
+            raise AssertionError('入点超出时长时应报错')
+    print("✅ 片段裁剪读取正确")
+
+
+def test_invalid_frame_transport():
+    try:
+        ConformedVideoFileClip('unused.mp4', frame_transport='socket')
+    except ValueError as e:
+        assert 'socket' in str(e)
+    else:
+        raise AssertionError('应拒绝未知的帧传输方式')
+    print("✅ 未知帧传输方式被拒绝")
+
+
+if __name__ == "__main__":
+    test_keyframe_before()
+    test_probe_keyframes()
+    test_seek_with_keyframes_matches_default()
+    test_shared_memory_transport_matches_pipe()
+    test_trimmed_reader()
+    test_invalid_frame_transport()
@@ -0,0 +1,56 @@
+"""
+测试指标模块（目录占用的后台统计）
+"""
+
+import os
+import tempfile
+import time
+
+import metrics
+from metrics import AppMetrics, refresh_directory_usage, watch_directory
+
+
+def _scraped(gauge):
+    """抓取一次，返回 {directory: 值}"""
+    return {labels.split('"')[1]: value for _, labels, value in gauge.samples()}
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_disk_usage_refreshed_in_background():
+    """抓取时只读取上次的统计结果，过期后在后台重新统计"""
+    original_dirs = dict(metrics._watched_dirs)
+    original_ttl = metrics.DISK_USAGE_TTL
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics._watched_dirs.clear()
+            with open(os.path.join(tmp, 'a.bin'), 'wb') as f:
+                f.write(b'x' * 100)
+            watch_directory('media', tmp)
+            # 登记后立即在后台开始统计
+            _wait_for(lambda: _scraped(AppMetrics.DISK_USAGE_BYTES).get('media') == 100)
+
+            # 未过期：新增的文件不会被统计，抓取不遍历目录
+            os.makedirs(os.path.join(tmp, 'sub'))
+            with open(os.path.join(tmp, 'sub', 'b.bin'), 'wb') as f:
+                f.write(b'x' * 50)
+            assert _scraped(AppMetrics.DISK_USAGE_FILES)['media'] == 1
+
+            # 过期后由抓取触发后台统计
+            metrics.DISK_USAGE_TTL = 0
+            _wait_for(lambda: _scraped(AppMetrics.DISK_USAGE_FILES).get('media') == 2)
+            assert refresh_directory_usage() == {'media': (150, 2)}
+    finally:
+        metrics.DISK_USAGE_TTL = original_ttl
+        metrics._watched_dirs.clear()
+        metrics._watched_dirs.update(original_dirs)
+    print("✅ 目录占用在后台统计")
+
+
+if __name__ == "__main__":
+    test_disk_usage_refreshed_in_background()
@@ -0,0 +1,131 @@
+"""
+测试渲染成本估算和准入控制
+"""
+
+import os
+import tempfile
+
+import render_cost
+from benchmark import generate_clip
+from conftest import source_info
+from metrics import AppMetrics
+from render_cost import RenderCostModel, admission_decision, cached_keyframes, cached_probe, plan_timeline
+from state_store import MemoryStateStore
+
+
+def test_plan_timeline():
+    """输出时长扣除转场重叠，转场帧数按类型汇总"""
+    timeline = plan_timeline([source_info('x.mp4', 10), source_info('x.mp4', 10), source_info('x.mp4', 10)],
+                             [{'type': 'fade', 'duration': 1.0}, {'type': 'fade', 'duration': 2.0}])
+    assert abs(timeline['duration'] - 27.0) < 1e-6
+    assert timeline['frames'] == 675
+    assert timeline['transition_frames'] == {'fade': 75}
+    print("✅ 时间线计算正确")
+
+
+def test_estimate_and_calibration():
+    """估算随历史任务的实际耗时校准"""
+    model = RenderCostModel(MemoryStateStore())
+    sources = [source_info('x.mp4', 10), source_info('x.mp4', 10)]
+    transitions = [{'type': 'zoom_out', 'duration': 1.0}]
+
+    before = model.estimate(None, transitions, engine='ffmpeg', sources=sources)
+    # ffmpeg 无法表达 zoom_out，按 moviepy 估算
+    assert before['engine'] == 'moviepy'
+    assert 'zoom_out' in before['breakdown']['transitions']
+
+    # 实际渲染比先验值慢得多，多次校准后估算上升
+    stats = {'engine': 'moviepy', 'output_frames': 475, 'output_size': (1280, 720),
+             'transition_seconds': {'zoom_out': 20.0}, 'transition_frames': {'zoom_out': 25}}
+    for _ in range(5):
+        model.observe(stats, elapsed=100.0)
+    after = model.estimate(None, transitions, sources=sources)
+    print(f"校准前: {before['estimated_seconds']}秒, 校准后: {after['estimated_seconds']}秒")
+    assert after['estimated_seconds'] > before['estimated_seconds'] * 2
+    assert after['calibration_samples'] == 5
+    print("✅ 估算校准正确")
+
+
+def test_calibration_reproduces_observed_time():
+    """估算与校准对转场帧的划分一致：大量同类任务之后估算收敛到实际耗时"""
+    model = RenderCostModel(MemoryStateStore())
+    sources = [source_info('x.mp4', 10), source_info('x.mp4', 10)]
+    transitions = [{'type': 'fade', 'duration': 1.0}]
+    plan = model.estimate(None, transitions, sources=sources)
+    stats = {'engine': 'moviepy', 'output_frames': plan['output_frames'], 'output_size': (1280, 720),
+             'transition_seconds': {'fade': 6.0}, 'transition_frames': plan['transition_frames']}
+    for _ in range(200):
+        model.observe(stats, elapsed=30.0)
+    estimate = model.estimate(None, transitions, sources=sources)
+    assert abs(estimate['estimated_seconds'] - 30.0) < 0.5
+    assert abs(estimate['breakdown']['transitions']['fade'] - 6.0) < 0.2
+    print("✅ 校准后估算收敛到实际耗时")
+
+
+def test_rendition_estimate():
+    """额外输出按编码工作量计入估算，校准时扣除，不影响基础速率"""
+    model = RenderCostModel(MemoryStateStore())
+    sources = [source_info('x.mp4', 20)]
+    plain = model.estimate(None, [], sources=sources)
+    with_renditions = model.estimate(None, [], sources=sources, renditions=[360])
+    extra = plain['output_frames'] * 0.64 * 0.36 * render_cost.RENDITION_ENCODE_RATE
+    assert abs(with_renditions['breakdown']['renditions'] - extra) < 1e-3
+    assert abs(with_renditions['estimated_seconds'] - plain['estimated_seconds'] - extra) < 1e-2
+
+    stats = {'engine': 'moviepy', 'output_frames': plain['output_frames'], 'output_size': (1280, 720),
+             'renditions': [{'height': 360, 'output_path': 'result_360p.mp4'}]}
+    for _ in range(200):
+        model.observe(stats, elapsed=30.0 + extra)
+    assert abs(model.estimate(None, [], sources=sources)['estimated_seconds'] - 30.0) < 0.5
+    print("✅ 额外输出估算正确")
+
+
+def test_probe_cache(monkeypatch):
+    """同一文件只探测一次，文件被替换后重新探测；命中和未命中计入缓存指标"""
+    def lookups():
+        return [AppMetrics.CACHE_REQUESTS.get(cache=cache, result=result)
+                for cache in ('probe', 'keyframes') for result in ('hit', 'miss')]
+
+    before = lookups()
+    calls = []
+    probe = render_cost.probe_source
+    monkeypatch.setattr(render_cost, 'probe_source', lambda path: calls.append(path) or probe(path))
+    store = MemoryStateStore()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_clip(tmp, 160, 120, 1)
+        first = cached_probe(path, store)
+        assert cached_probe(path, store) == first
+        assert first['size'] == (160, 120) and first['has_audio']
+        assert len(calls) == 1
+
+        # 上传时补建关键帧索引，复用已有的探测结果
+        assert cached_keyframes(path, store) is None
+        assert cached_probe(path, store, keyframes=True)['keyframes'] == [0.0]
+        assert cached_keyframes(path, store) == [0.0]
+        assert len(calls) == 1
+
+        os.utime(path, ns=(0, 0))
+        cached_probe(path, store)
+        assert len(calls) == 2
+    # probe 命中 1 次、未命中 3 次（首次、补建索引、文件被替换），keyframes 命中和未命中各 1 次
+    assert [after - start for after, start in zip(lookups(), before)] == [1, 3, 1, 1]
+    print("✅ 探测缓存正确")
+
+
+def test_admission_decision():
+    """积压超过容量时拒绝，并给出重试时间"""
+    assert admission_decision(100, 0, 1, 60)['admit']  # 没有积压时总是接受
+    assert admission_decision(100, 200, 4, 120)['admit']
+    rejected = admission_decision(100, 500, 2, 120)
+    assert not rejected['admit']
+    assert rejected['retry_after'] == 180
+    assert admission_decision(100, 10 ** 6, 1, 0)['admit']  # 0 表示不限制
+    print("✅ 准入判断正确")
+
+
+if __name__ == "__main__":
+    test_plan_timeline()
+    test_estimate_and_calibration()
+    test_calibration_reproduces_observed_time()
+    test_rendition_estimate()
+    test_admission_decision()
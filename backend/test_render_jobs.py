@@ -0,0 +1,197 @@
+"""
+测试 Redis 渲染任务队列
+需要本地 redis-server（默认 redis://localhost:6379/15，可用 TEST_REDIS_URL 指定），不可用时跳过
+"""
+
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+from render_cost import AdmissionRejected
+from render_jobs import RenderQueue, PENDING, STARTED, SUCCESS, FAILURE, CANCELLED
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+
+def _queue(**kwargs):
+    try:
+        queue = RenderQueue(REDIS_URL, namespace=f'test_{uuid.uuid4().hex[:8]}:', **kwargs)
+        queue.client.ping()
+    except Exception as e:
+        pytest.skip(f"Redis 不可用: {e}")
+    return queue
+
+
+def _cleanup(queue):
+    for key in queue.client.scan_iter(match=queue.namespace + '*'):
+        queue.client.delete(key)
+
+
+def test_job_lifecycle():
+    """入队、领取、进度、完成"""
+    queue = _queue()
+    try:
+        job_id = queue.enqueue({'video_files': ['a.mp4', 'b.mp4']}, estimated_seconds=12.5)
+        assert queue.get_job(job_id)['state'] == PENDING
+        assert queue.pending_count() == 1
+        assert queue.backlog_seconds() == 12.5
+
+        job = queue.claim('worker-1')
+        assert job['id'] == job_id
+        assert job['payload'] == {'video_files': ['a.mp4', 'b.mp4']}
+        assert job['attempts'] == 1
+        assert queue.get_job(job_id)['state'] == STARTED
+
+        queue.update_progress(job_id, 0.5, 'encode')
+        status = queue.get_job(job_id)
+        assert status['progress'] == 0.5 and status['stage'] == 'encode'
+
+        queue.complete('worker-1', job_id, {'output_filename': 'out.mp4'})
+        status = queue.get_job(job_id)
+        assert status['state'] == SUCCESS
+        assert status['result'] == {'output_filename': 'out.mp4'}
+        assert queue.client.llen(queue._processing_key('worker-1')) == 0
+        assert queue.running_by_client() == {}
+        assert queue.backlog_seconds() == 0
+        assert queue.claim('worker-1') is None
+        print("✅ 任务生命周期正确")
+    finally:
+        _cleanup(queue)
+
+
+def test_orphaned_job_requeued():
+    """worker 心跳超时后，其手中的任务重新入队；超过重试次数则失败"""
+    queue = _queue(heartbeat_ttl=0.2, max_attempts=2)
+    try:
+        job_id = queue.enqueue({'video_files': ['a.mp4']})
+        queue.heartbeat('worker-dead')
+        queue.claim('worker-dead')
+        queue.heartbeat('worker-alive')
+
+        time.sleep(0.3)
+        queue.heartbeat('worker-alive')
+        assert queue.requeue_orphans() == [job_id]
+        assert queue.get_job(job_id)['state'] == PENDING
+        assert [w['id'] for w in queue.workers()] == ['worker-alive']
+
+        # 第二个 worker 也失联，达到重试上限
+        queue.heartbeat('worker-dead-2')
+        assert queue.claim('worker-dead-2')['attempts'] == 2
+        time.sleep(0.3)
+        assert queue.requeue_orphans() == []
+        status = queue.get_job(job_id)
+        assert status['state'] == FAILURE
+        assert queue.pending_count() == 0
+        print("✅ 失联任务回收正确")
+    finally:
+        _cleanup(queue)
+
+
+def test_priority_and_fair_scheduling():
+    """草稿优先；同优先级内按客户端轮转，且不超过单客户端并发上限"""
+    queue = _queue(client_concurrency=2)
+    try:
+        heavy = [queue.enqueue({'n': i}, client_id='heavy', priority='final') for i in range(5)]
+        light = queue.enqueue({'n': 'light'}, client_id='light', priority='final')
+        draft = queue.enqueue({'n': 'draft'}, client_id='heavy', priority='draft')
+
+        order = []
+        while True:
+            job = queue.claim(f'worker-{len(order)}')
+            if job is None:
+                break
+            order.append(job['id'])
+        print(f"领取顺序: {order}")
+
+        # 草稿先于正式导出；heavy 最多同时运行 2 个（草稿占了一个），light 不被饿死
+        assert order[0] == draft
+        assert set(order[1:]) == {heavy[0], light}
+        assert queue.running_by_client() == {'heavy': 2, 'light': 1}
+        assert queue.pending_count() == 4
+
+        # heavy 的任务结束后，下一个任务才能被领取
+        queue.complete('worker-0', draft, {})
+        assert queue.claim('worker-9')['id'] == heavy[1]
+        print("✅ 优先级和公平调度正确")
+    finally:
+        _cleanup(queue)
+
+
+def test_cancel():
+    """等待中的任务直接取消；运行中的任务设置取消标记"""
+    queue = _queue()
+    try:
+        started = queue.enqueue({'n': 1}, estimated_seconds=30)
+        waiting = queue.enqueue({'n': 2}, estimated_seconds=20)
+        assert queue.claim('worker-1')['id'] == started
+        assert queue.cancel(waiting) == CANCELLED
+        assert queue.get_job(waiting)['state'] == CANCELLED
+        assert queue.pending_count() == 0
+        assert queue.backlog_seconds() == 30
+
+        assert queue.cancel(started) == 'CANCELLING'
+        assert queue.is_cancel_requested(started)
+        queue.mark_cancelled('worker-1', started)
+        assert queue.get_job(started)['state'] == CANCELLED
+        assert queue.cancel(started) == CANCELLED
+        assert queue.backlog_seconds() == 0
+        assert queue.cancel('missing') is None
+        assert queue.running_by_client() == {}
+        print("✅ 任务取消正确")
+    finally:
+        _cleanup(queue)
+
+
+def test_wait_for_change():
+    """长轮询在状态变化时立即返回，状态不变时等到超时"""
+    queue = _queue()
+    try:
+        job_id = queue.enqueue({'video_files': ['a.mp4']})
+        start = time.monotonic()
+        assert queue.wait_for_change(job_id, PENDING, timeout=0.3)['state'] == PENDING
+        assert time.monotonic() - start >= 0.3
+
+        threading.Timer(0.2, queue.claim, args=('worker-1',)).start()
+        start = time.monotonic()
+        assert queue.wait_for_change(job_id, PENDING, timeout=5)['state'] == STARTED
+        assert time.monotonic() - start < 2
+
+        # 调用方看到的状态已过时：立即返回
+        assert queue.wait_for_change(job_id, PENDING, timeout=5)['state'] == STARTED
+        assert queue.wait_for_change('missing', PENDING, timeout=5) is None
+        print("✅ 任务状态长轮询正确")
+    finally:
+        _cleanup(queue)
+
+
+def test_enqueue_admission():
+    """积压工作量超过上限时拒绝入队，任务结束后容量归还"""
+    queue = _queue()
+    try:
+        # 没有积压时即使超过上限也接受
+        first = queue.enqueue({'n': 1}, estimated_seconds=80, capacity_seconds=60)
+        with pytest.raises(AdmissionRejected) as rejected:
+            queue.enqueue({'n': 2}, estimated_seconds=10, capacity_seconds=60)
+        assert rejected.value.backlog_seconds == 80
+        assert queue.pending_count() == 1
+
+        queue.claim('worker-1')
+        queue.fail('worker-1', first, 'boom')
+        assert queue.backlog_seconds() == 0
+        queue.enqueue({'n': 3}, estimated_seconds=10, capacity_seconds=60)
+        assert queue.backlog_seconds() == 10
+        print("✅ 入队准入控制正确")
+    finally:
+        _cleanup(queue)
+
+
+if __name__ == "__main__":
+    test_job_lifecycle()
+    test_orphaned_job_requeued()
+    test_priority_and_fair_scheduling()
+    test_cancel()
+    test_wait_for_change()
+    test_enqueue_admission()
@@ -0,0 +1,76 @@
+"""
+测试共享状态存储
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from state_store import MemoryStateStore, SQLiteStateStore, create_state_store
+
+
+def _increment(path, times):
+    store = SQLiteStateStore(path)
+    for _ in range(times):
+        store.hincr('metrics:test', {'["a"]': 1, '["b"]': 0.5})
+
+
+def test_memory_store():
+    """进程内存储的基本读写和过期"""
+    store = MemoryStateStore()
+    store.set('job:1', {'status': 'queued'})
+    store.set('job:2', 'tmp', ttl=-1)
+    store.hincr('metrics:x', {'f': 2})
+    store.hincr('metrics:x', {'f': 3})
+
+    assert store.get('job:1') == {'status': 'queued'}
+    assert store.get('job:2') is None
+    assert store.hgetall('metrics:x') == {'f': 5}
+    print("✅ 进程内存储正确")
+
+
+def test_reservations():
+    """预留原子地检查容量，单独过期，释放后归还容量"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in (MemoryStateStore(), SQLiteStateStore(os.path.join(tmp, 'state.db'))):
+            # 没有预留时总是接受
+            assert store.reserve('backlog', 'a', 100, 60, ttl=60) == (True, 0)
+            assert store.reserve('backlog', 'b', 10, 60, ttl=60) == (False, 100)
+            assert store.reserve('backlog', 'c', 10, None, ttl=0.1) == (True, 100)
+            assert store.reserved('backlog') == 110
+
+            time.sleep(0.2)
+            assert store.reserved('backlog') == 100
+            store.release('backlog', 'a')
+            assert store.reserved('backlog') == 0
+            assert store.reserve('backlog', 'b', 10, 60, ttl=60) == (True, 0)
+    print("✅ 容量预留正确")
+
+
+def test_sqlite_store_shared_across_processes():
+    """多个进程并发累加同一个哈希，结果不丢失"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'state.db')
+        store = create_state_store(f'sqlite:///{path}')
+        store.hset('metrics:test', {'["c"]': 'label'})
+
+        ctx = multiprocessing.get_context('spawn')
+        workers = [ctx.Process(target=_increment, args=(path, 50)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        values = store.hgetall('metrics:test')
+        print(f"累加结果: {values}")
+        assert values['["a"]'] == 150
+        assert abs(values['["b"]'] - 75.0) < 1e-9
+        assert values['["c"]'] == 'label'
+        print("✅ SQLite 存储跨进程共享正确")
+
+
+if __name__ == "__main__":
+    test_memory_store()
+    test_reservations()
+    test_sqlite_store_shared_across_processes()
@@ -0,0 +1,53 @@
+"""
+测试转场预览缓存
+"""
+
+import os
+import tempfile
+import time
+
+from transition_preview import TransitionPreviewCache, preview_cache_key
+
+
+def test_preview_cache_key():
+    """缺省字段按默认值计，任何影响画面的参数变化都得到不同的键"""
+    digests = [('a' * 64, 0.0, 5.0), ('b' * 64, 0.0, 8.0)]
+    key = preview_cache_key(digests, {}, 240, 1.0)
+    assert key == preview_cache_key(digests, {'type': 'fade', 'duration': 1}, 240, 1.0)
+    assert key != preview_cache_key(digests[::-1], {}, 240, 1.0)
+    assert key != preview_cache_key([digests[0], ('b' * 64, 2.0, 6.0)], {}, 240, 1.0)
+    assert key != preview_cache_key(digests, {'type': 'zoom_in'}, 240, 1.0)
+    assert key != preview_cache_key(digests, {}, 360, 1.0)
+    assert key != preview_cache_key(digests, {}, 240, 1.0, fit_mode='cover')
+    print("✅ 预览缓存键正确")
+
+
+def test_preview_cache_eviction():
+    """超过上限时淘汰最久未使用的预览，命中会刷新使用时间"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TransitionPreviewCache(tmp, max_entries=2)
+        rendered = []
+
+        def render(path):
+            rendered.append(path)
+            with open(path, 'wb') as f:
+                f.write(b'mp4')
+
+        keys = [f'{i:064x}' for i in range(3)]
+        for index, key in enumerate(keys[:2]):
+            assert cache.get_or_render(key, render) == (cache.path(key), False)
+            past = time.time() - 100 + index
+            os.utime(cache.path(key), (past, past))
+
+        # 命中第一个，第二个成为最久未使用，渲染第三个时被淘汰
+        assert cache.get_or_render(keys[0], render) == (cache.path(keys[0]), True)
+        cache.get_or_render(keys[2], render)
+        assert len(rendered) == 3
+        assert cache.lookup(keys[0]) and cache.lookup(keys[2]) and cache.lookup(keys[1]) is None
+        assert cache.path('../x') is None and cache.lookup('../x') is None
+        print("✅ 预览缓存淘汰正确")
+
+
+if __name__ == "__main__":
+    test_preview_cache_key()
+    test_preview_cache_eviction()
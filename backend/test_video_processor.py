@@ -2,28 +2,38 @@
 测试视频处理器功能
 """
 
+import json
 import os
-from video_processor import VideoProcessor, TransitionEffect
+import struct
+import subprocess
+import tempfile
+from advanced_video_processor import AdvancedVideoProcessor
+from benchmark import generate_clip
+from ffmpeg_engine import probe_source
 
 def test_video_processor():
     """测试视频处理器基本功能"""
-    processor = VideoProcessor()
+    processor = AdvancedVideoProcessor(output_dir=tempfile.mkdtemp())
     
     print("=== 视频处理器测试 ===")
     
     # 测试转场效果类型
     print("\n可用的转场效果:")
     effects = [
-        TransitionEffect.FADE,
-        TransitionEffect.SLIDE_LEFT,
-        TransitionEffect.SLIDE_RIGHT,
-        TransitionEffect.ZOOM_IN,
-        TransitionEffect.ZOOM_OUT
+        "fade",
+        "slide_left",
+        "slide_right",
+        "slide_up",
+        "slide_down",
+        "zoom_in",
+        "zoom_out"
     ]
     
     for effect in effects:
         print(f"  - {effect}")
     
+    assert processor.last_render_stats == {}
+    
     print("\n✅ 视频处理器初始化成功")
     print("✅ 转场效果定义正常")
     
@@ -39,6 +49,169 @@ def test_video_processor():
     else:
         print("❌ 上传目录不存在")
 
+def test_renditions():
+    """一次合成同时输出多个分辨率，两个引擎结果一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = [generate_clip(tmp, 640, 360, 2, index=i) for i in range(2)]
+        for engine in ('moviepy', 'ffmpeg'):
+            processor = AdvancedVideoProcessor(output_dir=os.path.join(tmp, engine))
+            output_path = processor.compose_videos_advanced(
+                clips, [{'type': 'fade', 'duration': 0.5}], output_filename='result.mp4',
+                engine=engine, renditions=[240, 144]
+            )
+            stats = processor.last_render_stats
+            assert stats['engine'] == engine
+            assert [output['height'] for output in stats['renditions']] == [240, 144]
+
+            main = probe_source(output_path)
+            assert main['size'] == (640, 360) and main['has_audio']
+            for output, size in zip(stats['renditions'], [(426, 240), (256, 144)]):
+                assert output['output_path'] == os.path.join(tmp, engine, f"result_{output['height']}p.mp4")
+                info = probe_source(output['output_path'])
+                assert info['size'] == size and info['has_audio']
+                assert abs(info['duration'] - main['duration']) < 0.1
+            print(f"✅ {engine} 引擎多分辨率输出正确")
+
+
+def test_checkpoint_resume():
+    """分段检查点：重新运行时跳过已完成的分段，结果与完整渲染一致，输出目录不留临时文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = [generate_clip(tmp, 320, 240, 2, index=i) for i in range(2)]
+        transitions = [{'type': 'fade', 'duration': 0.5}]
+        output_dir = os.path.join(tmp, 'outputs')
+        checkpoint_dir = os.path.join(tmp, 'checkpoints')
+
+        reference = AdvancedVideoProcessor(output_dir=output_dir).compose_videos_advanced(
+            clips, list(transitions), output_filename='reference.mp4')
+
+        processor = AdvancedVideoProcessor(output_dir=output_dir, checkpoint_dir=checkpoint_dir, segment_seconds=1)
+        processor.compose_videos_advanced(clips, list(transitions), output_filename='result.mp4', renditions=[144])
+        assert processor.last_render_stats['resumed_segments'] == 0
+        with open(os.path.join(checkpoint_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        assert manifest['done'] == [0, 1, 2, 3]
+
+        # 模拟在第 3 个分段编码时中断：只有前两个分段完成
+        manifest['done'] = [0, 1]
+        with open(os.path.join(checkpoint_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.remove(os.path.join(output_dir, 'result.mp4'))
+
+        processor = AdvancedVideoProcessor(output_dir=output_dir, checkpoint_dir=checkpoint_dir, segment_seconds=1)
+        output_path = processor.compose_videos_advanced(clips, list(transitions), output_filename='result.mp4',
+                                                        renditions=[144])
+        assert processor.last_render_stats['resumed_segments'] == 2
+
+        expected, result = probe_source(reference), probe_source(output_path)
+        assert result['size'] == expected['size'] and result['has_audio']
+        assert abs(result['duration'] - expected['duration']) < 0.05, (result['duration'], expected['duration'])
+        assert abs(probe_source(os.path.join(output_dir, 'result_144p.mp4'))['duration'] - expected['duration']) < 0.05
+        assert sorted(os.listdir(output_dir)) == ['reference.mp4', 'result.mp4', 'result_144p.mp4']
+        print("✅ 分段检查点续渲正确")
+
+
+def test_shared_memory_transport():
+    """共享内存帧传输的合成结果与管道传输一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = [generate_clip(tmp, 320, 240, 2, index=i) for i in range(2)]
+        results = {}
+        for transport in ('pipe', 'shared_memory'):
+            processor = AdvancedVideoProcessor(output_dir=os.path.join(tmp, transport), frame_transport=transport)
+            results[transport] = probe_source(processor.compose_videos_advanced(
+                clips, [{'type': 'slide_left', 'duration': 0.5}], output_filename='result.mp4'))
+        expected, result = results['pipe'], results['shared_memory']
+        assert result['size'] == expected['size'] and result['has_audio']
+        assert abs(result['duration'] - expected['duration']) < 0.05, (result['duration'], expected['duration'])
+
+        try:
+            AdvancedVideoProcessor(output_dir=tmp, frame_transport='socket')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('应拒绝未知的帧传输方式')
+        print("✅ 共享内存帧传输合成正确")
+
+
+def test_trimmed_clips():
+    """带裁剪点的片段与转场组合，两个引擎的输出时长一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = [generate_clip(tmp, 320, 240, 4, index=i) for i in range(2)]
+        video_files = [{'file': clips[0], 'in': 1.0, 'out': 2.5}, {'file': clips[1], 'in': 0.5}]
+        for engine in ('moviepy', 'ffmpeg'):
+            processor = AdvancedVideoProcessor(output_dir=os.path.join(tmp, engine))
+            output_path = processor.compose_videos_advanced(
+                video_files, [{'type': 'fade', 'duration': 0.4}], output_filename='result.mp4', engine=engine)
+            assert processor.last_render_stats['engine'] == engine
+            # 1.5 + 3.5 - 0.4
+            assert abs(processor.last_render_stats['output_duration'] - 4.6) < 1e-6
+            info = probe_source(output_path)
+            assert abs(info['duration'] - 4.6) < 0.1, (engine, info['duration'])
+            assert info['has_audio']
+        print("✅ 片段裁剪合成正确")
+
+
+def test_loudness_normalization():
+    """指定目标响度时，音量差很大的片段合成后整体接近目标响度"""
+    from audio_analysis import analyze_audio
+    from ffmpeg_engine import resolve_ffmpeg_binary
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = generate_clip(tmp, 320, 240, 3)
+        quiet = os.path.join(tmp, 'quiet.mp4')
+        subprocess.run([resolve_ffmpeg_binary(), '-y', '-loglevel', 'error', '-i', clip,
+                        '-c:v', 'copy', '-af', 'volume=-15dB', '-c:a', 'aac', quiet], check=True)
+        for engine in ('moviepy', 'ffmpeg'):
+            processor = AdvancedVideoProcessor(output_dir=os.path.join(tmp, engine))
+            output_path = processor.compose_videos_advanced(
+                [clip, quiet], [{'type': 'fade', 'duration': 0.5}], output_filename='result.mp4',
+                engine=engine, loudness_target=-20.0)
+            gains = processor.last_render_stats['loudness_gains_db']
+            assert abs(gains[1] - gains[0] - 15) < 1, gains
+            analysis = analyze_audio(output_path, probe_source(output_path)['duration'])
+            assert abs(analysis['integrated_lufs'] + 20) < 1.5, (engine, analysis['integrated_lufs'])
+            # 前后两段的峰值接近
+            peaks = analysis['peaks']
+            half = len(peaks) // 2
+            assert abs(max(peaks[5:half - 20]) - max(peaks[half + 20:-5])) < 0.15 * max(peaks), engine
+        print("✅ 响度归一化合成正确")
+
+
+def _top_level_boxes(path):
+    """MP4 顶层 box 的类型序列"""
+    boxes = []
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return boxes
+            size, kind = struct.unpack('>I4s', header)
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0] - 8
+            boxes.append(kind.decode('ascii'))
+            f.seek(size - 8, os.SEEK_CUR)
+
+
+def test_mp4_layout():
+    """faststart/fragmented 输出的 moov 在媒体数据之前，standard 在末尾"""
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = [generate_clip(tmp, 320, 240, 2, index=i) for i in range(2)]
+        for engine in ('moviepy', 'ffmpeg'):
+            processor = AdvancedVideoProcessor(output_dir=os.path.join(tmp, engine))
+            for layout in ('faststart', 'fragmented', 'standard'):
+                boxes = _top_level_boxes(processor.compose_videos_advanced(
+                    clips, [{'type': 'fade', 'duration': 0.5}], output_filename=f'{layout}.mp4',
+                    engine=engine, mp4_layout=layout
+                ))
+                print(f"{engine} {layout}: {boxes}")
+                first_media = min(boxes.index(kind) for kind in ('mdat', 'moof') if kind in boxes)
+                if layout == 'standard':
+                    assert boxes.index('moov') > first_media
+                else:
+                    assert boxes.index('moov') < first_media
+                assert ('moof' in boxes) == (layout == 'fragmented')
+            print(f"✅ {engine} 引擎 MP4 封装方式正确")
+
+
 def test_api_endpoints():
     """测试 API 端点"""
     import requests
@@ -77,6 +250,12 @@ def test_api_endpoints():
 
 if __name__ == "__main__":
     test_video_processor()
+    test_renditions()
+    test_mp4_layout()
+    test_checkpoint_resume()
+    test_shared_memory_transport()
+    test_trimmed_clips()
+    test_loudness_normalization()
     test_api_endpoints()
     
     print("\n=== 使用说明 ===")
@@ -0,0 +1,134 @@
+"""
+测试任务结束回调（本地 HTTP 服务模拟接收方）
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from webhooks import callback_url_error, configure_callbacks, deliver_callback, is_valid_callback_url, send_callback
+
+
+class CallbackReceiver:
+    """记录收到的回调，前 failures 次返回 status；接收方在本机，测试期间把 127.0.0.1 加入允许列表"""
+
+    def __init__(self, failures=0, status=503):
+        self.requests = []
+        self.received = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                receiver.requests.append((dict(self.headers), body))
+                failed = len(receiver.requests) <= failures
+                self.send_response(status if failed else 204)
+                self.end_headers()
+                if not failed:
+                    receiver.received.set()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hook'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        configure_callbacks(['127.0.0.1'])
+
+    def close(self):
+        configure_callbacks()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_callback_url_validation():
+    """格式不对、解析到内网或保留地址的回调地址被拒绝"""
+    configure_callbacks()
+    assert is_valid_callback_url('https://93.184.216.34/hook')
+    for url in ('ftp://example.com/hook', 'example.com/hook', 'http://', '', None, 42,
+                'http://127.0.0.1:8080/hook?x=1', 'http://169.254.169.254/latest/meta-data/',
+                'http://10.0.0.5/hook', 'http://192.168.1.1/hook', 'http://[::1]/hook',
+                'http://[::ffff:127.0.0.1]/hook', 'http://0.0.0.0/hook', 'http://224.0.0.1/hook',
+                'http://localhost/hook'):
+        assert not is_valid_callback_url(url), url
+    assert '解析到内网或保留地址' in callback_url_error('http://169.254.169.254/latest/meta-data/')
+
+    # 允许列表：只接受列表中的主机，内网接收方需要显式加入
+    configure_callbacks(['127.0.0.1', 'Hooks.Internal.'])
+    try:
+        assert is_valid_callback_url('http://127.0.0.1:8080/hook')
+        assert callback_url_error('https://93.184.216.34/hook') == '回调主机不在允许列表中: 93.184.216.34'
+    finally:
+        configure_callbacks()
+    print("✅ 回调地址校验正确")
+
+
+def test_callback_checked_at_delivery():
+    """投递时重新校验地址：提交后主机被移出允许列表（或 DNS 变化）时不再连接，也不重试"""
+    receiver = CallbackReceiver()
+    try:
+        configure_callbacks()
+        delays = []
+        assert deliver_callback(receiver.url, {'task_id': 'job-5', 'state': 'SUCCESS'},
+                                sleep=delays.append) is False
+        assert receiver.requests == [] and delays == []
+    finally:
+        receiver.close()
+    print("✅ 投递时拒绝内网地址")
+
+
+def test_callback_retries_with_backoff():
+    """5xx 按指数退避重试直到成功"""
+    receiver = CallbackReceiver(failures=2, status=503)
+    delays = []
+    try:
+        body = {'task_id': 'job-1', 'state': 'SUCCESS', 'result': {'output_filename': 'out.mp4'}}
+        assert deliver_callback(receiver.url, body, attempts=5, backoff=0.5, sleep=delays.append) is True
+    finally:
+        receiver.close()
+    assert delays == [0.5, 1.0]
+    assert [headers['X-Callback-Attempt'] for headers, _ in receiver.requests] == ['1', '2', '3']
+    assert all(request_body == body for _, request_body in receiver.requests)
+    assert receiver.requests[0][0]['X-Task-Id'] == 'job-1'
+    print("✅ 回调失败后按指数退避重试")
+
+
+def test_callback_gives_up():
+    """4xx 不重试；接收方不可达时重试到上限"""
+    receiver = CallbackReceiver(failures=10, status=400)
+    try:
+        assert deliver_callback(receiver.url, {'task_id': 'job-2', 'state': 'FAILURE'},
+                                sleep=lambda _: None) is False
+        assert len(receiver.requests) == 1
+    finally:
+        receiver.close()
+
+    delays = []
+    configure_callbacks(['127.0.0.1'])
+    try:
+        assert deliver_callback(receiver.url, {'task_id': 'job-3', 'state': 'FAILURE'}, attempts=3,
+                                backoff=1, timeout=1, sleep=delays.append) is False
+    finally:
+        configure_callbacks()
+    assert delays == [1, 2]
+    print("✅ 回调重试上限正确")
+
+
+def test_send_callback_in_background():
+    receiver = CallbackReceiver()
+    try:
+        assert send_callback(None, 'job-4', 'SUCCESS') is None
+        thread = send_callback(receiver.url, 'job-4', 'FAILURE', error='boom')
+        thread.join(5)
+        assert receiver.requests[0][1] == {'task_id': 'job-4', 'state': 'FAILURE', 'error': 'boom'}
+    finally:
+        receiver.close()
+    print("✅ 后台投递回调")
+
+
+if __name__ == "__main__":
+    test_callback_url_validation()
+    test_callback_checked_at_delivery()
+    test_callback_retries_with_backoff()
+    test_callback_gives_up()
+    test_send_callback_in_background()
@@ -0,0 +1,113 @@
+"""
+转场预览缓存
+转场预览按 (两个片段的内容哈希和裁剪点, 转场配置, 预览参数) 缓存在输出目录下的 .previews 目录中，
+在界面上来回切换转场类型时命中缓存的请求不需要渲染。缓存键只依赖文件内容，同一素材重复上传也能命中；
+超过 max_entries 个预览时按最近使用时间淘汰。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import AppMetrics
+
+# 缓存的预览数上限
+PREVIEW_CACHE_ENTRIES = 200
+# 预览的渲染方式变化时递增，旧的缓存自然失效
+PREVIEW_CACHE_VERSION = 1
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# 同一进程内同一个键只渲染一次；跨进程时可能重复渲染，结果原子替换，不影响正确性
+_LOCK_STRIPES = 64
+
+
+def preview_cache_key(clips: List[Tuple[str, float, float]], transition: Dict[str, Any], height: int,
+                      padding: float, fit_mode: str = 'contain', pad_color: str = 'black') -> str:
+    """
+    预览的缓存键
+
+    Args:
+        clips: 每个片段的 (内容哈希, 入点, 保留时长)，没有裁剪时入点为 0、时长为整个视频
+        transition: 转场配置，省略的字段按默认值计，{} 与 {'type': 'fade'} 是同一个预览
+    """
+    material = {
+        'version': PREVIEW_CACHE_VERSION,
+        'clips': [[digest, round(float(start), 6), round(float(duration), 6)] for digest, start, duration in clips],
+        'type': transition.get('type', 'fade'),
+        'duration': float(transition.get('duration', 1.0)),
+        'height': height,
+        'padding': float(padding),
+        'fit_mode': fit_mode,
+        'pad_color': pad_color,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class TransitionPreviewCache:
+    """按内容寻址的转场预览文件缓存"""
+
+    def __init__(self, directory: str, max_entries: int = PREVIEW_CACHE_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def path(self, key: str) -> Optional[str]:
+        """预览文件路径，键不合法时返回 None"""
+        if not isinstance(key, str) or not _KEY_PATTERN.match(key):
+            return None
+        return os.path.join(self.directory, f"{key}.mp4")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """命中时返回预览文件路径并刷新其使用时间"""
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_render(self, key: str, render: Callable[[str], Any]) -> Tuple[str, bool]:
+        """
+        读取缓存的预览，未命中时调用 render(path) 渲染到 path
+
+        Returns:
+            (预览文件路径, 是否命中缓存)
+        """
+        path = self.lookup(key)
+        if path is None:
+            with self._locks[int(key[:8], 16) % _LOCK_STRIPES]:
+                # 等锁期间其他请求可能已经渲染完成
+                path = self.lookup(key)
+                if path is None:
+                    path = self.path(key)
+                    render(path)
+                    self.prune()
+                    AppMetrics.TRANSITION_PREVIEWS.inc(cache='miss')
+                    return path, False
+        AppMetrics.TRANSITION_PREVIEWS.inc(cache='hit')
+        return path, True
+
+    def prune(self) -> int:
+        """淘汰最久未使用的预览，返回删除的文件数"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.mp4') and _KEY_PATTERN.match(name[:-4]):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        removed = 0
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
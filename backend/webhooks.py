@@ -0,0 +1,242 @@
+"""
+任务结束回调
+合成任务结束（成功、失败或取消）后，向提交时指定的 callback_url 发送一次 JSON POST，
+客户端不必轮询任务状态。投递在后台线程中进行，不阻塞渲染；网络错误、超时、5xx、408 和 429
+按指数退避重试，其他 4xx 视为接收方拒绝，不再重试。
+
+回调地址由客户端指定，为防止借回调访问内网服务（SSRF），提交时和每次投递建立连接时都解析主机名，
+回环、私有、链路本地（含云主机元数据地址 169.254.169.254）、保留和组播地址一律拒绝。
+投递时直接连接校验过的地址，不经过环境变量中的 HTTP 代理，重定向同样按此校验。
+接收方部署在内网时，把它的主机名加入 CALLBACK_ALLOWED_HOSTS：配置后只接受列表中的主机，
+且不再检查它们解析出的地址。
+"""
+
+import http.client
+import ipaddress
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from logger_config import AppLoggers
+from metrics import AppMetrics
+
+logger = AppLoggers.COMPOSE
+
+# 最多投递次数，第 n 次失败后等待 CALLBACK_BACKOFF * 2^(n-1) 秒再重试
+CALLBACK_ATTEMPTS = 5
+CALLBACK_BACKOFF = 2.0
+CALLBACK_TIMEOUT = 10.0
+
+_RETRY_STATUSES = (408, 429)
+
+# 进行中的投递线程，进程退出前等待它们结束
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+# 允许的回调主机，为空时接受任何解析到公网地址的主机
+_allowed_hosts = frozenset()
+
+
+class CallbackAddressError(OSError):
+    """回调地址解析到了不允许访问的地址"""
+
+
+def configure_callbacks(allowed_hosts: Iterable[str] = ()) -> None:
+    """设置允许的回调主机（CALLBACK_ALLOWED_HOSTS），Web 进程和渲染 worker 启动时调用"""
+    global _allowed_hosts
+    _allowed_hosts = frozenset(host.strip().lower().rstrip('.') for host in allowed_hosts if host.strip())
+
+
+def _is_public_address(address: str) -> bool:
+    """是否是可以从服务端访问的公网地址"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not (ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_reserved
+                or ip.is_multicast or ip.is_unspecified or not ip.is_global)
+
+
+def resolve_callback_host(host: str, port: int) -> List[str]:
+    """
+    解析回调主机，返回可以连接的地址
+
+    Raises:
+        CallbackAddressError: 主机不在允许列表中，或解析到了不允许访问的地址
+        OSError: 解析失败
+    """
+    host = host.lower().rstrip('.')
+    if _allowed_hosts and host not in _allowed_hosts:
+        raise CallbackAddressError(f"回调主机不在允许列表中: {host}")
+    addresses = []
+    for *_, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        if sockaddr[0] not in addresses:
+            addresses.append(sockaddr[0])
+    if not _allowed_hosts:
+        blocked = [address for address in addresses if not _is_public_address(address)]
+        if blocked:
+            raise CallbackAddressError(f"回调主机 {host} 解析到内网或保留地址: {', '.join(blocked)}")
+    return addresses
+
+
+def callback_url_error(url: Any) -> Optional[str]:
+    """校验回调地址，合法时返回 None，否则返回原因"""
+    if not isinstance(url, str):
+        return "callback_url 必须是字符串"
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return f"callback_url 必须是 http(s) 地址: {url}"
+    try:
+        resolve_callback_host(parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+    except CallbackAddressError as e:
+        return str(e)
+    except (OSError, ValueError) as e:
+        return f"无法解析回调主机 {parsed.hostname}: {e}"
+    return None
+
+
+def is_valid_callback_url(url: Any) -> bool:
+    """带主机名的 http/https 地址，且主机解析到允许访问的地址"""
+    return callback_url_error(url) is None
+
+
+def _guarded_connection(address, timeout, source_address=None):
+    """建立连接前重新解析并校验主机（DNS 可能在提交后变化），只连接校验过的地址"""
+    host, port = address
+    error = None
+    for ip in resolve_callback_host(host, port):
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error or OSError(f"无法连接回调主机: {host}")
+
+
+class _GuardedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _guarded_connection
+
+
+class _GuardedHTTPSConnection(http.client.HTTPSConnection):
+    # HTTPS 在校验过的 TCP 连接上握手，证书仍按主机名验证
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _guarded_connection
+
+
+class _GuardedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_GuardedHTTPConnection, req)
+
+
+class _GuardedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_GuardedHTTPSConnection, req, context=self._context)
+
+
+# 不使用环境变量中的代理：经代理转发时服务端无法校验目标地址
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _GuardedHTTPHandler, _GuardedHTTPSHandler)
+
+
+def callback_body(task_id: str, state: str, result: Optional[Dict[str, Any]] = None,
+                  error: Optional[str] = None) -> Dict[str, Any]:
+    """回调请求体，字段与 /api/task/<task_id> 的响应一致"""
+    body = {'task_id': task_id, 'state': state}
+    if result is not None:
+        body['result'] = result
+    if error is not None:
+        body['error'] = error
+    return body
+
+
+def deliver_callback(url: str, body: Dict[str, Any], attempts: int = CALLBACK_ATTEMPTS,
+                     backoff: float = CALLBACK_BACKOFF, timeout: float = CALLBACK_TIMEOUT,
+                     sleep: Callable[[float], None] = time.sleep) -> bool:
+    """
+    投递回调（阻塞），失败时按指数退避重试
+
+    Returns:
+        是否投递成功（接收方返回 2xx）
+    """
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    for attempt in range(1, attempts + 1):
+        request = urllib.request.Request(url, data=data, method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-Task-Id': body['task_id'],
+            'X-Callback-Attempt': str(attempt),
+        })
+        try:
+            with _opener.open(request, timeout=timeout):
+                pass
+            AppMetrics.COMPOSE_CALLBACKS.inc(status='delivered')
+            logger.info(f"回调已送达 | 任务: {body['task_id']} | 第 {attempt} 次投递")
+            return True
+        except urllib.error.HTTPError as e:
+            error = f"HTTP {e.code}"
+            retryable = e.code >= 500 or e.code in _RETRY_STATUSES
+        except urllib.error.URLError as e:
+            error = str(e.reason)
+            # 地址校验失败不重试；解析失败等网络错误重试
+            retryable = not isinstance(e.reason, CallbackAddressError)
+        except CallbackAddressError as e:
+            error = str(e)
+            retryable = False
+        except OSError as e:
+            error = str(e)
+            retryable = True
+
+        if not retryable or attempt == attempts:
+            AppMetrics.COMPOSE_CALLBACKS.inc(status='failed')
+            logger.warning(f"回调投递失败 | 任务: {body['task_id']} | 第 {attempt} 次投递 | {error}")
+            return False
+        delay = backoff * 2 ** (attempt - 1)
+        logger.info(f"回调投递失败，{delay:.1f}秒后重试 | 任务: {body['task_id']} | {error}")
+        sleep(delay)
+    return False
+
+
+def send_callback(url: Optional[str], task_id: str, state: str, result: Optional[Dict[str, Any]] = None,
+                  error: Optional[str] = None) -> Optional[threading.Thread]:
+    """
+    在后台线程中投递任务结束回调，未指定 url 时什么也不做
+
+    Returns:
+        投递线程，未指定 url 时为 None
+    """
+    if not url:
+        return None
+    body = callback_body(task_id, state, result, error)
+
+    def run():
+        try:
+            deliver_callback(url, body)
+        finally:
+            with _pending_lock:
+                _pending.discard(thread)
+
+    thread = threading.Thread(target=run, name=f'callback-{task_id}', daemon=True)
+    with _pending_lock:
+        _pending.add(thread)
+    thread.start()
+    return thread
+
+
+def wait_for_callbacks(timeout: float) -> int:
+    """
+    等待进行中的回调投递结束，进程退出前调用
+
+    Returns:
+        超时后仍未结束的投递数
+    """
+    deadline = time.monotonic() + timeout
+    with _pending_lock:
+        threads = list(_pending)
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    return sum(thread.is_alive() for thread in threads)
@@ -0,0 +1,8 @@
+"""
+WSGI 入口
+供 gunicorn 等生产服务器加载: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import create_app
+
+app = create_app()
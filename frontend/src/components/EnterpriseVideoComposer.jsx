@@ -219,6 +219,27 @@ const EnterpriseVideoComposer = () => {
     }
   };
 
+  const waitForTask = async (taskId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      const response = await fetch(`http://localhost:5000/api/task/${taskId}`);
+      const task = await response.json();
+      if (!response.ok) {
+        return { status: 'error', error: task.error };
+      }
+      if (task.state === 'SUCCESS') {
+        return { status: 'success', result: task.result };
+      }
+      if (task.state === 'FAILURE') {
+        return { status: 'error', error: task.error };
+      }
+      if (task.state === 'CANCELLED') {
+        return { status: 'error', error: '任务已取消' };
+      }
+      setProcessingProgress(Math.min(task.current, 99));
+    }
+  };
+
   const handleCompose = async () => {
     if (uploadedVideos.length < 2) {
       message.error('至少需要2个视频文件才能合成');
@@ -263,8 +284,14 @@ const EnterpriseVideoComposer = () => {
         }),
       });
 
-      const data = await response.json();
+      let data = await response.json();
       console.log('合成响应:', data);
+
+      // 后端启用渲染队列时返回任务ID，轮询任务状态直到完成
+      if (data.status === 'queued') {
+        clearInterval(progressInterval);
+        data = await waitForTask(data.task_id);
+      }
       
       clearInterval(progressInterval);
       setProcessingProgress(100);